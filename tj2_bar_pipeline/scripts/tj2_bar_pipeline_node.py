@@ -9,13 +9,11 @@ import numpy as np
 
 import tf2_ros
 import tf_conversions
-import tf2_geometry_msgs
 
 from sensor_msgs.msg import Image
 from sensor_msgs.msg import CameraInfo
 
 from geometry_msgs.msg import Pose
-from geometry_msgs.msg import PoseStamped
 from geometry_msgs.msg import Point
 
 from visualization_msgs.msg import MarkerArray
@@ -28,6 +26,9 @@ from std_msgs.msg import ColorRGBA
 from tj2_networktables.msg import NTEntry
 
 from tj2_tools.robot_state import Pose2d
+from tj2_tools.transforms import transform_to_matrix, transform_points, project_pixels_to_rays
+from tj2_tools.pipeline import StageTimings
+from tj2_tools.pipeline.replay import NullPublisher
 
 import ctypes
 # a thread gets killed improperly within CvBridge without this causing segfaults
@@ -37,38 +38,45 @@ from cv_bridge import CvBridge, CvBridgeError
 
 
 class TJ2BarPipeline(object):
-    def __init__(self):
+    def __init__(self, offline_params=None):
+        """
+        :param offline_params: if not None, run without a ROS master. Parameters are read from this dict
+        """
         self.node_name = "tj2_bar_pipeline"
-        rospy.init_node(
-            self.node_name
-            # disable_signals=True
-            # log_level=rospy.DEBUG
-        )
+        self.offline_params = offline_params
+        self.offline = offline_params is not None
+        if not self.offline:
+            rospy.init_node(
+                self.node_name
+                # disable_signals=True
+                # log_level=rospy.DEBUG
+            )
         self.bridge = CvBridge()
 
-        self.min_distance = rospy.get_param("~min_distance", 0.5)
-        self.max_distance = rospy.get_param("~max_distance", 5.0)
-        self.contour_perimeter_threshold = rospy.get_param("~contour_perimeter_threshold", 200)
-        self.line_angle_lower_threshold = rospy.get_param("~line_angle_lower_threshold", math.pi / 4)
-        self.line_angle_upper_threshold = rospy.get_param("~line_angle_upper_threshold", 3 * math.pi / 4)
-        self.hough_lines_rho = rospy.get_param("~hough_lines_rho", 1.1)
-        self.hough_lines_theta = rospy.get_param("~hough_lines_theta", math.pi / 360.0)
-        self.hough_lines_threshold = rospy.get_param("~hough_lines_threshold", 100)
-        self.hough_lines_min_length = rospy.get_param("~hough_lines_min_length", 100)
-        self.hough_lines_max_gap = rospy.get_param("~hough_lines_max_gap", 100)
-        self.bar_z_lower_threshold = rospy.get_param("~bar_z_lower_threshold", 0.5)
-        self.bar_z_upper_threshold = rospy.get_param("~bar_z_upper_threshold", 5.0)
-        self.z_outlier_stddev = rospy.get_param("~z_outlier_stddev", 3.0)
-        self.line_mask_width = rospy.get_param("~line_mask_width", 1)
-
-        self.roi_left = rospy.get_param("~roi_left", 0)
-        self.roi_top = rospy.get_param("~roi_top", 20)
-        self.roi_right = rospy.get_param("~roi_right", 0)
-        self.roi_bottom = rospy.get_param("~roi_bottom", 20)
-
-        self.depth_topic = rospy.get_param("~depth_topic", "depth/image_raw")
-        self.info_topic = rospy.get_param("~info_topic", "depth/camera_info")
-        self.base_link_frame = rospy.get_param("~base_link_frame", "base_link")
+        self.min_distance = self.get_param("~min_distance", 0.5)
+        self.max_distance = self.get_param("~max_distance", 5.0)
+        self.contour_perimeter_threshold = self.get_param("~contour_perimeter_threshold", 200)
+        self.line_angle_lower_threshold = self.get_param("~line_angle_lower_threshold", math.pi / 4)
+        self.line_angle_upper_threshold = self.get_param("~line_angle_upper_threshold", 3 * math.pi / 4)
+        self.hough_lines_rho = self.get_param("~hough_lines_rho", 1.1)
+        self.hough_lines_theta = self.get_param("~hough_lines_theta", math.pi / 360.0)
+        self.hough_lines_threshold = self.get_param("~hough_lines_threshold", 100)
+        self.hough_lines_min_length = self.get_param("~hough_lines_min_length", 100)
+        self.hough_lines_max_gap = self.get_param("~hough_lines_max_gap", 100)
+        self.bar_z_lower_threshold = self.get_param("~bar_z_lower_threshold", 0.5)
+        self.bar_z_upper_threshold = self.get_param("~bar_z_upper_threshold", 5.0)
+        self.z_outlier_stddev = self.get_param("~z_outlier_stddev", 3.0)
+        self.line_mask_width = self.get_param("~line_mask_width", 1)  # cv2.line thickness of the depth sampling mask
+        self.tf_timeout = rospy.Duration(self.get_param("~tf_timeout", 0.02))
+
+        self.roi_left = self.get_param("~roi_left", 0)
+        self.roi_top = self.get_param("~roi_top", 20)
+        self.roi_right = self.get_param("~roi_right", 0)
+        self.roi_bottom = self.get_param("~roi_bottom", 20)
+
+        self.depth_topic = self.get_param("~depth_topic", "depth/image_raw")
+        self.info_topic = self.get_param("~info_topic", "depth/camera_info")
+        self.base_link_frame = self.get_param("~base_link_frame", "base_link")
 
         self.min_distance_mm = int(self.min_distance * 1000.0)
         self.max_distance_mm = int(self.max_distance * 1000.0)
@@ -78,20 +86,33 @@ class TJ2BarPipeline(object):
         self.camera_info = None
 
         self.tf_buffer = tf2_ros.Buffer()
-        self.tf_listener = tf2_ros.TransformListener(self.tf_buffer)
+        if not self.offline:
+            self.tf_listener = tf2_ros.TransformListener(self.tf_buffer)
 
         self.dilate_kernel = np.ones((5, 5), np.uint8)
+        self.stage_timings = StageTimings(self.get_param("~timing_window", 100))
         
-        self.debug_image_pub = rospy.Publisher("bar_pipeline_debug/image_raw", Image, queue_size=1)
-        self.debug_info_pub = rospy.Publisher("bar_pipeline_debug/camera_info", CameraInfo, queue_size=1)
-        self.bar_marker_pub = rospy.Publisher("bar_markers", MarkerArray, queue_size=10)
-        self.nt_pub = rospy.Publisher("nt_passthrough", NTEntry, queue_size=10)
+        self.debug_image_pub = self.make_publisher("bar_pipeline_debug/image_raw", Image, queue_size=1)
+        self.debug_info_pub = self.make_publisher("bar_pipeline_debug/camera_info", CameraInfo, queue_size=1)
+        self.bar_marker_pub = self.make_publisher("bar_markers", MarkerArray, queue_size=10)
+        self.nt_pub = self.make_publisher("nt_passthrough", NTEntry, queue_size=10)
 
-        rospy.Subscriber(self.depth_topic, Image, self.depth_callback, queue_size=1)
-        rospy.Subscriber(self.info_topic, CameraInfo, self.info_callback, queue_size=1)
+        if not self.offline:
+            rospy.Subscriber(self.depth_topic, Image, self.depth_callback, queue_size=1)
+            rospy.Subscriber(self.info_topic, CameraInfo, self.info_callback, queue_size=1)
 
         rospy.loginfo("%s init complete" % self.node_name)
 
+    def get_param(self, name, default):
+        if self.offline:
+            return self.offline_params.get(name.lstrip("~"), default)
+        return rospy.get_param(name, default)
+
+    def make_publisher(self, topic, msg_type, queue_size):
+        if self.offline:
+            return NullPublisher()
+        return rospy.Publisher(topic, msg_type, queue_size=queue_size)
+
     def run(self):
         rospy.spin()
     
@@ -114,7 +135,7 @@ class TJ2BarPipeline(object):
             return
         
         t0 = time.time()
-        bars, debug_image = self.pipeline(cv2_img, self.debug_image_pub.get_num_connections() > 0)
+        bars, debug_image = self.pipeline(cv2_img, self.debug_image_pub.get_num_connections() > 0, msg.header.stamp)
         t1 = time.time()
         rospy.loginfo_throttle(1.0, "Pipeline rate: %0.3f" % (1.0 / (t1 - t0)))
 
@@ -122,10 +143,12 @@ class TJ2BarPipeline(object):
         self.publish_bar_visualization(bars)
         self.publish_debug_image(debug_image)
     
-    def pipeline(self, depth_image, debug=False):
+    def pipeline(self, depth_image, debug=False, stamp=None):
+        t_start = time.perf_counter()
         # constrain depth image to requested range
         threshold, depth_bounded = cv2.threshold(depth_image, self.max_distance_mm, 65535, cv2.THRESH_TOZERO_INV)
         threshold, depth_bounded = cv2.threshold(depth_bounded, self.min_distance_mm, 65535, cv2.THRESH_TOZERO)
+        t_threshold = time.perf_counter()
 
         # convert to 0..255 range so OpenCV algorithms can process it
         # normalized = cv2.normalize(depth_bounded, None, 0, 255, cv2.NORM_MINMAX)
@@ -143,25 +166,46 @@ class TJ2BarPipeline(object):
             )
         else:
             debug_image = None
+        t_normalize = time.perf_counter()
         
         # remove noise from image
         normalized = cv2.medianBlur(normalized, 3)
+        t_median_blur = time.perf_counter()
 
         normalized = cv2.dilate(normalized, self.dilate_kernel, iterations=1)
+        t_dilate = time.perf_counter()
 
         # find contours and generate an image from them
         contours_image, contours = self.contours(normalized, debug_image)
+        t_contours = time.perf_counter()
 
         # identify lines in the image
         lines, hough_debug_image = self.houghlines(contours_image, debug_image)
+        t_houghlines = time.perf_counter()
 
         lines = self.filter_lines(normalized, lines)
+        t_filter_lines = time.perf_counter()
 
         # print("lines: ", lines)
         # print('hough image shape: ', hough_debug_image.shape)
 
         lines, clouds, debug_image = self.hough_line_clouds(depth_bounded, lines, hough_debug_image, debug_image)
-        bars = self.bars_from_cloud(lines, clouds)
+        t_line_clouds = time.perf_counter()
+        bars = self.bars_from_cloud(lines, clouds, stamp)
+        t_end = time.perf_counter()
+
+        self.stage_timings.record_many({
+            "threshold": t_threshold - t_start,
+            "normalize": t_normalize - t_threshold,
+            "median_blur": t_median_blur - t_normalize,
+            "dilate": t_dilate - t_median_blur,
+            "contours": t_contours - t_dilate,
+            "houghlines": t_houghlines - t_contours,
+            "filter_lines": t_filter_lines - t_houghlines,
+            "line_clouds": t_line_clouds - t_filter_lines,
+            "bars_from_cloud": t_end - t_line_clouds,
+            "total": t_end - t_start,
+        })
 
         return bars, debug_image
 
@@ -194,12 +238,10 @@ class TJ2BarPipeline(object):
             b = mid_y - k * mid_x
             left = min(t_slope[2], b_slope[2])
             right = max(t_slope[3], b_slope[3])
-            xs = np.array(list(range(left, right)))
+            xs = np.arange(left, right)
             ys = np.clip(k * xs + b + 0.5, 0, h - 1).astype(np.int32)
-            xs = (xs + 0.5).astype(np.int32)
             grays = normalized[ys, xs]
-            effects = grays > 0
-            ratio = sum(effects) / len(effects)
+            ratio = np.count_nonzero(grays) / len(grays)
             # print('r: ', ratio)
             if ratio > th:
                 # normalized[ys, xs] = 255
@@ -209,7 +251,7 @@ class TJ2BarPipeline(object):
         return filtered_lines
 
     def normalize_depth(self, depth_image):
-        return np.uint8(depth_image.astype(np.float64) * 255 / self.max_distance_mm)
+        return (depth_image.astype(np.float32) * np.float32(255.0 / self.max_distance_mm)).astype(np.uint8)
 
     def publish_debug_image(self, debug_image):
         if debug_image is None:
@@ -315,40 +357,47 @@ class TJ2BarPipeline(object):
 
         self.bar_marker_pub.publish(markers_msg)
 
-    def bars_from_cloud(self, lines, clouds):
-        bars = []  # an array of potential bars in the robot's frame
+    def bars_from_cloud(self, lines, clouds, stamp=None):
+        # an array of potential bars in the robot's frame
         assert len(lines) == len(clouds)
-        for index in range(len(lines)):
-            cloud = clouds[index]
+        if self.camera_model is None:
+            rospy.logwarn("Unable to translate pixel coordinates to camera coordinates. No camera model has been received.")
+            return []
+
+        # two (pixel x, pixel y, Z mm) points per bar
+        fit_points = []
+        for line, cloud in zip(lines, clouds):
             if len(cloud) == 0:
                 continue
-            line = lines[index]
-            bar_coordinates = []
-            for point in self.best_fit_3d(line, cloud):
-                if point is None:
-                    break
-                camera_z = point[2] / 1000.0  # Z values in the point cloud are in mm
-                result = self.pixels_to_camera_frame(point[0], point[1], camera_z)
-                if result is None:
-                    rospy.logwarn("Unable to translate pixel coordinates to camera coordinates. No camera model has been received.")
-                    break
-                camera_x, camera_y = result
-                # print("camera: \t%0.4f\t%0.4f\t%0.4f" % (camera_x, camera_y, camera_z))
-
-                result = self.camera_to_robot_frame(camera_x, camera_y, camera_z, timeout=rospy.Duration(0.02))
-                if result is None:
-                    rospy.logwarn("Unable to translate camera coordinates to robot frame. TF from camera to robot has been received.")
-                    break
-                robot_x, robot_y, robot_z = result
+            fit_points.extend(self.best_fit_3d(line, cloud))
+        if len(fit_points) == 0:
+            return []
 
-                # if not (self.bar_z_lower_threshold <= robot_z <= self.bar_z_upper_threshold):
-                #     break
+        transform = self.lookup_camera_transform(stamp)
+        if transform is None:
+            rospy.logwarn("Unable to translate camera coordinates to robot frame. TF from camera to robot has been received.")
+            return []
 
-                bar_coordinates.append((robot_x, robot_y, robot_z))
-                # bar_coordinates.append((camera_x, camera_y, camera_z))
-            if len(bar_coordinates) == 2:
-                bars.append(bar_coordinates)
-        return bars
+        fit_points = np.array(fit_points, dtype=np.float64)
+        camera_z = fit_points[:, 2] / 1000.0  # Z values in the point cloud are in mm
+        rays = project_pixels_to_rays(self.camera_model, fit_points[:, 0:2])
+        camera_points = np.stack((rays[:, 0] * camera_z, rays[:, 1] * camera_z, camera_z), axis=1)
+        robot_points = transform_points(transform_to_matrix(transform), camera_points)
+
+        return [[tuple(point) for point in bar] for bar in robot_points.reshape((-1, 2, 3)).tolist()]
+
+    def lookup_camera_transform(self, stamp=None):
+        """
+        Camera to base link transform at the frame's stamp, or the latest transform if that isn't available
+        """
+        stamps = [rospy.Time(0)] if stamp is None else [stamp, rospy.Time(0)]
+        for lookup_stamp in stamps:
+            try:
+                return self.tf_buffer.lookup_transform(self.base_link_frame, self.camera_frame, lookup_stamp, self.tf_timeout)
+            except (tf2_ros.LookupException, tf2_ros.ConnectivityException, tf2_ros.ExtrapolationException) as e:
+                error = e
+        rospy.logwarn("Failed to look up %s to %s. %s" % (self.camera_frame, self.base_link_frame, error))
+        return None
 
     def best_fit_3d(self, line, cloud):
         # given a 3d cloud of points, return two 3d points that describes the best
@@ -367,44 +416,40 @@ class TJ2BarPipeline(object):
         return (x1, y1_fit, z1_fit), (x2, y2_fit, z2_fit)
     
     def hough_line_clouds(self, depth_image, lines, hough_debug_image, debug_image):
-        # Using lines generated by houghlines, mask pixels that lay on the line.
-        # For each column in the image, find the average value (pixel values outside the acceptable range).
+        # Rasterize every line into pixel coordinates inside the ROI and gather their depths in one pass.
+        # For each column a line covers, find the average in range depth.
         # Each value in the resulting array is a z distance along the discovered line.
         # Each z value is paired with an x, y coordinate
         # a 2D array describing the point cloud is returned
-        nonzero_mask = depth_image > 0
-        nonzero_mask = np.uint8(nonzero_mask)
-        
+        lines = [line for line in lines if line[2] != line[0]]
+        if len(lines) == 0:
+            return [], [], debug_image
+        height, width = depth_image.shape[0:2]
+        line_indices, xs, ys = self.rasterize_lines(lines, self.line_mask_width, width, height)
+        depths = depth_image[ys, xs]
+
+        if debug_image is not None:
+            nonzero = depths > 0
+            debug_image[ys[nonzero], xs[nonzero], 2] = 255
+
+        in_range = (depths > self.min_distance_mm) & (depths < self.max_distance_mm)
+        # mean depth of each (line, column) pair
+        keys = line_indices[in_range] * width + xs[in_range]
+        counts = np.bincount(keys, minlength=len(lines) * width).reshape((len(lines), width))
+        sums = np.bincount(keys, weights=depths[in_range], minlength=len(lines) * width).reshape((len(lines), width))
+
         clouds = []
         filtered_lines = []
-        
-        total_mask = np.zeros_like(nonzero_mask)
-
-        for line in lines:
+        for index, line in enumerate(lines):
             x1, y1, x2, y2 = line
-            mask_image = np.zeros_like(nonzero_mask)
-            cv2.line(mask_image, (x1, y1), (x2, y2), (255, 255, 255), self.line_mask_width)
-            target_mask = cv2.bitwise_and(mask_image, nonzero_mask)
-            if debug_image is not None:
-                total_mask = cv2.bitwise_or(total_mask, target_mask)
-            
-            masked_depth = cv2.bitwise_and(depth_image, depth_image, mask=target_mask)
-
-            column_sums = masked_depth.sum(axis=0)
-            inrange_count = ((masked_depth > self.min_distance_mm) & (masked_depth < self.max_distance_mm)).sum(axis=0)
-            z_values = np.true_divide(column_sums, inrange_count, where=inrange_count != 0)
-            
-            cloud = []
-            for xn in range(x1, x2):
-                zn = z_values[xn]
-                if not (self.min_distance_mm <= zn < self.max_distance_mm):
-                    continue
-                yn = (y2 - y1) / (x2 - x1) * (xn - x1) + y1
-                cloud.append((xn, yn, zn))
-            if len(cloud) == 0:
+            # thick line caps extend past the end points. Only keep columns along the segment
+            columns = np.flatnonzero(counts[index, min(x1, x2): max(x1, x2)]) + min(x1, x2)
+            if len(columns) == 0:
                 continue
-
-            cloud = np.array(cloud)
+            xn = columns.astype(np.float32)
+            zn = (sums[index, columns] / counts[index, columns]).astype(np.float32)
+            yn = np.float32((y2 - y1) / (x2 - x1)) * (xn - np.float32(x1)) + np.float32(y1)
+            cloud = np.stack((xn, yn, zn), axis=1)
 
             if self.z_outlier_stddev is not None:
                 z_cloud = cloud[:, 2]
@@ -418,52 +463,43 @@ class TJ2BarPipeline(object):
             clouds.append(cloud)
             filtered_lines.append(line)
 
-        if debug_image is not None:
-            masked_debug = cv2.cvtColor(total_mask * 255, cv2.COLOR_GRAY2BGR)
-            masked_debug[:, :, 0] = 0
-            masked_debug[:, :, 1] = 0
-            debug_image = cv2.addWeighted(debug_image, 1.0, masked_debug, 1.0, 0.0)
-
-            # masked_debug = cv2.bitwise_and(debug_image, debug_image, mask=total_mask)
-            # debug_image = cv2.vconcat((masked_debug, hough_debug_image))
-            
         return filtered_lines, clouds, debug_image
-        
-    def pixels_to_camera_frame(self, pixel_x, pixel_y, camera_z):
-        if self.camera_model is None:
-            return None
-        ray = self.camera_model.projectPixelTo3dRay((pixel_x, pixel_y))
-        camera_x = ray[0] * camera_z
-        camera_y = ray[1] * camera_z
-        return camera_x, camera_y
-    
-    def camera_to_robot_frame(self, camera_x, camera_y, camera_z, time_window=None, timeout=None):
-        if time_window is None:
-            time_window = rospy.Time(0)
-        else:
-            time_window = rospy.Time.now() - time_window
-
-        if timeout is None:
-            timeout = rospy.Duration(1.0)
-
-        try:
-            transform = self.tf_buffer.lookup_transform(self.base_link_frame, self.camera_frame, time_window, timeout)
-        except (tf2_ros.LookupException, tf2_ros.ConnectivityException, tf2_ros.ExtrapolationException) as e:
-            rospy.logwarn("Failed to look up %s to %s. %s" % (self.camera_frame, self.base_link_frame, e))
-            return None
-
-        camera_pose = PoseStamped()
-        camera_pose.header.frame_id = self.camera_frame
-        camera_pose.pose.position.x = camera_x
-        camera_pose.pose.position.y = camera_y
-        camera_pose.pose.position.z = camera_z
-        base_link_pose = tf2_geometry_msgs.do_transform_pose(camera_pose, transform)
-        
-        robot_x = base_link_pose.pose.position.x
-        robot_y = base_link_pose.pose.position.y
-        robot_z = base_link_pose.pose.position.z
 
-        return robot_x, robot_y, robot_z
+    def rasterize_lines(self, lines, thickness, width, height):
+        """
+        Pixels covered by line segments drawn thickness pixels wide (same pixels as cv2.line), clipped to the ROI.
+        Returns arrays of line index, x, and y for each pixel
+        """
+        line_indices, xs, ys = self.draw_line_pixels(np.array(lines, dtype=np.int32).reshape((-1, 4)), thickness, width, height)
+        in_roi = (
+            (xs >= self.roi_left) & (xs < width - self.roi_right) &
+            (ys >= self.roi_top) & (ys < height - self.roi_bottom)
+        )
+        return line_indices[in_roi], xs[in_roi], ys[in_roi]
+
+    def draw_line_pixels(self, lines, thickness, width, height):
+        # Draw each line with cv2.line into a crop around its bounding box instead of a full frame mask.
+        # Thick lines are filled polygons with round caps, about thickness + 2 pixels across
+        thickness = max(thickness, 1)
+        line_indices = []
+        xs = []
+        ys = []
+        for index, (x1, y1, x2, y2) in enumerate(lines.tolist()):
+            left = max(min(x1, x2) - thickness, 0)
+            top = max(min(y1, y2) - thickness, 0)
+            right = min(max(x1, x2) + thickness + 1, width)
+            bottom = min(max(y1, y2) + thickness + 1, height)
+            if right <= left or bottom <= top:
+                continue
+            crop = np.zeros((bottom - top, right - left), dtype=np.uint8)
+            cv2.line(crop, (x1 - left, y1 - top), (x2 - left, y2 - top), 1, thickness)
+            crop_ys, crop_xs = np.nonzero(crop)
+            line_indices.append(np.full(len(crop_xs), index))
+            xs.append(crop_xs + left)
+            ys.append(crop_ys + top)
+        if len(line_indices) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(line_indices), np.concatenate(xs), np.concatenate(ys)
 
     def grab_contours(self, cnts):
         # if the length the contours tuple returned by cv2.findContours
@@ -498,7 +534,8 @@ class TJ2BarPipeline(object):
             if perimeter < self.contour_perimeter_threshold:
                 continue
             cv2.drawContours(contour_image, [contour], -1, (255, 255, 255), 1)
-            cv2.drawContours(debug_image, [contour], -1, (255, 0, 255), 1)
+            if debug_image is not None:
+                cv2.drawContours(debug_image, [contour], -1, (255, 0, 255), 1)
         
         return contour_image, contours
 
@@ -516,8 +553,8 @@ class TJ2BarPipeline(object):
         )
         result = []
         if lines is not None:
-            for hough_line in lines:
-                line = hough_line[0]
+            # (N, 1, 4) in OpenCV 4, (N, 4) in newer versions
+            for line in lines.reshape((-1, 4)):
                 x1, y1, x2, y2 = line
                 angle = math.atan2(y2 - y1, x2 - x1)
                 if not (self.line_angle_lower_threshold < angle < self.line_angle_upper_threshold or
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Replay depth frames through TJ2BarPipeline without a ROS master and report frames/s,
+per-stage p50/p99 latencies, and the bars found in each frame as JSON.
+
+    ./tj2_bar_pipeline_replay.py --bag match.bag
+    ./tj2_bar_pipeline_replay.py --depths depth/ --param hough_lines_threshold=80 --param line_mask_width=3
+
+Frames are loaded into memory before timing starts. The camera to base link transform is identity.
+"""
+import os
+import json
+import time
+import argparse
+
+import cv2
+import rospy
+
+from tj2_tools.pipeline.replay import add_depth_source_arguments, load_depth_source, set_identity_transform, replay, summarize_timings
+from tj2_bar_pipeline_node import TJ2BarPipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tj2_bar_pipeline offline on recorded depth frames")
+    add_depth_source_arguments(parser, "/camera/depth/image_rect_raw", "/camera/depth/camera_info")
+    parser.add_argument("--debug", action="store_true", help="also draw the debug image (included in timings)")
+    parser.add_argument("--debug-dir", default="", help="write debug images to this directory after timing. Implies --debug")
+    args = parser.parse_args()
+
+    # use wall clock time for rospy.Time.now() without a master
+    rospy.rostime.set_rostime_initialized(True)
+
+    images, info_msg = load_depth_source(parser, args)
+    debug = args.debug or bool(args.debug_dir)
+
+    params = dict(timing_window=len(images))
+    params.update(dict(args.param))
+    node = TJ2BarPipeline(offline_params=params)
+    node.info_callback(info_msg)
+    set_identity_transform(node.tf_buffer, node.base_link_frame, node.camera_frame)
+
+    def process(depth_image):
+        return node.pipeline(depth_image, debug, rospy.Time.now())
+
+    outputs, frames_per_s = replay(process, images, node.stage_timings, args.warmup)
+
+    if args.debug_dir:
+        if not os.path.isdir(args.debug_dir):
+            os.makedirs(args.debug_dir)
+        for index, (bars, debug_image) in enumerate(outputs):
+            cv2.imwrite(os.path.join(args.debug_dir, "%05d.png" % index), debug_image)
+
+    results = {
+        "time": time.time(),
+        "source": args.bag or args.depths,
+        "params": params,
+        "frames": len(images),
+        "image_size": [images[0].shape[1], images[0].shape[0]],
+        "frames_per_s": frames_per_s,
+        "stages": summarize_timings(node.stage_timings),
+        "frames_with_valid_bars": sum(len(node.get_valid_bars(bars)) > 0 for bars, debug_image in outputs),
+        "bars": [bars for bars, debug_image in outputs],
+    }
+
+    serialized = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(serialized)
+    else:
+        print(serialized)
+
+
+if __name__ == "__main__":
+    main()
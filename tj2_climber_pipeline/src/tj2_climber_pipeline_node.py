@@ -25,6 +25,9 @@ from image_geometry import PinholeCameraModel
 
 from std_msgs.msg import ColorRGBA
 
+from tj2_tools.pipeline import StageTimings
+from tj2_tools.pipeline.replay import NullPublisher
+
 import ctypes
 # a thread gets killed improperly within CvBridge without this causing segfaults
 libgcc_s = ctypes.CDLL('libgcc_s.so.1')
@@ -33,26 +36,32 @@ from cv_bridge import CvBridge, CvBridgeError
 
 
 class TJ2ClimberPipeline(object):
-    def __init__(self):
+    def __init__(self, offline_params=None):
+        """
+        :param offline_params: if not None, run without a ROS master. Parameters are read from this dict
+        """
         self.node_name = "tj2_climber_pipeline"
-        rospy.init_node(
-            self.node_name
-            # disable_signals=True
-            # log_level=rospy.DEBUG
-        )
+        self.offline_params = offline_params
+        self.offline = offline_params is not None
+        if not self.offline:
+            rospy.init_node(
+                self.node_name
+                # disable_signals=True
+                # log_level=rospy.DEBUG
+            )
         self.bridge = CvBridge()
 
-        self.min_distance = rospy.get_param("~min_distance", 0.5)
-        self.max_distance = rospy.get_param("~max_distance", 1.5)
+        self.min_distance = self.get_param("~min_distance", 0.5)
+        self.max_distance = self.get_param("~max_distance", 1.5)
         
-        self.roi_left = rospy.get_param("~roi_left", 0)
-        self.roi_top = rospy.get_param("~roi_top", 0)
-        self.roi_right = rospy.get_param("~roi_right", 0)
-        self.roi_bottom = rospy.get_param("~roi_bottom", 0)
+        self.roi_left = self.get_param("~roi_left", 0)
+        self.roi_top = self.get_param("~roi_top", 0)
+        self.roi_right = self.get_param("~roi_right", 0)
+        self.roi_bottom = self.get_param("~roi_bottom", 0)
 
-        self.depth_topic = rospy.get_param("~depth_topic", "depth/image_raw")
-        self.info_topic = rospy.get_param("~info_topic", "depth/camera_info")
-        self.base_link_frame = rospy.get_param("~base_link_frame", "base_link")
+        self.depth_topic = self.get_param("~depth_topic", "depth/image_raw")
+        self.info_topic = self.get_param("~info_topic", "depth/camera_info")
+        self.base_link_frame = self.get_param("~base_link_frame", "base_link")
 
         self.min_distance_mm = int(self.min_distance * 1000.0)
         self.max_distance_mm = int(self.max_distance * 1000.0)
@@ -62,17 +71,31 @@ class TJ2ClimberPipeline(object):
         self.camera_info = None
 
         self.tf_buffer = tf2_ros.Buffer()
-        self.tf_listener = tf2_ros.TransformListener(self.tf_buffer)
+        if not self.offline:
+            self.tf_listener = tf2_ros.TransformListener(self.tf_buffer)
+
+        self.stage_timings = StageTimings(self.get_param("~timing_window", 100))
         
-        self.debug_image_pub = rospy.Publisher("climber_pipeline_debug/image_raw", Image, queue_size=1)
-        self.debug_info_pub = rospy.Publisher("climber_pipeline_debug/camera_info", CameraInfo, queue_size=1)
-        self.bar_marker_pub = rospy.Publisher("bar_markers", MarkerArray, queue_size=10)
+        self.debug_image_pub = self.make_publisher("climber_pipeline_debug/image_raw", Image, queue_size=1)
+        self.debug_info_pub = self.make_publisher("climber_pipeline_debug/camera_info", CameraInfo, queue_size=1)
+        self.bar_marker_pub = self.make_publisher("bar_markers", MarkerArray, queue_size=10)
         
-        rospy.Subscriber(self.depth_topic, Image, self.depth_callback, queue_size=1)
-        rospy.Subscriber(self.info_topic, CameraInfo, self.info_callback, queue_size=1)
+        if not self.offline:
+            rospy.Subscriber(self.depth_topic, Image, self.depth_callback, queue_size=1)
+            rospy.Subscriber(self.info_topic, CameraInfo, self.info_callback, queue_size=1)
 
         rospy.loginfo("%s init complete" % self.node_name)
 
+    def get_param(self, name, default):
+        if self.offline:
+            return self.offline_params.get(name.lstrip("~"), default)
+        return rospy.get_param(name, default)
+
+    def make_publisher(self, topic, msg_type, queue_size):
+        if self.offline:
+            return NullPublisher()
+        return rospy.Publisher(topic, msg_type, queue_size=queue_size)
+
     def run(self):
         rospy.spin()
     
@@ -105,9 +128,11 @@ class TJ2ClimberPipeline(object):
         self.publish_debug_image(debug_image)
     
     def pipeline(self, depth_image, debug=False):
+        t_start = time.perf_counter()
         # constrain depth image to requested range
         threshold, depth_bounded = cv2.threshold(depth_image, self.max_distance_mm, 65535, cv2.THRESH_TOZERO_INV)
         threshold, depth_bounded = cv2.threshold(depth_bounded, self.min_distance_mm, 65535, cv2.THRESH_TOZERO)
+        t_threshold = time.perf_counter()
 
         # convert to 0..255 range so OpenCV algorithms can process it
         # normalized = self.normalize_depth(depth_bounded)
@@ -124,11 +149,18 @@ class TJ2ClimberPipeline(object):
             )
         else:
             debug_image = None
+        t_end = time.perf_counter()
+
+        self.stage_timings.record_many({
+            "threshold": t_threshold - t_start,
+            "debug_image": t_end - t_threshold,
+            "total": t_end - t_start,
+        })
         
         return debug_image
 
     def normalize_depth(self, depth_image):
-        return np.uint8(depth_image.astype(np.float64) * 255 / self.max_distance_mm)
+        return (depth_image.astype(np.float32) * np.float32(255.0 / self.max_distance_mm)).astype(np.uint8)
 
     def publish_debug_image(self, debug_image):
         if debug_image is None:
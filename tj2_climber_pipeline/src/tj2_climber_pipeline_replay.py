@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Replay depth frames through TJ2ClimberPipeline without a ROS master and report frames/s
+and per-stage p50/p99 latencies as JSON.
+
+    ./tj2_climber_pipeline_replay.py --bag match.bag
+    ./tj2_climber_pipeline_replay.py --depths depth/ --param max_distance=1.35 --debug-dir debug/
+
+Frames are loaded into memory before timing starts.
+"""
+import os
+import json
+import time
+import argparse
+
+import cv2
+import rospy
+
+from tj2_tools.pipeline.replay import add_depth_source_arguments, load_depth_source, replay, summarize_timings
+from tj2_climber_pipeline_node import TJ2ClimberPipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tj2_climber_pipeline offline on recorded depth frames")
+    add_depth_source_arguments(parser, "/camera/depth/image_rect_raw", "/camera/depth/camera_info")
+    parser.add_argument("--debug", action="store_true", help="also draw the debug image (included in timings)")
+    parser.add_argument("--debug-dir", default="", help="write debug images to this directory after timing. Implies --debug")
+    args = parser.parse_args()
+
+    # use wall clock time for rospy.Time.now() without a master
+    rospy.rostime.set_rostime_initialized(True)
+
+    images, info_msg = load_depth_source(parser, args)
+    debug = args.debug or bool(args.debug_dir)
+
+    params = dict(timing_window=len(images))
+    params.update(dict(args.param))
+    node = TJ2ClimberPipeline(offline_params=params)
+    node.info_callback(info_msg)
+
+    def process(depth_image):
+        return node.pipeline(depth_image, debug)
+
+    debug_images, frames_per_s = replay(process, images, node.stage_timings, args.warmup)
+
+    if args.debug_dir:
+        if not os.path.isdir(args.debug_dir):
+            os.makedirs(args.debug_dir)
+        for index, debug_image in enumerate(debug_images):
+            cv2.imwrite(os.path.join(args.debug_dir, "%05d.png" % index), debug_image)
+
+    results = {
+        "time": time.time(),
+        "source": args.bag or args.depths,
+        "params": params,
+        "frames": len(images),
+        "image_size": [images[0].shape[1], images[0].shape[0]],
+        "frames_per_s": frames_per_s,
+        "stages": summarize_timings(node.stage_timings),
+    }
+
+    serialized = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(serialized)
+    else:
+        print(serialized)
+
+
+if __name__ == "__main__":
+    main()
@@ -142,7 +142,7 @@ class Tj2SimplePursuit:
         rospy.loginfo("%s is ready" % self.name)
 
     def odom_callback(self, msg):
-        self.odom_state = Simple3DState.from_odom(msg)
+        self.odom_state.update_from_odom(msg)
 
     def pursue_object_callback(self, goal):
         rate = rospy.Rate(self.command_rate)
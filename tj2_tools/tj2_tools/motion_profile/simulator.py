@@ -0,0 +1,593 @@
+"""
+Offline simulation of PIDController, TrapezoidalProfile, and TrapezoidalProfileLive.
+The *Array classes step N gain/constraint combinations at once with numpy and follow the scalar
+classes operation for operation, so each column of a simulation is what the scalar class would produce.
+
+    python -m tj2_tools.motion_profile.simulator pid --kp 0.5:8:16 --kd 0:0.5:11 --time-constant 0.1
+    python -m tj2_tools.motion_profile.simulator live --max-accel 1:4:7 --kp 0:2:9 --goal 2.0
+    python -m tj2_tools.motion_profile.simulator pid --kp 1:5:9 --trace bag.json --topic /setpoint --key data
+"""
+import json
+import math
+import argparse
+import itertools
+import numpy as np
+
+
+def _broadcast_params(size, params):
+    """
+    Broadcast a dict of scalars/arrays to writable float64 arrays of a common 1D shape
+    """
+    names = list(params.keys())
+    arrays = [np.asarray(params[name], dtype=np.float64) for name in names]
+    if size is None:
+        shape = np.broadcast_shapes((1,), *[array.shape for array in arrays])
+    else:
+        shape = (size,)
+    if len(shape) != 1:
+        raise ValueError("Parameters must be scalars or 1D arrays. Got shape %s" % (shape,))
+    return {name: np.array(np.broadcast_to(array, shape)) for name, array in zip(names, arrays)}
+
+
+def broadcast_size(*configs):
+    """
+    Number of combinations described by one or more config dicts of scalars/1D arrays
+    """
+    shapes = [(1,)]
+    for config in configs:
+        for value in config.values():
+            if value is not None:
+                shapes.append(np.shape(value))
+    return np.broadcast_shapes(*shapes)[0]
+
+
+class PIDControllerArray:
+    """
+    N independent PIDControllers. Takes the same keyword arguments as PIDController where each may
+    be a scalar or an array of length N. i_zone entries of None or nan disable the integral zone.
+    A zero dt with kd enabled produces inf/nan instead of raising ZeroDivisionError.
+    """
+    def __init__(self, size=None, **kwargs):
+        i_zone = kwargs.get("i_zone", None)
+        params = _broadcast_params(size, dict(
+            kp=kwargs.get("kp", 1.0),
+            ki=kwargs.get("ki", 0.0),
+            kd=kwargs.get("kd", 0.0),
+            kf=kwargs.get("kf", 0.0),
+            i_zone=math.nan if i_zone is None else i_zone,
+            i_max=kwargs.get("i_max", 0.0),
+            epsilon=kwargs.get("epsilon", 1E-9),
+            tolerance=kwargs.get("tolerance", 0.0),
+            i_accum=kwargs.get("i_accum", 0.0),
+            prev_error=kwargs.get("prev_error", 0.0),
+        ))
+        self.kp = params["kp"]
+        self.ki = params["ki"]
+        self.kd = params["kd"]
+        self.kf = params["kf"]
+        self.i_zone = params["i_zone"]
+        self.i_max = params["i_max"]
+        self.epsilon = params["epsilon"]
+        self.tolerance = params["tolerance"]
+
+        self.i_accum = params["i_accum"]
+        self.prev_error = params["prev_error"]
+
+    def __len__(self):
+        return len(self.kp)
+
+    def reset(self):
+        self.i_accum = np.zeros(len(self))
+        self.prev_error = np.zeros(len(self))
+
+    def update(self, setpoint, measurement, dt):
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            error = setpoint - measurement
+            error = np.broadcast_to(error, self.kp.shape)
+            active = ~(np.abs(error) < self.tolerance)
+            output = 0.0
+            output += self.calculate_p(error)
+            output += self.calculate_i(error, active)
+            output += self.calculate_d(error, dt, active)
+            output += self.calculate_f(setpoint)
+        return np.where(active, output, 0.0)
+
+    def calculate_p(self, error):
+        return np.where(np.abs(self.kp) < self.epsilon, 0.0, self.kp * error)
+
+    def calculate_i(self, error, active):
+        enabled = active & ~(np.abs(self.ki) < self.epsilon)
+
+        i_accum = np.where(
+            np.isnan(self.i_zone),
+            self.i_accum + error,
+            np.where(
+                self.i_zone <= self.epsilon,
+                0.0,
+                np.where(np.abs(error) < self.i_zone, self.i_accum + error, self.i_accum)
+            )
+        )
+        i_limit = self.i_max / self.ki
+        clamped = np.where(i_accum > 0.0, np.minimum(i_accum, i_limit), np.maximum(i_accum, -self.i_max / self.ki))
+        i_accum = np.where(self.i_max > self.epsilon, clamped, i_accum)
+
+        self.i_accum = np.where(enabled, i_accum, self.i_accum)
+        return np.where(enabled, self.ki * self.i_accum, 0.0)
+
+    def calculate_d(self, error, dt, active):
+        enabled = active & ~(np.abs(self.kd) < self.epsilon) & ~(np.asarray(dt) < 0.0)
+        output = self.kd * (error - self.prev_error) / dt
+        self.prev_error = np.where(enabled, error, self.prev_error)
+        return np.where(enabled, output, 0.0)
+
+    def calculate_f(self, setpoint):
+        return np.where(np.abs(self.kf) < self.epsilon, 0.0, self.kf * setpoint)
+
+
+class TrapezoidalProfileArray:
+    """
+    N independent TrapezoidalProfiles. pid_config and trapezoid_config values may be scalars or arrays of length N
+    """
+    def __init__(self, pid_config, trapezoid_config, size=None):
+        if size is None:
+            size = broadcast_size(pid_config, trapezoid_config)
+        self.pid = PIDControllerArray(size, **pid_config)
+        params = _broadcast_params(size, dict(
+            max_speed=trapezoid_config.get("max_speed", 1.0),
+            max_accel=trapezoid_config.get("max_accel", 1.0),
+        ))
+        self.max_speed = params["max_speed"]
+        self.max_accel = params["max_accel"]
+
+        self.reset_position(0.0)
+
+    def __len__(self):
+        return len(self.max_speed)
+
+    def reset_position(self, goal_position, initial_position=0.0):
+        self.reset(goal_position, 0.0, initial_position, 0.0)
+
+    def reset(self, goal_position, goal_velocity=0.0, initial_position=0.0, initial_velocity=0.0):
+        size = len(self)
+        self.prev_t = np.zeros(size)
+        self.direction = np.where(
+            np.broadcast_to(np.asarray(initial_position) > np.asarray(goal_position), (size,)), -1.0, 1.0)
+        self.initial_position = initial_position * self.direction
+        self.initial_velocity = initial_velocity * self.direction
+        self.goal_position = goal_position * self.direction
+        self.goal_velocity = goal_velocity * self.direction
+
+        self.initial_velocity = np.where(self.initial_velocity > self.max_speed, self.max_speed, self.initial_velocity)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cutoff_begin = self.initial_velocity / self.max_accel
+            cutoff_dist_begin = cutoff_begin * cutoff_begin * self.max_accel / 2.0
+
+            cutoff_end = self.goal_velocity / self.max_accel
+            cutoff_dist_end = cutoff_end * cutoff_end * self.max_accel / 2.0
+
+            full_trapezoid_dist = \
+                cutoff_dist_begin + (self.goal_position - self.initial_position) + cutoff_dist_end
+            acceleration_time = self.max_speed / self.max_accel
+
+            full_speed_dist = \
+                full_trapezoid_dist - acceleration_time * acceleration_time * self.max_accel
+
+            never_full_speed = full_speed_dist < 0
+            acceleration_time = np.where(
+                never_full_speed, np.sqrt(full_trapezoid_dist / self.max_accel), acceleration_time)
+            full_speed_dist = np.where(never_full_speed, 0.0, full_speed_dist)
+
+            self.end_accel = acceleration_time - cutoff_begin
+            self.end_full_speed = self.end_accel + full_speed_dist / self.max_speed
+            self.end_decel = self.end_full_speed + acceleration_time - cutoff_end
+
+    def calculate(self, t):
+        """
+        Profile position and velocity arrays at time t (scalar or array of length N)
+        """
+        time_left = self.end_decel - t
+        conditions = [t < self.end_accel, t < self.end_full_speed, t <= self.end_decel]
+        velocity = np.select(conditions, [
+            self.initial_velocity + t * self.max_accel,
+            self.max_speed,
+            self.goal_velocity + time_left * self.max_accel,
+        ], self.goal_velocity)
+        position = np.select(conditions, [
+            self.initial_position + (self.initial_velocity + t * self.max_accel / 2.0) * t,
+            self.initial_position + (
+                (self.initial_velocity + self.end_accel * self.max_accel / 2.0) * self.end_accel
+                + self.max_speed * (t - self.end_accel)),
+            self.goal_position - (self.goal_velocity + time_left * self.max_accel / 2.0) * time_left,
+        ], self.goal_position)
+
+        return position * self.direction, velocity * self.direction
+
+    def calculate_command_velocity(self, current_position, t):
+        dt = t - self.prev_t
+        self.prev_t = np.broadcast_to(t, self.prev_t.shape).astype(np.float64)
+        return self.pid.update(self.calculate(t)[0], current_position, dt)
+
+    def total_time(self):
+        return self.end_decel
+
+    def is_finished(self, t):
+        return t >= self.total_time()
+
+
+class TrapezoidalProfileLiveArray:
+    """
+    N independent TrapezoidalProfileLives. pid_config and trapezoid_config values may be scalars or arrays of length N
+    """
+    def __init__(self, pid_config, trapezoid_config, size=None):
+        if size is None:
+            size = broadcast_size(pid_config, trapezoid_config)
+        self.pid = PIDControllerArray(size, **pid_config)
+        params = _broadcast_params(size, dict(
+            max_speed=trapezoid_config.get("max_speed", 1.0),
+            max_accel=trapezoid_config.get("max_accel", 1.0),
+            reset_time_threshold=trapezoid_config.get("reset_time_threshold", 0.2),
+            position_jump_threshold=trapezoid_config.get("position_jump_threshold", 20.0),
+        ))
+        self.max_speed = params["max_speed"]
+        self.max_accel = params["max_accel"]
+        self.reset_time_threshold = params["reset_time_threshold"]
+        self.position_jump_threshold = self.max_speed / params["position_jump_threshold"]
+
+        self.last_command_pos = np.zeros(size)
+        self.last_command_vel = np.zeros(size)
+        self.target_position = np.zeros(size)
+        self.target_velocity = np.zeros(size)
+
+    def __len__(self):
+        return len(self.max_speed)
+
+    def set_target_velocity(self, velocity):
+        self.target_velocity = np.broadcast_to(velocity, (len(self),)).astype(np.float64)
+
+    def set_target_position(self, position):
+        self.target_position = np.broadcast_to(position, (len(self),)).astype(np.float64)
+
+    def reset(self, current_position):
+        self.last_command_pos = np.broadcast_to(current_position, (len(self),)).astype(np.float64)
+        self.pid.reset()
+
+    def calculate_velocity(self, current_position, current_velocity, dt):
+        with np.errstate(invalid="ignore"):
+            jumped = (dt > self.reset_time_threshold) | \
+                (np.abs(self.last_command_pos - current_position) > self.position_jump_threshold)
+            self.last_command_pos = np.where(jumped, current_position, self.last_command_pos)
+
+            forwards = self.target_position > self.last_command_pos
+
+            command_vel = current_velocity + np.copysign(dt * self.max_accel, np.where(forwards, 1.0, -1.0))
+            command_vel = self.apply_max_velocity_limit(command_vel)
+            command_vel = self.apply_deceleration_limit(command_vel, forwards)
+
+            self.last_command_vel = command_vel
+
+            command_pos = self.last_command_pos + dt * command_vel
+
+            command_vel = command_vel + self.pid.update(current_position, command_pos, dt)
+            command_vel = self.apply_max_velocity_limit(command_vel)
+
+            self.last_command_pos = command_pos
+
+        return command_vel
+
+    def apply_max_velocity_limit(self, current_vel):
+        return np.minimum(self.max_speed, np.maximum(-self.max_speed, current_vel))
+
+    def apply_deceleration_limit(self, current_vel, forwards):
+        limit_vel = np.copysign(self.target_velocity ** 2.0, self.target_velocity) + \
+            2 * self.max_accel * (self.target_position - self.last_command_pos)
+        limit_vel = np.copysign(np.sqrt(np.abs(limit_vel)), limit_vel)
+        return np.where(forwards, np.minimum(limit_vel, current_vel), np.maximum(limit_vel, current_vel))
+
+
+class VelocityPlant:
+    """
+    Simple mechanism model. The commanded velocity passes through a first order lag (time_constant seconds,
+    0 for none) and a speed limit, then integrates into position. All parameters may be arrays of length N.
+    """
+    def __init__(self, size, time_constant=0.0, max_speed=math.inf, position=0.0, velocity=0.0):
+        params = _broadcast_params(size, dict(
+            time_constant=time_constant,
+            max_speed=max_speed,
+            position=position,
+            velocity=velocity,
+        ))
+        self.time_constant = params["time_constant"]
+        self.max_speed = params["max_speed"]
+        self.position = params["position"]
+        self.velocity = params["velocity"]
+
+    def step(self, command, dt):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            alpha = np.where(self.time_constant > 0.0, np.minimum(dt / self.time_constant, 1.0), 1.0)
+        velocity = self.velocity + (command - self.velocity) * alpha
+        self.velocity = np.clip(velocity, -self.max_speed, self.max_speed)
+        self.position = self.position + self.velocity * dt
+
+
+class SimulationResult:
+    """
+    (T,) times and (T, N) setpoints, positions, velocities, and commands. Row 0 is the initial state
+    """
+    def __init__(self, times, setpoints, positions, velocities, commands):
+        self.times = times
+        self.setpoints = setpoints
+        self.positions = positions
+        self.velocities = velocities
+        self.commands = commands
+
+    def step_metrics(self, goal, initial=None, **kwargs):
+        if initial is None:
+            initial = self.positions[0]
+        return step_metrics(self.times, self.positions, initial, goal, **kwargs)
+
+    def tracking_metrics(self):
+        return tracking_metrics(self.setpoints, self.positions)
+
+
+def _run(times, plant, get_command, get_setpoint):
+    times = np.asarray(times, dtype=np.float64)
+    if len(times) < 2:
+        raise ValueError("Need at least two time steps to simulate")
+    size = len(plant.position)
+    shape = (len(times), size)
+    setpoints = np.zeros(shape)
+    positions = np.zeros(shape)
+    velocities = np.zeros(shape)
+    commands = np.zeros(shape)
+
+    setpoints[0] = get_setpoint(0)
+    positions[0] = plant.position
+    velocities[0] = plant.velocity
+    for index in range(1, len(times)):
+        dt = times[index] - times[index - 1]
+        command = get_command(index, dt)
+        plant.step(command, dt)
+        setpoints[index] = get_setpoint(index)
+        positions[index] = plant.position
+        velocities[index] = plant.velocity
+        commands[index] = command
+    return SimulationResult(times, setpoints, positions, velocities, commands)
+
+
+def simulate_pid(pid_config, setpoints, times, plant_config=None):
+    """
+    Drive a plant's position to a setpoint trace with PIDController.update as the velocity command.
+
+    :param setpoints: (T,) setpoint per time step, or a scalar for a step response
+    :param times: (T,) timestamps in seconds
+    :param plant_config: keyword arguments for VelocityPlant
+    """
+    plant_config = plant_config or {}
+    size = broadcast_size(pid_config, plant_config)
+    pid = PIDControllerArray(size, **pid_config)
+    plant = VelocityPlant(size, **plant_config)
+    setpoints = np.broadcast_to(np.asarray(setpoints, dtype=np.float64), np.shape(times))
+
+    def get_command(index, dt):
+        return pid.update(setpoints[index], plant.position, dt)
+
+    return _run(times, plant, get_command, lambda index: setpoints[index])
+
+
+def simulate_trapezoidal(pid_config, trapezoid_config, goal_position, times, plant_config=None):
+    """
+    Follow a TrapezoidalProfile from the plant's initial position to goal_position
+    """
+    plant_config = plant_config or {}
+    size = broadcast_size(pid_config, trapezoid_config, plant_config)
+    profile = TrapezoidalProfileArray(pid_config, trapezoid_config, size)
+    plant = VelocityPlant(size, **plant_config)
+    profile.reset_position(goal_position, plant.position)
+    start_time = times[0]
+
+    def get_command(index, dt):
+        return profile.calculate_command_velocity(plant.position, times[index] - start_time)
+
+    def get_setpoint(index):
+        return profile.calculate(times[index] - start_time)[0]
+
+    return _run(times, plant, get_command, get_setpoint)
+
+
+def simulate_trapezoidal_live(pid_config, trapezoid_config, target_positions, times, plant_config=None,
+                              target_velocity=0.0):
+    """
+    Drive the plant with TrapezoidalProfileLive.calculate_velocity.
+
+    :param target_positions: (T,) target per time step, or a scalar for a step response
+    """
+    plant_config = plant_config or {}
+    size = broadcast_size(pid_config, trapezoid_config, plant_config)
+    profile = TrapezoidalProfileLiveArray(pid_config, trapezoid_config, size)
+    plant = VelocityPlant(size, **plant_config)
+    profile.reset(plant.position)
+    profile.set_target_velocity(target_velocity)
+    target_positions = np.broadcast_to(np.asarray(target_positions, dtype=np.float64), np.shape(times))
+
+    def get_command(index, dt):
+        profile.set_target_position(target_positions[index])
+        return profile.calculate_velocity(plant.position, plant.velocity, dt)
+
+    return _run(times, plant, get_command, lambda index: target_positions[index])
+
+
+def step_metrics(times, positions, initial, goal, rise_start=0.1, rise_end=0.9, settle_band=0.02):
+    """
+    Step response metrics for each column of positions.
+
+    :return dict: (N,) arrays. rise_time is the time from rise_start to rise_end of the step (nan if never reached).
+        overshoot is the peak past the goal as a fraction of the step. settling_time is the time after which
+        the response stays within settle_band of the step from the goal (nan if it never settles).
+        final_error is the absolute error at the last time step.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    positions = np.asarray(positions, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        progress = (positions - initial) / (goal - initial)
+
+    def first_time(mask):
+        reached = mask.any(axis=0)
+        return np.where(reached, times[np.argmax(mask, axis=0)], np.nan)
+
+    rise_time = first_time(progress >= rise_end) - first_time(progress >= rise_start)
+    overshoot = np.maximum(np.nanmax(progress, axis=0) - 1.0, 0.0)
+
+    outside = ~(np.abs(progress - 1.0) <= settle_band)
+    last_outside = len(times) - 1 - np.argmax(outside[::-1], axis=0)
+    settled_index = np.minimum(last_outside + 1, len(times) - 1)
+    settling_time = np.where(
+        ~outside.any(axis=0), 0.0,
+        np.where(last_outside == len(times) - 1, np.nan, times[settled_index] - times[0])
+    )
+
+    return {
+        "rise_time": rise_time,
+        "overshoot": overshoot,
+        "settling_time": settling_time,
+        "final_error": np.abs(positions[-1] - goal),
+    }
+
+
+def tracking_metrics(setpoints, positions):
+    """
+    RMS and max absolute error between setpoints and positions for each column
+    """
+    error = np.asarray(positions) - np.asarray(setpoints)
+    return {
+        "rms_error": np.sqrt(np.mean(error * error, axis=0)),
+        "max_error": np.max(np.abs(error), axis=0),
+    }
+
+
+def make_grid(**ranges):
+    """
+    Cartesian product of parameter values. Each keyword is a scalar or sequence.
+    Returns a dict of flattened arrays of equal length.
+    """
+    names = list(ranges.keys())
+    values = [np.atleast_1d(np.asarray(ranges[name], dtype=np.float64)) for name in names]
+    grids = np.meshgrid(*values, indexing="ij")
+    return {name: grid.ravel() for name, grid in zip(names, grids)}
+
+
+def load_setpoint_trace(path, topic, key):
+    """
+    Load (times, values) for a numeric message field from a bag converted with rosbag_to_file --type json
+    """
+    from tj2_tools.rosbag_to_file.json_loader import iter_bag, get_key
+    times = []
+    values = []
+    for timestamp, row_topic, msg in iter_bag(path):
+        if row_topic != topic:
+            continue
+        value = get_key(msg, key)
+        if value is None:
+            continue
+        times.append(timestamp)
+        values.append(value)
+    if len(times) == 0:
+        raise ValueError("No values for %s.%s in %s" % (topic, key, path))
+    return np.array(times, dtype=np.float64), np.array(values, dtype=np.float64)
+
+
+PID_PARAMS = ("kp", "ki", "kd", "kf", "i_zone", "i_max", "tolerance")
+TRAPEZOID_PARAMS = ("max_speed", "max_accel", "reset_time_threshold", "position_jump_threshold")
+PLANT_PARAMS = ("time_constant", "plant_max_speed")
+
+
+def parse_range(text):
+    """
+    "value", "v1,v2,...", or "start:stop:num" (inclusive linspace)
+    """
+    if ":" in text:
+        start, stop, num = text.split(":")
+        return np.linspace(float(start), float(stop), int(num))
+    return np.array([float(value) for value in text.split(",")])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep motion profile gains and constraints offline")
+    parser.add_argument("mode", choices=["pid", "trapezoidal", "live"])
+    for name in PID_PARAMS + TRAPEZOID_PARAMS + PLANT_PARAMS:
+        parser.add_argument("--" + name.replace("_", "-"), dest=name, type=parse_range, default=None,
+                            help="value, comma separated values, or start:stop:num")
+    parser.add_argument("--goal", type=float, default=1.0, help="step goal position")
+    parser.add_argument("--duration", type=float, default=5.0, help="step response length in seconds")
+    parser.add_argument("--dt", type=float, default=0.02, help="step response time step in seconds")
+    parser.add_argument("--trace", default="", help="bag converted to JSON to take setpoints from")
+    parser.add_argument("--topic", default="", help="setpoint topic in the trace")
+    parser.add_argument("--key", default="data", help="setpoint message field in the trace")
+    parser.add_argument("--sort", default="", help="metric to rank by")
+    parser.add_argument("--top", type=int, default=10, help="number of combinations to report")
+    parser.add_argument("-o", "--output", default="", help="write JSON results to this path instead of stdout")
+    args = parser.parse_args()
+
+    ranges = {name: getattr(args, name) for name in PID_PARAMS + TRAPEZOID_PARAMS + PLANT_PARAMS}
+    ranges = {name: value for name, value in ranges.items() if value is not None}
+    grid = make_grid(**ranges) if ranges else {}
+    pid_config = {name: grid[name] for name in PID_PARAMS if name in grid}
+    trapezoid_config = {name: grid[name] for name in TRAPEZOID_PARAMS if name in grid}
+    plant_config = {}
+    if "time_constant" in grid:
+        plant_config["time_constant"] = grid["time_constant"]
+    if "plant_max_speed" in grid:
+        plant_config["max_speed"] = grid["plant_max_speed"]
+
+    if args.trace:
+        if args.mode == "trapezoidal":
+            parser.error("trapezoidal mode only supports step responses")
+        times, setpoints = load_setpoint_trace(args.trace, args.topic, args.key)
+        plant_config["position"] = setpoints[0]
+    else:
+        times = np.arange(0.0, args.duration + args.dt / 2.0, args.dt)
+        setpoints = args.goal
+
+    if args.mode == "pid":
+        result = simulate_pid(pid_config, setpoints, times, plant_config)
+    elif args.mode == "trapezoidal":
+        result = simulate_trapezoidal(pid_config, trapezoid_config, setpoints, times, plant_config)
+    else:
+        result = simulate_trapezoidal_live(pid_config, trapezoid_config, setpoints, times, plant_config)
+
+    metrics = result.tracking_metrics()
+    if not args.trace:
+        metrics.update(result.step_metrics(args.goal))
+    sort_key = args.sort or ("rms_error" if args.trace else "settling_time")
+    if sort_key not in metrics:
+        parser.error("Unknown metric '%s'. Choose from %s" % (sort_key, ", ".join(metrics.keys())))
+    order = np.argsort(metrics[sort_key], kind="stable")
+
+    def to_json(value):
+        value = float(value)
+        return None if math.isnan(value) else value
+
+    ranked = []
+    for index in itertools.islice(order, args.top):
+        ranked.append({
+            "params": {name: to_json(values[index]) for name, values in grid.items()},
+            "metrics": {name: to_json(values[index]) for name, values in metrics.items()},
+        })
+    results = {
+        "mode": args.mode,
+        "combinations": len(result.positions[0]),
+        "steps": len(times),
+        "sort": sort_key,
+        "best": ranked,
+    }
+
+    serialized = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(serialized)
+    else:
+        print(serialized)
+
+
+if __name__ == '__main__':
+    main()
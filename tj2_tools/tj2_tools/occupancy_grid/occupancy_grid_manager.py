@@ -24,6 +24,8 @@ class OccupancyGridManager:
         # OccupancyGrid starts on lower left corner
         self.map_config = {}
         self._reference_frame = ""
+        self._closest_cell_indices = {}
+        self._msg = None
         self.grid_data = np.array([], dtype=np.int8)
 
     @classmethod
@@ -41,12 +43,15 @@ class OccupancyGridManager:
         self.map_config["height"] = msg.info.height
         self.map_config["origin"] = Pose2d.from_ros_pose(msg.info.origin)
         self._reference_frame = msg.header.frame_id
+        return self
 
     @classmethod
     def from_map_file(cls, config_path, reference_frame="map", image_path=None):
         self = cls()
         with open(config_path) as file:
             map_file_config = yaml.safe_load(file)
+        if self._is_grid_file(map_file_config, image_path):
+            return cls.from_grid_file(config_path, reference_frame)
         
         image = self._load_from_dict(map_file_config, reference_frame, config_path, image_path)
 
@@ -70,6 +75,8 @@ class OccupancyGridManager:
         self = cls()
         with open(config_path) as file:
             map_file_config = yaml.safe_load(file)
+        if self._is_grid_file(map_file_config, image_path):
+            return cls.from_grid_file(config_path, reference_frame)
         
         image = self._load_from_dict(map_file_config, reference_frame, config_path, image_path)
 
@@ -81,17 +88,53 @@ class OccupancyGridManager:
         self.grid_data = data.astype(np.int8)
         return self
     
-    def _load_from_dict(self, map_file_config, reference_frame, config_path, image_path):
+    @classmethod
+    def from_grid_file(cls, config_path, reference_frame="map", mmap_mode="c"):
+        """
+        Load a map written by to_grid_file. The grid is stored as raw costs in a .npy file
+        so no image decoding or thresholding is needed. With the default mmap_mode the
+        grid is memory mapped copy-on-write: pages are read lazily and in-place edits
+        stay in memory without touching the file. Pass mmap_mode="r" for a read-only
+        map or None to load the whole grid up front.
+        """
+        self = cls()
+        with open(config_path) as file:
+            map_file_config = yaml.safe_load(file)
+
         self._reference_frame = reference_frame
         self.map_config["resolution"] = map_file_config["resolution"]
         self.map_config["origin"] = Pose2d(*map_file_config["origin"])
 
+        grid_path = self._get_image_path(map_file_config, config_path, None)
+        grid_data = np.load(grid_path, mmap_mode=mmap_mode)
+        if grid_data.dtype != np.int8 or grid_data.ndim != 2:
+            raise ValueError("Grid file must contain a 2D int8 array: %s" % str(grid_path))
+        self.grid_data = grid_data
+
+        self.map_config["width"] = grid_data.shape[1]
+        self.map_config["height"] = grid_data.shape[0]
+        return self
+
+    def _is_grid_file(self, map_file_config, image_path):
+        if image_path is None:
+            image_path = map_file_config["image"]
+        return image_path.endswith(".npy")
+
+    def _get_image_path(self, map_file_config, config_path, image_path):
         if image_path is None:
             image_path = map_file_config["image"]
         if not image_path.startswith("/"):
             image_path = os.path.join(os.path.dirname(config_path), os.path.basename(image_path))
         if not os.path.isfile(image_path):
             raise FileNotFoundError("Map image file not found: %s" % str(image_path))
+        return image_path
+
+    def _load_from_dict(self, map_file_config, reference_frame, config_path, image_path):
+        self._reference_frame = reference_frame
+        self.map_config["resolution"] = map_file_config["resolution"]
+        self.map_config["origin"] = Pose2d(*map_file_config["origin"])
+
+        image_path = self._get_image_path(map_file_config, config_path, image_path)
         image = cv2.imread(image_path)
         image = image.astype(np.uint8)
         image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
@@ -102,6 +145,15 @@ class OccupancyGridManager:
         return image
 
     def to_msg(self):
+        """
+        The returned message is cached and shared between calls until the grid or map config changes.
+        Don't modify it.
+        """
+        if self._msg is None:
+            self._msg = self._make_msg()
+        return self._msg
+
+    def _make_msg(self):
         msg = OccupancyGrid()
         msg.header.frame_id = self._reference_frame
         msg.info.resolution = self.resolution
@@ -135,6 +187,39 @@ class OccupancyGridManager:
         image = np.flipud(image)
         cv2.imwrite(image_path, image)
 
+    def to_grid_file(self, path):
+        """
+        Write the map as YAML metadata plus the raw grid in a .npy file next to it.
+        Load it with from_grid_file (or from_map_file/from_cost_file, which detect it).
+        """
+        map_file_config = {}
+        map_file_config["resolution"] = self.resolution
+        map_file_config["origin"] = self.origin.to_list()
+
+        grid_path = os.path.splitext(path)[0] + ".npy"
+        map_file_config["image"] = os.path.basename(grid_path)
+
+        with open(path, 'w') as file:
+            yaml.dump(map_file_config, file)
+        np.save(grid_path, np.ascontiguousarray(self.grid_data, dtype=np.int8))
+
+    @property
+    def grid_data(self):
+        return self._grid_data
+
+    @grid_data.setter
+    def grid_data(self, value):
+        self._grid_data = value
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Drop everything derived from grid_data. Assigning grid_data calls this automatically.
+        Call it after modifying grid_data in place.
+        """
+        self._closest_cell_indices = {}
+        self._msg = None
+
     @property
     def resolution(self):
         return self.map_config["resolution"]
@@ -158,14 +243,17 @@ class OccupancyGridManager:
     def set_resolution(self, value):
         assert isinstance(value, float) or isinstance(value, int)
         self.map_config["resolution"] = value
+        self._msg = None
 
     def set_width(self, value):
         assert isinstance(value, float) or isinstance(value, int)
         self.map_config["width"] = value
+        self._msg = None
 
     def set_height(self, value):
         assert isinstance(value, float) or isinstance(value, int)
         self.map_config["height"] = value
+        self._msg = None
 
     def set_origin(self, value):
         if isinstance(value, list) or isinstance(value, tuple):
@@ -179,9 +267,11 @@ class OccupancyGridManager:
             self.map_config["origin"] = value
         else:
             raise ValueError("Invalid type for origin: %s" % repr(value))
+        self._msg = None
 
     def set_reference_frame(self, value):
         self._reference_frame = value
+        self._msg = None
     
     def set_image(self, grid_data):
         self.grid_data = grid_data
@@ -239,7 +329,69 @@ class OccupancyGridManager:
         else:
             return False
 
-    def get_closest_cell_under_cost(self, x, y, cost_threshold, max_radius):
+    def get_world_points(self, cells):
+        """
+        Vectorized get_world_x_y.
+
+        :param cells np.ndarray: (N, 2) array of costmap x, y indices
+        :return np.ndarray: (N, 2) float array of world x, y
+        """
+        cells = np.asarray(cells)
+        origin = np.array([self.origin.x, self.origin.y])
+        return cells * self.resolution + origin
+
+    def get_costmap_points(self, points):
+        """
+        Vectorized get_costmap_x_y. Rounds the same way as round() (half to even).
+
+        :param points np.ndarray: (N, 2) array of world x, y
+        :return np.ndarray: (N, 2) int array of costmap x, y indices
+        """
+        points = np.asarray(points, dtype=np.float64)
+        origin = np.array([self.origin.x, self.origin.y])
+        return np.round((points - origin) / self.resolution).astype(np.int64)
+
+    def is_in_gridmap_points(self, cells):
+        """
+        Vectorized is_in_gridmap.
+
+        :param cells np.ndarray: (N, 2) array of costmap x, y indices
+        :return np.ndarray: (N,) bool mask of cells inside the grid
+        """
+        cells = np.asarray(cells)
+        return (cells[:, 0] > -1) & (cells[:, 0] < self.width) & (cells[:, 1] > -1) & (cells[:, 1] < self.height)
+
+    def get_costs_from_costmap_points(self, cells, out_of_bounds_cost=-1):
+        """
+        Vectorized get_cost_from_costmap_x_y. Cells outside the grid are given
+        out_of_bounds_cost instead of raising IndexError.
+
+        :param cells np.ndarray: (N, 2) array of costmap x, y indices
+        :param out_of_bounds_cost int: cost assigned to cells outside the grid
+        :return tuple: (N,) costs and (N,) bool mask of cells inside the grid
+        """
+        cells = np.asarray(cells)
+        in_bounds = self.is_in_gridmap_points(cells)
+        costs = np.full(len(cells), out_of_bounds_cost, dtype=np.int16)
+        valid_cells = cells[in_bounds]
+        # row-major: first index is the row (y), second the column (x)
+        costs[in_bounds] = self.grid_data[valid_cells[:, 1], valid_cells[:, 0]]
+        return costs, in_bounds
+
+    def get_costs_from_world_points(self, points, out_of_bounds_cost=-1):
+        """
+        Vectorized get_cost_from_world_x_y. Points outside the grid are given
+        out_of_bounds_cost instead of raising IndexError.
+
+        :param points np.ndarray: (N, 2) array of world x, y
+        :param out_of_bounds_cost int: cost assigned to points outside the grid
+        :return tuple: (N,) costs, (N, 2) costmap indices and (N,) bool mask of points inside the grid
+        """
+        cells = self.get_costmap_points(points)
+        costs, in_bounds = self.get_costs_from_costmap_points(cells, out_of_bounds_cost)
+        return costs, cells, in_bounds
+
+    def get_closest_cell_under_cost(self, x, y, cost_threshold, max_radius, use_index=False):
         """
         Looks from closest to furthest in a circular way for the first cell
         with a cost under cost_threshold up until a distance of max_radius,
@@ -250,11 +402,15 @@ class OccupancyGridManager:
         :param y int: y coordinate to look from
         :param cost_threshold int: maximum threshold to look for
         :param max_radius int: maximum number of cells around to check
+        :param use_index bool: answer from a distance transform index built once per threshold
         """
+        if use_index:
+            return self._get_closest_cell_from_index(
+                x, y, cost_threshold, max_radius, bigger_than=False)
         return self._get_closest_cell_arbitrary_cost(
             x, y, cost_threshold, max_radius, bigger_than=False)
 
-    def get_closest_cell_over_cost(self, x, y, cost_threshold, max_radius):
+    def get_closest_cell_over_cost(self, x, y, cost_threshold, max_radius, use_index=False):
         """
         Looks from closest to furthest in a circular way for the first cell
         with a cost over cost_threshold up until a distance of max_radius,
@@ -265,10 +421,57 @@ class OccupancyGridManager:
         :param y int: y coordinate to look from
         :param cost_threshold int: minimum threshold to look for
         :param max_radius int: maximum number of cells around to check
+        :param use_index bool: answer from a distance transform index built once per threshold
         """
+        if use_index:
+            return self._get_closest_cell_from_index(
+                x, y, cost_threshold, max_radius, bigger_than=True)
         return self._get_closest_cell_arbitrary_cost(
             x, y, cost_threshold, max_radius, bigger_than=True)
 
+    def _get_closest_cell_index(self, cost_threshold, bigger_than):
+        """
+        For every cell, the distance to and coordinates of the nearest cell matching
+        the cost predicate. Distances are chessboard distances so max_radius means
+        the same thing as in the ring search. Built on first use and cached until
+        the grid is invalidated.
+        """
+        key = (cost_threshold, bigger_than)
+        if key in self._closest_cell_indices:
+            return self._closest_cell_indices[key]
+
+        if bigger_than:
+            matches = self.grid_data > cost_threshold
+        else:
+            matches = self.grid_data < cost_threshold
+
+        if not np.any(matches):
+            index = None
+        else:
+            # distanceTransform measures distance to the nearest zero pixel
+            src = np.where(matches, 0, 255).astype(np.uint8)
+            distances, labels = cv2.distanceTransformWithLabels(
+                src, cv2.DIST_C, 3, labelType=cv2.DIST_LABEL_PIXEL)
+            # every zero pixel has its own label. Map labels back to cell coordinates
+            match_y, match_x = np.nonzero(matches)
+            label_cells = np.zeros((labels.max() + 1, 2), dtype=np.int32)
+            label_cells[labels[match_y, match_x]] = np.stack((match_x, match_y), axis=1)
+            index = distances, label_cells[labels]
+        self._closest_cell_indices[key] = index
+        return index
+
+    def _get_closest_cell_from_index(self, x, y, cost_threshold, max_radius, bigger_than=False):
+        if not self.is_in_gridmap(x, y):
+            return None
+        index = self._get_closest_cell_index(cost_threshold, bigger_than)
+        if index is None:
+            return -1, -1, -1
+        distances, nearest_cells = index
+        if distances[y, x] > max_radius:
+            return -1, -1, -1
+        cell_x, cell_y = nearest_cells[y, x]
+        return int(cell_x), int(cell_y), self.grid_data[cell_y][cell_x]
+
     def _get_closest_cell_arbitrary_cost(self, x, y,
                                          cost_threshold, max_radius,
                                          bigger_than=False):
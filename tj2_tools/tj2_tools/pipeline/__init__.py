@@ -0,0 +1,3 @@
+from .latest_slot import LatestSlot
+from .stage_timings import StageTimings
+from .worker import PipelineWorker
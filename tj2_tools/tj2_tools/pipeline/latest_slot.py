@@ -0,0 +1,49 @@
+import threading
+
+
+class LatestSlot:
+    """
+    Single item handoff between pipeline threads. put() replaces an item that
+    hasn't been taken yet, so a slow consumer always gets the newest frame
+    instead of working through a backlog of stale ones.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.item = None
+        self.has_item = False
+        self.closed = False
+        self.num_put = 0
+        self.num_dropped = 0
+
+    def put(self, item):
+        """
+        Store item for the consumer. Returns False if an untaken item was dropped to make room
+        """
+        with self.condition:
+            dropped = self.has_item
+            if dropped:
+                self.num_dropped += 1
+            self.num_put += 1
+            self.item = item
+            self.has_item = True
+            self.condition.notify()
+        return not dropped
+
+    def get(self, timeout=None):
+        """
+        Wait up to timeout seconds for an item. Returns None on timeout or if the slot is closed
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.has_item or self.closed, timeout):
+                return None
+            if not self.has_item:
+                return None
+            item = self.item
+            self.item = None
+            self.has_item = False
+            return item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
@@ -0,0 +1,172 @@
+import os
+import time
+
+import cv2
+import yaml
+import numpy as np
+
+from sensor_msgs.msg import CameraInfo
+from geometry_msgs.msg import TransformStamped
+
+DEPTH_EXTENSIONS = (".npy", ".png", ".tif", ".tiff")
+
+
+class NullPublisher:
+    """
+    Stands in for rospy.Publisher when a node runs offline
+    """
+    def publish(self, msg):
+        pass
+
+    def get_num_connections(self):
+        return 0
+
+
+def parse_param(text):
+    """
+    argparse type for node parameters given as name=value (YAML value)
+    """
+    key, value = text.split("=", 1)
+    return key, yaml.safe_load(value)
+
+
+def make_camera_info(width, height, fx, fy, cx, cy, frame_id):
+    info_msg = CameraInfo()
+    info_msg.header.frame_id = frame_id
+    info_msg.width = width
+    info_msg.height = height
+    info_msg.distortion_model = "plumb_bob"
+    info_msg.D = [0.0] * 5
+    info_msg.K = [fx, 0.0, cx, 0.0, fy, cy, 0.0, 0.0, 1.0]
+    info_msg.R = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0]
+    info_msg.P = [fx, 0.0, cx, 0.0, 0.0, fy, cy, 0.0, 0.0, 0.0, 1.0, 0.0]
+    return info_msg
+
+
+def set_identity_transform(tf_buffer, parent_frame, child_frame):
+    transform = TransformStamped()
+    transform.header.frame_id = parent_frame
+    transform.child_frame_id = child_frame
+    transform.transform.rotation.w = 1.0
+    tf_buffer.set_transform_static(transform, "replay")
+
+
+def load_depth_images(directory, max_frames):
+    """
+    Depth images in file name order. .npy arrays are loaded as is, images are read unchanged (typically 16 bit mm)
+    """
+    images = []
+    for filename in sorted(os.listdir(directory)):
+        extension = os.path.splitext(filename)[1].lower()
+        if extension not in DEPTH_EXTENSIONS:
+            continue
+        path = os.path.join(directory, filename)
+        if extension == ".npy":
+            image = np.load(path)
+        else:
+            image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            continue
+        images.append(image)
+        if len(images) >= max_frames:
+            break
+    return images
+
+
+def load_bag_depth_images(path, depth_topic, info_topic, max_frames):
+    """
+    Returns a list of depth images and the first camera info message
+    """
+    import rosbag
+    from cv_bridge import CvBridge
+    bridge = CvBridge()
+    images = []
+    info_msg = None
+    with rosbag.Bag(path) as bag:
+        for topic, msg, timestamp in bag.read_messages(topics=[depth_topic, info_topic]):
+            if topic == info_topic:
+                if info_msg is None:
+                    info_msg = msg
+            else:
+                images.append(bridge.imgmsg_to_cv2(msg, "passthrough"))
+                if len(images) >= max_frames:
+                    break
+    return images, info_msg
+
+
+def add_depth_source_arguments(parser, depth_topic, info_topic):
+    parser.add_argument("--bag", default="", help="bag with depth image and camera info topics")
+    parser.add_argument("--depth-topic", default=depth_topic)
+    parser.add_argument("--info-topic", default=info_topic)
+    parser.add_argument("--depths", default="", help="directory of depth .npy or PNG files (instead of a bag)")
+    parser.add_argument("--fx", type=float, default=0.0, help="focal length for depth directories. Default: image width")
+    parser.add_argument("--fy", type=float, default=0.0)
+    parser.add_argument("--cx", type=float, default=0.0, help="principal point for depth directories. Default: center")
+    parser.add_argument("--cy", type=float, default=0.0)
+    parser.add_argument("--camera-frame", default="camera_depth_optical_frame")
+    parser.add_argument("--max-frames", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=5, help="frames to run before timing starts")
+    parser.add_argument("--param", action="append", default=[], type=parse_param,
+                        help="node parameter as name=value (YAML value)")
+    parser.add_argument("-o", "--output", default="", help="write JSON results to this path instead of stdout")
+
+
+def load_depth_source(parser, args):
+    """
+    Depth images and camera info for arguments added by add_depth_source_arguments.
+    Camera info missing from the source is made from --fx, --fy, --cx, --cy
+    """
+    if args.bag:
+        images, info_msg = load_bag_depth_images(args.bag, args.depth_topic, args.info_topic, args.max_frames)
+    elif args.depths:
+        images = load_depth_images(args.depths, args.max_frames)
+        info_msg = None
+    else:
+        parser.error("Provide --bag or --depths")
+    if len(images) == 0:
+        parser.error("No depth frames found")
+
+    height, width = images[0].shape[0:2]
+    if info_msg is None:
+        info_msg = make_camera_info(
+            width, height,
+            args.fx or float(width), args.fy or float(width),
+            args.cx or width / 2.0, args.cy or height / 2.0,
+            args.camera_frame
+        )
+    return images, info_msg
+
+
+def replay(process, frames, timings=None, warmup=5):
+    """
+    Call process(frame) on each frame after warmup frames and return the list of results and frames per second.
+    timings (StageTimings) is cleared after warmup so it only holds timed frames
+    """
+    for frame in frames[0:warmup]:
+        process(frame)
+    if timings is not None:
+        timings.clear()
+
+    results = []
+    start_time = time.perf_counter()
+    for frame in frames:
+        results.append(process(frame))
+    duration = time.perf_counter() - start_time
+    return results, len(frames) / duration
+
+
+def summarize_timings(timings):
+    """
+    JSON friendly per stage statistics in milliseconds
+    """
+    stages = {}
+    for stage, stats in timings.summary().items():
+        stages[stage] = {
+            "count": stats["count"],
+            "p50_ms": stats["p50"] * 1000.0,
+            "p99_ms": stats["p99"] * 1000.0,
+            "mean_ms": stats["mean"] * 1000.0,
+            "max_ms": stats["max"] * 1000.0,
+        }
+    return stages
+
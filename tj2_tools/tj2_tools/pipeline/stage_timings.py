@@ -0,0 +1,87 @@
+import bisect
+import threading
+import collections
+
+# upper edges in seconds of the histogram buckets. The last bucket counts everything slower
+HISTOGRAM_EDGES = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+
+def percentile(sorted_values, percent):
+    if len(sorted_values) == 0:
+        return None
+    index = min(len(sorted_values) - 1, int(round(percent / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class StageTimings:
+    """
+    Durations for each named stage of a pipeline. Keeps a rolling window of the latest window_size
+    durations for statistics and a histogram of every duration since the last clear().
+    Safe to record from multiple threads
+    """
+    def __init__(self, window_size=100, histogram_edges=HISTOGRAM_EDGES):
+        self.window_size = window_size
+        self.histogram_edges = histogram_edges
+        self.durations = collections.OrderedDict()
+        self.counts = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, duration):
+        with self.lock:
+            if stage not in self.durations:
+                self.durations[stage] = collections.deque(maxlen=self.window_size)
+                self.counts[stage] = 0
+                self.histograms[stage] = [0] * (len(self.histogram_edges) + 1)
+            self.durations[stage].append(duration)
+            self.counts[stage] += 1
+            self.histograms[stage][bisect.bisect_left(self.histogram_edges, duration)] += 1
+
+    def record_many(self, durations, prefix=""):
+        """
+        Record a dict of stage name -> duration
+        """
+        for stage, duration in durations.items():
+            self.record(prefix + stage, duration)
+
+    def summary(self):
+        """
+        dict of stage name -> dict of count, last, mean, p50, p99, and max seconds over the window
+        """
+        with self.lock:
+            durations = {stage: list(window) for stage, window in self.durations.items()}
+            counts = dict(self.counts)
+        summary = collections.OrderedDict()
+        for stage, window in durations.items():
+            last = window[-1]
+            window.sort()
+            summary[stage] = {
+                "count": counts[stage],
+                "last": last,
+                "mean": sum(window) / len(window),
+                "p50": percentile(window, 50),
+                "p99": percentile(window, 99),
+                "max": window[-1],
+            }
+        return summary
+
+    def histogram(self, stage):
+        """
+        List of (upper edge in seconds, count). The last edge is None for durations past every edge
+        """
+        with self.lock:
+            counts = list(self.histograms.get(stage, [0] * (len(self.histogram_edges) + 1)))
+        return list(zip(list(self.histogram_edges) + [None], counts))
+
+    def report(self):
+        report = ""
+        for stage, stats in self.summary().items():
+            report += "\t%s: last %0.4f, p50 %0.4f, p99 %0.4f, max %0.4f (n=%d)\n" % (
+                stage, stats["last"], stats["p50"], stats["p99"], stats["max"], stats["count"])
+        return report
+
+    def clear(self):
+        with self.lock:
+            self.durations.clear()
+            self.counts.clear()
+            self.histograms.clear()
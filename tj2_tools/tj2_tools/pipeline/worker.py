@@ -0,0 +1,50 @@
+import time
+import rospy
+import threading
+import traceback
+
+
+class PipelineWorker:
+    """
+    Thread that takes items from input_slot, calls function(*item), and hands the result to output_slot.
+    A result of None ends processing of that item (nothing is passed on).
+    Call durations are recorded in timings under the worker's name.
+    """
+    def __init__(self, name, function, input_slot, output_slot=None, timings=None, poll_interval=0.1):
+        self.name = name
+        self.function = function
+        self.input_slot = input_slot
+        self.output_slot = output_slot
+        self.timings = timings
+        self.poll_interval = poll_interval
+
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            item = self.input_slot.get(self.poll_interval)
+            if item is None:
+                continue
+            start_time = time.perf_counter()
+            try:
+                result = self.function(*item)
+            except Exception as e:
+                rospy.logerr("Exception in pipeline stage %s: %s\n%s" % (self.name, e, traceback.format_exc()))
+                continue
+            if self.timings is not None:
+                self.timings.record(self.name, time.perf_counter() - start_time)
+            if result is not None and self.output_slot is not None:
+                self.output_slot.put(result)
+
+    def stop(self):
+        self.running = False
+        self.input_slot.close()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
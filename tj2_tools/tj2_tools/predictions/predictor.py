@@ -1,3 +1,4 @@
+import math
 import numpy as np
 from tj2_tools.robot_state import Simple3DState
 
@@ -9,50 +10,148 @@ def iter_pairs(l, reverse=False):
     else:
         for index in range(0, len(l) - 1):
             yield l[index], l[index + 1]
-    
 
 
 class BouncePredictor:
+    """
+    Projects an object's motion from the last past_window_size measurements.
+    Measurements live in fixed capacity numpy ring buffers with running sums
+    so the direction fit and velocity spread update in O(1) per sample.
+    """
     def __init__(self, v_max_robot, past_window_size, vx_std_dev_threshold, vy_std_dev_threshold):
         self.v_max_robot = v_max_robot
         self.past_window_size = past_window_size
         self.vx_std_dev_threshold = vx_std_dev_threshold
         self.vy_std_dev_threshold = vy_std_dev_threshold
 
-        self.odom_buffer = []
-        self.obj_buffer = []
+        # rows: stamp, x, y
+        self.obj_samples = np.zeros((self.past_window_size, 3))
+        self.obj_index = 0
+        self.num_obj_samples = 0
+        self.last_obj_state = None
+        self.num_odom_samples = 0
+
+        # rows: vx, vy, valid (dt > 0) between consecutive samples
+        self.pair_velocities = np.zeros((max(self.past_window_size - 1, 0), 3))
+        self.pair_index = 0
+        self.num_pairs = 0
+
+        self.reset_sums()
+
+    def reset_sums(self):
+        # sum x, y, x^2, y^2, xy of the samples in the window
+        self.sumx = self.sumy = self.sumxx = self.sumyy = self.sumxy = 0.0
+        # sum vx, vy, vx^2, vy^2 and count of valid pairs in the window
+        self.sumvx = self.sumvy = self.sumvxx = self.sumvyy = 0.0
+        self.num_valid_pairs = 0
+
+    def recompute_sums(self):
+        """
+        Rebuild the running sums from the buffers to discard accumulated floating point error
+        """
+        self.reset_sums()
+        for index in range(self.num_obj_samples):
+            self._add_sample(self.obj_samples[index, 1], self.obj_samples[index, 2], 1.0)
+        for index in range(self.num_pairs):
+            vx, vy, valid = self.pair_velocities[index]
+            if valid:
+                self._add_pair(vx, vy, 1.0)
+
+    def _add_sample(self, x, y, sign):
+        self.sumx += sign * x
+        self.sumy += sign * y
+        self.sumxx += sign * x * x
+        self.sumyy += sign * y * y
+        self.sumxy += sign * x * y
+
+    def _add_pair(self, vx, vy, sign):
+        self.sumvx += sign * vx
+        self.sumvy += sign * vy
+        self.sumvxx += sign * vx * vx
+        self.sumvyy += sign * vy * vy
+        self.num_valid_pairs += int(sign)
+
+    def _push_pair(self, vx, vy, valid):
+        capacity = len(self.pair_velocities)
+        if capacity == 0:
+            return
+        if self.num_pairs == capacity:
+            old_vx, old_vy, old_valid = self.pair_velocities[self.pair_index]
+            if old_valid:
+                self._add_pair(old_vx, old_vy, -1.0)
+        else:
+            self.num_pairs += 1
+        self.pair_velocities[self.pair_index] = vx, vy, valid
+        if valid:
+            self._add_pair(vx, vy, 1.0)
+        self.pair_index = (self.pair_index + 1) % capacity
 
     def update_buffers(self, obj_state: Simple3DState, odom_state: Simple3DState):
-        self.odom_buffer.append(odom_state)
-        while len(self.odom_buffer) > self.past_window_size:
-            self.odom_buffer.pop(0)
-
-        self.obj_buffer.append(obj_state)
-        while len(self.obj_buffer) > self.past_window_size:
-            self.obj_buffer.pop(0)
-
-    def get_object_velocity(self, obj_buffer: list):
-        sumx = sumy = sumxx = sumyy = sumxy = 0
-        for state in obj_buffer:
-            sumx += state.x
-            sumy += state.y
-            sumxx += state.x * state.x
-            sumyy += state.y * state.y
-            sumxy += state.x * state.y
+        self.num_odom_samples = min(self.num_odom_samples + 1, self.past_window_size)
+
+        stamp = obj_state.stamp
+        x = obj_state.x
+        y = obj_state.y
+
+        if self.num_obj_samples > 0:
+            prev_stamp, prev_x, prev_y = self.obj_samples[(self.obj_index - 1) % self.past_window_size]
+            dt = stamp - prev_stamp
+            if dt > 0.0:
+                self._push_pair((x - prev_x) / dt, (y - prev_y) / dt, True)
+            else:
+                self._push_pair(0.0, 0.0, False)
+
+        if self.num_obj_samples == self.past_window_size:
+            _, old_x, old_y = self.obj_samples[self.obj_index]
+            self._add_sample(old_x, old_y, -1.0)
+        else:
+            self.num_obj_samples += 1
+        self.obj_samples[self.obj_index] = stamp, x, y
+        self._add_sample(x, y, 1.0)
+        self.obj_index = (self.obj_index + 1) % self.past_window_size
+        self.last_obj_state = obj_state
+
+        if self.obj_index == 0:
+            self.recompute_sums()
+
+    def get_velocity_std_dev(self):
+        """
+        Population standard deviation of vx and vy between consecutive samples. nan if there are none
+        """
+        if self.num_valid_pairs == 0:
+            return math.nan, math.nan
+        mean_vx = self.sumvx / self.num_valid_pairs
+        mean_vy = self.sumvy / self.num_valid_pairs
+        var_vx = max(0.0, self.sumvxx / self.num_valid_pairs - mean_vx * mean_vx)
+        var_vy = max(0.0, self.sumvyy / self.num_valid_pairs - mean_vy * mean_vy)
+        return math.sqrt(var_vx), math.sqrt(var_vy)
+
+    def get_object_velocity(self, obj_buffer: list = None):
+        """
+        Fit the object's direction of travel over the window and its speed from the first and last samples.
+        Uses the running sums unless a list of states is given.
+        """
+        if obj_buffer is None:
+            sumx, sumy, sumxx, sumyy, sumxy = self.sumx, self.sumy, self.sumxx, self.sumyy, self.sumxy
+            oldest_index = self.obj_index if self.num_obj_samples == self.past_window_size else 0
+            first_time, first_x, first_y = self.obj_samples[oldest_index]
+            last_time, last_x, last_y = self.obj_samples[(self.obj_index - 1) % self.past_window_size]
+        else:
+            sumx = sumy = sumxx = sumyy = sumxy = 0
+            for state in obj_buffer:
+                sumx += state.x
+                sumy += state.y
+                sumxx += state.x * state.x
+                sumyy += state.y * state.y
+                sumxy += state.x * state.y
+            first_state = obj_buffer[0]
+            last_state = obj_buffer[-1]
+            first_x, first_y, first_time = first_state.x, first_state.y, first_state.stamp
+            last_x, last_y, last_time = last_state.x, last_state.y, last_state.stamp
 
         denox = self.past_window_size * sumxx - sumx * sumx
         denoy = self.past_window_size * sumyy - sumy * sumy
 
-        first_state = obj_buffer[0]
-        last_state = obj_buffer[-1]
-
-        first_x = first_state.x
-        first_y = first_state.y
-        last_x = last_state.x
-        last_y = last_state.y
-        first_time = first_state.stamp
-        last_time = last_state.stamp
-
         if denox > denoy:
             k = (self.past_window_size * sumxy - sumx * sumy) / denox if denox != 0.0 else 1000.0
             vx = (last_x - first_x) / (last_time - first_time)
@@ -67,39 +166,71 @@ class BouncePredictor:
 
         return vx, vy
 
+    def get_velocity_estimate(self):
+        """
+        Projected object velocity, or None if the window isn't full or the measurements are too noisy
+        """
+        if self.num_obj_samples < self.past_window_size:
+            return None
+        if self.num_odom_samples < self.past_window_size:
+            return None
+
+        # samples that all share a stamp have no valid pairs and would divide by zero
+        if self.num_valid_pairs == 0:
+            return None
+        oldest_index = self.obj_index if self.num_obj_samples == self.past_window_size else 0
+        first_time = self.obj_samples[oldest_index][0]
+        last_time = self.obj_samples[(self.obj_index - 1) % self.past_window_size][0]
+        if last_time <= first_time:
+            return None
+
+        vx_std_dev, vy_std_dev = self.get_velocity_std_dev()
+        if math.isnan(vx_std_dev) or math.isnan(vy_std_dev):
+            return None
+        if vx_std_dev > self.vx_std_dev_threshold:
+            return None
+        if vy_std_dev > self.vy_std_dev_threshold:
+            return None
+
+        return self.get_object_velocity()
+
+    def predict_many(self, time_offsets):
+        """
+        Project the last measured position forward by each time offset in one call.
+
+        :param time_offsets np.ndarray: (N,) seconds past the last measurement
+        :return np.ndarray: (N, 2) predicted x, y. Positions stay at the last measurement
+            if no velocity estimate is available
+        """
+        time_offsets = np.asarray(time_offsets, dtype=np.float64)
+        positions = np.zeros((len(time_offsets), 2))
+        if self.num_obj_samples == 0:
+            return positions
+        _, last_x, last_y = self.obj_samples[(self.obj_index - 1) % self.past_window_size]
+        positions[:, 0] = last_x
+        positions[:, 1] = last_y
+
+        velocity = self.get_velocity_estimate()
+        if velocity is not None:
+            positions[:, 0] += velocity[0] * time_offsets
+            positions[:, 1] += velocity[1] * time_offsets
+        return positions
+
     def get_robot_intersection(self, obj_state: Simple3DState, odom_state: Simple3DState):
         # plot a course to where the object will head
         # given robot parameters, find where the robot and object intersect
 
         self.update_buffers(obj_state, odom_state)
 
-        if len(self.obj_buffer) < self.past_window_size:
-            return obj_state
-        if len(self.odom_buffer) < self.past_window_size:
-            return obj_state
-
-        vxs, vys = [], []
-        for next_state, prev_state in iter_pairs(self.obj_buffer, reverse=True):
-            delta_state = next_state - prev_state
-            dt = next_state.stamp - prev_state.stamp
-            if dt <= 0.0:
-                continue
-            obj_vx = delta_state.x / dt
-            obj_vy = delta_state.y / dt
-            vxs.append(obj_vx)
-            vys.append(obj_vy)
-
-        if np.std(vxs) > self.vx_std_dev_threshold:
-            return obj_state
-        if np.std(vys) > self.vy_std_dev_threshold:
+        velocity = self.get_velocity_estimate()
+        if velocity is None:
             return obj_state
+        proj_vx, proj_vy = velocity
 
-        proj_vx, proj_vy = self.get_object_velocity(self.obj_buffer)
-        
         obj_dist = obj_state.distance()
         future_time_window = obj_dist / self.v_max_robot
 
-        future_obj_state = Simple3DState.from_state(self.obj_buffer[-1])
+        future_obj_state = Simple3DState.from_state(self.last_obj_state)
         future_obj_state.stamp += future_time_window
         future_obj_state.x += proj_vx * future_time_window
         future_obj_state.y += proj_vy * future_time_window
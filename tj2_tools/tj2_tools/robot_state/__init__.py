@@ -1,4 +1,6 @@
-from .robot_state import Pose2d, Velocity
+from .robot_state import State, Pose2d, Velocity
+from .yaw_quaternion import yaw_to_quat, quat_to_yaw, yaw_to_quat_msg, quat_msg_to_yaw, yaws_to_quats, quats_to_yaws
+from .state_array import StateArray, Pose2dArray, VelocityArray
 from .simple_3d_state import Simple3DState
 from .delta_timer import DeltaTimer
 from .simple_filter import SimpleFilter
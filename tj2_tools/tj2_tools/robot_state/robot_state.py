@@ -1,11 +1,12 @@
 import math
 import numpy as np
-import tf_conversions
-from geometry_msgs.msg import Quaternion
 from geometry_msgs.msg import Pose
+from .yaw_quaternion import yaw_to_quat, yaw_to_quat_msg, quat_msg_to_yaw
 
 
 class State:
+    __slots__ = ("x", "y", "theta")
+
     def __init__(self, x=0.0, y=0.0, theta=0.0):
         self.x = x  # meters
         self.y = y  # meters
@@ -39,7 +40,12 @@ class State:
 
     @classmethod
     def from_ros_pose(cls, pose):
-        self = cls()
+        return cls().update_from_ros_pose(pose)
+
+    def update_from_ros_pose(self, pose):
+        """
+        Overwrite this state in place. Returns self
+        """
         self.x = pose.position.x
         self.y = pose.position.y
         self.theta = State.theta_from_quat(pose.orientation)
@@ -47,27 +53,15 @@ class State:
 
     @staticmethod
     def theta_from_quat(quaternion):
-        return tf_conversions.transformations.euler_from_quaternion((
-            quaternion.x,
-            quaternion.y,
-            quaternion.z,
-            quaternion.w
-        ))[2]
+        return quat_msg_to_yaw(quaternion)
 
     def is_none(self):
         return self.x is None and self.y is None and self.theta is None
 
     def get_theta_as_quat(self, as_list=False):
-        quat = tf_conversions.transformations.quaternion_from_euler(0.0, 0.0, self.theta)
         if as_list:
-            return quat
-
-        quat_msg = Quaternion()
-        quat_msg.x = quat[0]
-        quat_msg.y = quat[1]
-        quat_msg.z = quat[2]
-        quat_msg.w = quat[3]
-        return quat_msg
+            return list(yaw_to_quat(self.theta))
+        return yaw_to_quat_msg(self.theta)
 
     def relative_to(self, other):
         if not isinstance(other, self.__class__):
@@ -154,16 +148,14 @@ class State:
         return state
 
     def magnitude(self):
-        return math.sqrt(self.x * self.x + self.y * self.y)
+        return math.hypot(self.x, self.y)
 
     def distance(self, other=None):
         if other is None:  # if other is None, assume you're getting distance from the origin
-            other = self.__class__()
+            return math.hypot(self.x, self.y)
         if not isinstance(other, self.__class__):
             raise ValueError("Can't get distance from %s to %s" % (self.__class__, other.__class__))
-        dx = self.x - other.x
-        dy = self.y - other.y
-        return math.sqrt(dx * dx + dy * dy)
+        return math.hypot(self.x - other.x, self.y - other.y)
 
     def heading(self, other=None):
         if other is None:
@@ -297,8 +289,8 @@ class State:
 
 
 class Pose2d(State):
-    pass
+    __slots__ = ()
 
 
 class Velocity(State):
-    pass
+    __slots__ = ()
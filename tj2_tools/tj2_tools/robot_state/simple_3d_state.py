@@ -9,6 +9,8 @@ from scipy.spatial.transform import Rotation
 
 
 class Simple3DState(State):
+    __slots__ = ("type", "stamp", "z", "vx", "vy", "vz", "vt")
+
     def __init__(self, x=0.0, y=0.0, z=0.0, theta=0.0, vx=0.0, vy=0.0, vz=0.0, vt=0.0):
         super(Simple3DState, self).__init__(x, y, theta)
         self.type = ""
@@ -38,112 +40,100 @@ class Simple3DState(State):
 
     @classmethod
     def from_ros_pose(cls, pose):
-        self = cls()
+        return cls().update_from_ros_pose(pose)
+
+    def update_from_ros_pose(self, pose):
+        """
+        Overwrite the position and orientation in place. Returns self
+        """
         self.x = pose.position.x
         self.y = pose.position.y
         self.z = pose.position.z
-        self.theta = cls.theta_from_quat(pose.orientation)
+        self.theta = self.theta_from_quat(pose.orientation)
         return self
 
     @classmethod
     def from_odom(cls, msg):
+        return cls().update_from_odom(msg)
+
+    def update_from_odom(self, msg):
+        """
+        Overwrite this state with an Odometry message in place so callbacks
+        don't allocate a new state per message. Returns self
+        """
         if not isinstance(msg, Odometry):
             raise ValueError("%s is not of type %s" % (repr(msg), Odometry))
 
-        self = cls.from_ros_pose(msg.pose.pose)
+        self.update_from_ros_pose(msg.pose.pose)
         self.type = "odom"
         self.stamp = msg.header.stamp.to_sec()
-        self.vx = msg.twist.twist.linear.x
-        self.vy = msg.twist.twist.linear.y
-        self.vz = msg.twist.twist.linear.z
-        self.vt = msg.twist.twist.angular.z
+        twist = msg.twist.twist
+        self.vx = twist.linear.x
+        self.vy = twist.linear.y
+        self.vz = twist.linear.z
+        self.vt = twist.angular.z
         return self
 
     @classmethod
     def from_detect(cls, msg):
+        return cls().update_from_detect(msg)
+
+    def update_from_detect(self, msg):
+        """
+        Overwrite the pose, type, and stamp with a detection message in place. Returns self
+        """
         if not (isinstance(msg, Detection2D) or isinstance(msg, Detection3D)):
             raise ValueError("%s is not of type %s" % (repr(msg), Detection2D))
-        self = cls.from_ros_pose(msg.results[0].pose.pose)
+        self.update_from_ros_pose(msg.results[0].pose.pose)
         self.type = msg.results[0].id
         self.stamp = msg.header.stamp.to_sec()
         return self
 
+    def _delta(self, state, other):
+        # difference along one axis. other is None means the origin
+        if state == "x":
+            return self.x if other is None else self.x - other.x
+        elif state == "y":
+            return self.y if other is None else self.y - other.y
+        elif state == "z":
+            return self.z if other is None else self.z - other.z
+        else:
+            return 0.0
+
     def distance(self, other=None, states="xyz"):
         # if other is None, assume you're getting distance from the origin
         if other is not None and not isinstance(other, self.__class__):
             raise ValueError("Can't get distance from %s to %s" % (self.__class__, other.__class__))
-
-        dimensions = []
-        other_dims = []
+        assert len(states) <= 3, len(states)
+
+        if states == "xyz":
+            if other is None:
+                return math.hypot(self.x, self.y, self.z)
+            return math.hypot(self.x - other.x, self.y - other.y, self.z - other.z)
+        if states == "xy":
+            if other is None:
+                return math.hypot(self.x, self.y)
+            return math.hypot(self.x - other.x, self.y - other.y)
+
+        square_sum = 0.0
         for state in states:
-            if state == "x":
-                dimensions.append(float(self.x))
-                if other is not None:
-                    other_dims.append(float(other.x))
-            elif state == "y":
-                dimensions.append(float(self.y))
-                if other is not None:
-                    other_dims.append(float(other.y))
-            elif state == "z":
-                dimensions.append(float(self.z))
-                if other is not None:
-                    other_dims.append(float(other.z))
-
-        assert len(dimensions) <= 3, len(dimensions)
-        assert len(other_dims) <= 3, len(other_dims)
-        assert len(other_dims) == 0 or len(other_dims) == len(dimensions), len(other_dims)
-
-        if other is None:
-            square_sum = 0.0
-            for value in dimensions:
-                square_sum += value * value
-            return math.sqrt(square_sum)
-        else:
-            square_sum = 0.0
-            for index in range(len(dimensions)):
-                delta = dimensions[index] - other_dims[index]
-                square_sum += delta * delta
-            return math.sqrt(square_sum)
+            delta = self._delta(state, other)
+            square_sum += delta * delta
+        return math.sqrt(square_sum)
 
     def heading(self, other=None, states="xy"):
         if other is not None and not isinstance(other, self.__class__):
             raise ValueError("Can't get heading from %s to %s" % (self.__class__, other.__class__))
+        assert len(states) == 2, len(states)
 
-        dimensions = []
-        other_dims = []
-        for state in states:
-            if state == "x":
-                dimensions.append(float(self.x))
-                if other is not None:
-                    other_dims.append(float(other.x))
-            elif state == "y":
-                dimensions.append(float(self.y))
-                if other is not None:
-                    other_dims.append(float(other.y))
-            elif state == "z":
-                dimensions.append(float(self.z))
-                if other is not None:
-                    other_dims.append(float(other.z))
-
-        assert len(dimensions) == 2, len(dimensions)
-        assert len(other_dims) == 0 or len(other_dims) == 2, len(other_dims)
-
-        if other is None:
-            return math.atan2(dimensions[1], dimensions[0])
-        else:
-            d1 = dimensions[0] - other_dims[0]
-            d2 = dimensions[1] - other_dims[1]
-            return math.atan2(d2, d1)
+        return math.atan2(self._delta(states[1], other), self._delta(states[0], other))
 
     def velocity_magnitude(self, other=None):
         if other is None:  # if other is None, assume you're getting distance from the origin
-            other = self.__class__()
+            return math.hypot(self.vx, self.vy, self.vz)
         if not isinstance(other, self.__class__):
             raise ValueError("Can't get distance from %s to %s" % (self.__class__, other.__class__))
-        dvx = self.vx - other.vx
-        dvy = self.vy - other.vy
-        dvz = self.vz - other.vz
-        return math.sqrt(dvx * dvx + dvy * dvy + dvz * dvz)
+        return math.hypot(self.vx - other.vx, self.vy - other.vy, self.vz - other.vz)
 
     def to_ros_pose(self):
         ros_pose = Pose()
@@ -0,0 +1,169 @@
+import math
+import numpy as np
+from .robot_state import State, Pose2d, Velocity
+from .yaw_quaternion import yaws_to_quats, quats_to_yaws
+
+
+class StateArray:
+    """
+    Structure-of-arrays counterpart to State. Stores x, y, and theta of N states
+    as contiguous float64 arrays so trajectory math runs vectorized.
+    Operations mirror the State methods of the same name.
+    """
+    state_type = State
+
+    def __init__(self, x=(), y=(), theta=()):
+        self.x = np.ascontiguousarray(x, dtype=np.float64)  # meters
+        self.y = np.ascontiguousarray(y, dtype=np.float64)  # meters
+        self.theta = np.ascontiguousarray(theta, dtype=np.float64)  # radians
+        if not (self.x.shape == self.y.shape == self.theta.shape) or self.x.ndim != 1:
+            raise ValueError("x, y, and theta must be 1D arrays of the same length. %s, %s, %s" % (
+                self.x.shape, self.y.shape, self.theta.shape))
+
+    @classmethod
+    def from_states(cls, states):
+        length = len(states)
+        x = np.empty(length)
+        y = np.empty(length)
+        theta = np.empty(length)
+        for index, state in enumerate(states):
+            x[index] = state.x
+            y[index] = state.y
+            theta[index] = state.theta
+        return cls(x, y, theta)
+
+    @classmethod
+    def from_array(cls, array):
+        """
+        :param array np.ndarray: (N, 3) array of x, y, theta. Same layout as State.to_array
+        """
+        array = np.asarray(array, dtype=np.float64)
+        return cls(array[:, 0], array[:, 1], array[:, 2])
+
+    @classmethod
+    def from_xy_quats(cls, x, y, quats):
+        """
+        :param quats np.ndarray: (N, 4) orientations as x, y, z, w quaternions
+        """
+        return cls(x, y, quats_to_yaws(quats))
+
+    @classmethod
+    def zeros(cls, length):
+        return cls(np.zeros(length), np.zeros(length), np.zeros(length))
+
+    def to_states(self):
+        state_type = self.state_type
+        return [
+            state_type(x, y, theta)
+            for x, y, theta in zip(self.x.tolist(), self.y.tolist(), self.theta.tolist())
+        ]
+
+    def to_array(self):
+        return np.stack((self.x, self.y, self.theta), axis=1)
+
+    def get_theta_as_quats(self):
+        """
+        (N, 4) array of x, y, z, w quaternions
+        """
+        return yaws_to_quats(self.theta)
+
+    def copy(self):
+        return self.__class__(self.x.copy(), self.y.copy(), self.theta.copy())
+
+    def _other_xyt(self, other):
+        if isinstance(other, State) or isinstance(other, StateArray):
+            return other.x, other.y, other.theta
+        raise ValueError("Can't operate on %s and %s" % (self.__class__, other.__class__))
+
+    def rotate_by(self, theta):
+        """
+        Apply rotation matrix (defined by theta). theta may be a scalar or an array of length N
+        """
+        cos_theta = np.cos(theta)
+        sin_theta = np.sin(theta)
+        return self.__class__(
+            self.x * cos_theta - self.y * sin_theta,
+            self.x * sin_theta + self.y * cos_theta,
+            self.theta + theta
+        )
+
+    def relative_to(self, other):
+        """
+        Transform every state into other's frame. other may be a State or a StateArray of length N
+        """
+        other_x, other_y, other_theta = self._other_xyt(other)
+        states = self.rotate_by(other_theta)
+        states.x += other_x
+        states.y += other_y
+        states.theta = self.normalize_theta(states.theta)
+        return states
+
+    def relative_to_reverse(self, other):
+        other_x, other_y, other_theta = self._other_xyt(other)
+        states = self.__class__(self.x - other_x, self.y - other_y, self.theta)
+        states = states.rotate_by(-other_theta)
+        states.theta = self.normalize_theta(states.theta)
+        return states
+
+    @classmethod
+    def normalize_theta(cls, theta):
+        # normalize theta to -pi..pi. Matches State.normalize_theta
+        theta = np.fmod(theta, 2 * math.pi)
+        wrapped = np.where(theta > 0, theta - 2 * math.pi, theta + 2 * math.pi)
+        return np.where(np.abs(theta) > math.pi, wrapped, theta)
+
+    def get_normalize_theta(self):
+        return self.normalize_theta(self.theta)
+
+    def magnitude(self):
+        return np.hypot(self.x, self.y)
+
+    def distance(self, other=None):
+        """
+        Distance from each state to other (a State, a StateArray of length N, or the origin if None)
+        """
+        if other is None:
+            return self.magnitude()
+        other_x, other_y, _ = self._other_xyt(other)
+        return np.hypot(self.x - other_x, self.y - other_y)
+
+    def heading(self, other=None):
+        if other is None:
+            return np.arctan2(self.y, self.x)
+        other_x, other_y, _ = self._other_xyt(other)
+        return np.arctan2(self.y - other_y, self.x - other_x)
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.state_type(float(self.x[index]), float(self.y[index]), float(self.theta[index]))
+        return self.__class__(self.x[index], self.y[index], self.theta[index])
+
+    def __iter__(self):
+        return iter(self.to_states())
+
+    def __add__(self, other):
+        other_x, other_y, other_theta = self._other_xyt(other)
+        return self.__class__(self.x + other_x, self.y + other_y, self.theta + other_theta)
+
+    def __sub__(self, other):
+        other_x, other_y, other_theta = self._other_xyt(other)
+        return self.__class__(self.x - other_x, self.y - other_y, self.theta - other_theta)
+
+    def __neg__(self):
+        return self.__class__(-self.x, -self.y, -self.theta)
+
+    def __str__(self):
+        return "%s(length=%s)" % (self.__class__.__name__, len(self))
+
+    __repr__ = __str__
+
+
+class Pose2dArray(StateArray):
+    state_type = Pose2d
+
+
+class VelocityArray(StateArray):
+    state_type = Velocity
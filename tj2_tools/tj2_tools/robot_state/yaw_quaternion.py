@@ -0,0 +1,63 @@
+"""
+Closed form yaw <-> quaternion conversions for planar robots.
+Replaces tf_conversions/tf.transformations, which build 4x4 matrices for what is
+a rotation about z. Quaternions are (x, y, z, w) ordered like tf.
+"""
+import math
+import numpy as np
+from geometry_msgs.msg import Quaternion
+
+
+def yaw_to_quat(yaw):
+    """
+    Same result as tf.transformations.quaternion_from_euler(0.0, 0.0, yaw)
+    """
+    half_yaw = yaw * 0.5
+    return 0.0, 0.0, math.sin(half_yaw), math.cos(half_yaw)
+
+
+def quat_to_yaw(x, y, z, w):
+    """
+    Yaw component of tf.transformations.euler_from_quaternion((x, y, z, w)).
+    Doesn't require a normalized quaternion
+    """
+    return math.atan2(2.0 * (w * z + x * y), w * w + x * x - y * y - z * z)
+
+
+def yaw_to_quat_msg(yaw):
+    half_yaw = yaw * 0.5
+    quat_msg = Quaternion()
+    quat_msg.x = 0.0
+    quat_msg.y = 0.0
+    quat_msg.z = math.sin(half_yaw)
+    quat_msg.w = math.cos(half_yaw)
+    return quat_msg
+
+
+def quat_msg_to_yaw(quaternion):
+    return quat_to_yaw(quaternion.x, quaternion.y, quaternion.z, quaternion.w)
+
+
+def yaws_to_quats(yaws):
+    """
+    :param yaws np.ndarray: (N,) yaw angles in radians
+    :return np.ndarray: (N, 4) quaternions as x, y, z, w
+    """
+    half_yaws = np.asarray(yaws, dtype=np.float64) * 0.5
+    quats = np.zeros((len(half_yaws), 4))
+    quats[:, 2] = np.sin(half_yaws)
+    quats[:, 3] = np.cos(half_yaws)
+    return quats
+
+
+def quats_to_yaws(quats):
+    """
+    :param quats np.ndarray: (N, 4) quaternions as x, y, z, w
+    :return np.ndarray: (N,) yaw angles in radians
+    """
+    quats = np.asarray(quats, dtype=np.float64)
+    x = quats[:, 0]
+    y = quats[:, 1]
+    z = quats[:, 2]
+    w = quats[:, 3]
+    return np.arctan2(2.0 * (w * z + x * y), w * w + x * x - y * y - z * z)
@@ -1,5 +1,6 @@
 import rospy
 import tf2_ros
+import numpy as np
 
 
 def lookup_transform(tf_buffer, parent_link, child_link, time_window=None, timeout=None, silent=False):
@@ -20,3 +21,53 @@ def lookup_transform(tf_buffer, parent_link, child_link, time_window=None, timeo
         if not silent:
             rospy.logwarn("Failed to look up %s to %s. %s" % (parent_link, child_link, e))
         return None
+
+
+def quaternion_to_matrix(x, y, z, w):
+    """
+    3x3 rotation matrix of a (not necessarily normalized) quaternion
+    """
+    norm = x * x + y * y + z * z + w * w
+    if norm == 0.0:
+        return np.identity(3)
+    s = 2.0 / norm
+    return np.array([
+        [1.0 - s * (y * y + z * z), s * (x * y - z * w), s * (x * z + y * w)],
+        [s * (x * y + z * w), 1.0 - s * (x * x + z * z), s * (y * z - x * w)],
+        [s * (x * z - y * w), s * (y * z + x * w), 1.0 - s * (x * x + y * y)],
+    ])
+
+
+def transform_to_matrix(transform):
+    """
+    4x4 homogeneous matrix of a geometry_msgs TransformStamped or Transform
+    """
+    if hasattr(transform, "transform"):
+        transform = transform.transform
+    rotation = transform.rotation
+    translation = transform.translation
+    matrix = np.identity(4)
+    matrix[0:3, 0:3] = quaternion_to_matrix(rotation.x, rotation.y, rotation.z, rotation.w)
+    matrix[0:3, 3] = translation.x, translation.y, translation.z
+    return matrix
+
+
+def transform_points(matrix, points):
+    """
+    Apply a 4x4 homogeneous matrix to an (N, 3) array of points with one matrix multiply
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    return points @ matrix[0:3, 0:3].T + matrix[0:3, 3]
+
+
+def project_pixels_to_rays(camera_model, pixels):
+    """
+    Vectorized image_geometry PinholeCameraModel.projectPixelTo3dRay.
+    Returns an (N, 3) array of unit rays for an (N, 2) array of rectified u, v pixels
+    """
+    pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 2)
+    rays = np.ones((len(pixels), 3))
+    rays[:, 0] = (pixels[:, 0] - camera_model.cx()) / camera_model.fx()
+    rays[:, 1] = (pixels[:, 1] - camera_model.cy()) / camera_model.fy()
+    rays /= np.linalg.norm(rays, axis=1)[:, np.newaxis]
+    return rays
@@ -0,0 +1,422 @@
+"""
+Throughput and latency benchmarks for the tunnel stack.
+Runs TunnelProtocol on its own, TunnelSocketClient against a TunnelSocketServer over localhost,
+and TunnelSerialClient against a pty backed fake serial port. Results are printed as JSON.
+
+    python -m tj2_tools.tunnel.benchmark --packets 20000 --corruption 0.01 -o results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+
+from .protocol import TunnelProtocol
+from .parser import TunnelStreamParser
+from .util import NO_ERROR, to_int
+
+DEFAULT_MIX = "odom=dddddd:4,cmd=ddd:4,match=ids:1,ping=d:1"
+
+# latency marker sent between workload packets by the transport benchmarks
+PING_CATEGORY = "bench_ping"
+
+
+def parse_mix(mix):
+    """
+    Parse "category=formats:weight,..." into a list of (category, formats, weight)
+    """
+    entries = []
+    for entry in mix.split(","):
+        entry = entry.strip()
+        if len(entry) == 0:
+            continue
+        category, formats = entry.split("=")
+        if ":" in formats:
+            formats, weight = formats.split(":")
+            weight = float(weight)
+        else:
+            weight = 1.0
+        entries.append((category, formats, weight))
+    return entries
+
+
+def random_args(formats, rng):
+    args = []
+    for f in formats:
+        if f == 'i':
+            args.append(rng.randint(-0x80000000, 0x7fffffff))
+        elif f in "df":
+            args.append(rng.uniform(-1000.0, 1000.0))
+        elif f == 's':
+            args.append("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(0, 16))))
+        elif f == 'x':
+            args.append(bytes(rng.getrandbits(8) for _ in range(rng.randint(0, 16))))
+        else:
+            raise ValueError("Invalid format character '%s'" % f)
+    return tuple(args)
+
+
+def make_workload(mix, num_packets, seed):
+    rng = random.Random(seed)
+    categories = [entry[0:2] for entry in mix]
+    weights = [entry[2] for entry in mix]
+    workload = []
+    for category, formats in rng.choices(categories, weights, k=num_packets):
+        workload.append((category, random_args(formats, rng)))
+    return workload
+
+
+def corrupt(packets, rate, rng):
+    """
+    Flip a random byte in a fraction of the packets. Returns the stream and the number corrupted
+    """
+    num_corrupted = 0
+    stream = bytearray()
+    for packet in packets:
+        if rng.random() < rate:
+            packet = bytearray(packet)
+            packet[rng.randrange(len(packet))] ^= 1 << rng.randrange(8)
+            num_corrupted += 1
+        stream += packet
+    return bytes(stream), num_corrupted
+
+
+def percentile(sorted_values, percent):
+    if len(sorted_values) == 0:
+        return None
+    index = min(len(sorted_values) - 1, int(round(percent / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def latency_stats(latencies):
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000.0 if latencies else None,
+        "p99_ms": percentile(latencies, 99) * 1000.0 if latencies else None,
+        "max_ms": latencies[-1] * 1000.0 if latencies else None,
+    }
+
+
+def register_mix(protocol, mix):
+    for category, formats, weight in mix:
+        protocol.register_category(category, formats)
+
+
+def get_fields(result, formats):
+    """
+    Decode fields one at a time with the PacketResult getters, the way callers did before codecs
+    """
+    fields = []
+    for f in formats:
+        if f == 'i':
+            fields.append(result.get_int())
+        elif f in "df":
+            fields.append(result.get_double())
+        elif f == 's':
+            fields.append(result.get_string())
+        else:
+            # PacketResult has no bytes getter. Read the length prefixed segment directly
+            start_index = result.current_index + 2
+            length = to_int(result.buffer[result.current_index: start_index])
+            result.current_index = start_index + length
+            fields.append(bytes(result.buffer[start_index: result.current_index]))
+    return fields
+
+
+def bench_protocol(mix, num_packets, corruption, chunk_size, use_codecs, seed):
+    """
+    Encode and parse a workload without any I/O
+    """
+    rng = random.Random(seed)
+    workload = make_workload(mix, num_packets, seed)
+
+    writer = TunnelProtocol()
+    reader = TunnelProtocol()
+    if use_codecs:
+        register_mix(writer, mix)
+        register_mix(reader, mix)
+    formats = {category: category_formats for category, category_formats, weight in mix}
+    start_cpu = time.process_time()
+    packets = [writer.make_packet(category, *args) for category, args in workload]
+    encode_cpu = time.process_time() - start_cpu
+
+    stream, num_corrupted = corrupt(packets, corruption, rng)
+
+    parser = TunnelStreamParser(reader)
+    results = []
+    num_valid = 0
+    start_time = time.perf_counter()
+    start_cpu = time.process_time()
+    for index in range(0, len(stream), chunk_size):
+        chunk_results = parser.feed(stream[index: index + chunk_size])
+        for result in chunk_results:
+            if result.error_code != NO_ERROR:
+                continue
+            if use_codecs:
+                reader.unpack(result)
+            else:
+                get_fields(result, formats[result.category])
+            num_valid += 1
+        results.extend(chunk_results)
+    parse_cpu = time.process_time() - start_cpu
+    parse_time = time.perf_counter() - start_time
+
+    return {
+        "packets": num_packets,
+        "bytes": len(stream),
+        "corrupted": num_corrupted,
+        "parsed": len(results),
+        "valid": num_valid,
+        "encode_cpu_us_per_packet": encode_cpu / num_packets * 1E6,
+        "parse_cpu_us_per_packet": parse_cpu / num_packets * 1E6,
+        "parse_packets_per_s": num_packets / parse_time,
+        "parse_bytes_per_s": len(stream) / parse_time,
+    }
+
+
+class TimedParser:
+    """
+    Wraps a transport's TunnelStreamParser to total the bytes fed to it
+    and the CPU time its thread spends parsing them
+    """
+    def __init__(self, parser):
+        self.parser = parser
+        self.cpu_time = 0.0
+        self.num_bytes = 0
+
+    def feed(self, data):
+        start_cpu = time.thread_time()
+        results = self.parser.feed(data)
+        self.cpu_time += time.thread_time() - start_cpu
+        self.num_bytes += len(data)
+        return results
+
+    def reset(self):
+        self.parser.reset()
+
+
+class Echo:
+    """
+    Decodes received packets and encodes them again as replies.
+    A fraction of the replies get a flipped bit
+    """
+    def __init__(self, mix, corruption, seed):
+        self.mix = mix
+        self.protocol = TunnelProtocol()
+        register_mix(self.protocol, mix)
+        self.protocol.register_category(PING_CATEGORY, "d")
+        self.corruption = corruption
+        self.rng = random.Random(seed)
+        self.num_corrupted = 0
+
+    def reply(self, results):
+        packets = []
+        for result in results:
+            if result.error_code == NO_ERROR and result.category in self.protocol.codecs:
+                packets.append(self.protocol.make_packet(result.category, *self.protocol.unpack(result)))
+        stream, num_corrupted = corrupt(packets, self.corruption, self.rng)
+        self.num_corrupted += num_corrupted
+        return stream
+
+
+def run_workload(client, update_server, echo, workload, ping_every, timeout):
+    """
+    Send the workload from client with a ping every ping_every packets and wait for the echoes.
+    Returns a report of ping round trip latencies, received packets/s and bytes/s, and the client's parse CPU
+    """
+    latencies = []
+    num_received = 0
+    last_receive_time = None
+    num_sent = len(workload) + (len(workload) + ping_every - 1) // ping_every
+    done = threading.Event()
+
+    client.parser = TimedParser(client.parser)
+    register_mix(client.protocol, echo.mix)
+    client.protocol.register_category(PING_CATEGORY, "d")
+
+    def packet_callback(result):
+        nonlocal num_received, last_receive_time
+        fields = client.protocol.unpack(result)
+        if result.category == PING_CATEGORY:
+            latencies.append(time.perf_counter() - fields[0])
+        num_received += 1
+        last_receive_time = time.perf_counter()
+        if num_received + echo.num_corrupted >= num_sent:
+            done.set()
+
+    client.packet_callback = packet_callback
+
+    start_time = time.perf_counter()
+    for index, (category, args) in enumerate(workload):
+        if index % ping_every == 0:
+            client.write(PING_CATEGORY, time.perf_counter())
+            update_server()
+        client.write(category, *args)
+        update_server()
+    stop_time = time.perf_counter() + timeout
+    while not done.is_set() and time.perf_counter() < stop_time:
+        update_server()
+
+    # corrupted replies can take good packets with them, so don't count time spent waiting for them
+    duration = (last_receive_time or time.perf_counter()) - start_time
+    report = latency_stats(latencies)
+    report["sent"] = num_sent
+    report["received"] = num_received
+    report["corrupted"] = echo.num_corrupted
+    report["lost"] = num_sent - num_received
+    report["packets_per_s"] = num_received / duration
+    report["bytes_per_s"] = client.parser.num_bytes / duration
+    report["parse_cpu_us_per_packet"] = client.parser.cpu_time / num_received * 1E6 if num_received else None
+    return report
+
+
+def bench_socket(mix, num_packets, corruption, ping_every, coalesce_window, timeout, seed):
+    from .socket.server import TunnelSocketServer
+    from .socket.client import TunnelSocketClient
+
+    echo = Echo(mix, corruption, seed)
+
+    class EchoServer(TunnelSocketServer):
+        def read(self, connection):
+            # replies to every packet in a read at once, bypassing packet_callback
+            try:
+                recv_msg = connection.stream.recv(self.read_block_size)
+            except BlockingIOError:
+                return
+            except OSError:
+                recv_msg = b''
+            if not recv_msg:
+                with self.write_lock:
+                    self.close_stream(connection.stream)
+                return
+            reply = echo.reply(connection.parser.feed(recv_msg))
+            with self.write_lock:
+                connection.queue(reply)
+                connection.flush()
+
+    server = EchoServer("127.0.0.1", 0)
+    server.poll_timeout = 0.001
+    server.max_queue_size = 0x1000000
+    server.start()
+    port = server.device.getsockname()[1]
+
+    client = TunnelSocketClient("127.0.0.1", port, coalesce_window)
+    client.poll_timeout = 0.01
+    client.start()
+    server.update()
+
+    running = True
+
+    def client_loop():
+        while running:
+            client.update()
+
+    thread = threading.Thread(target=client_loop)
+    thread.daemon = True
+    thread.start()
+    try:
+        workload = make_workload(mix, num_packets, seed)
+        report = run_workload(client, server.update, echo, workload, ping_every, timeout)
+    finally:
+        running = False
+        thread.join()
+        client.stop()
+        server.stop()
+
+    report["coalesce_window"] = coalesce_window
+    return report
+
+
+def bench_serial(mix, num_packets, corruption, ping_every, coalesce_window, timeout, seed):
+    """
+    Echo a workload through a pty pair. The master end stands in for the microcontroller
+    """
+    import tty
+    import select
+    from .serial.client import TunnelSerialClient
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    client = TunnelSerialClient(os.ttyname(slave), 115200, coalesce_window)
+    client.poll_timeout = 0.01
+
+    echo = Echo(mix, corruption, seed)
+    echo_parser = TunnelStreamParser(echo.protocol)
+    running = True
+
+    def echo_loop():
+        while running:
+            readable, _, _ = select.select([master], [], [], 0.01)
+            if not readable:
+                continue
+            reply = echo.reply(echo_parser.feed(os.read(master, 4096)))
+            if len(reply) > 0:
+                os.write(master, reply)
+
+    def client_loop():
+        while running:
+            client.update()
+
+    threads = [threading.Thread(target=echo_loop), threading.Thread(target=client_loop)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        workload = make_workload(mix, num_packets, seed)
+        report = run_workload(client, lambda: time.sleep(0.0), echo, workload, ping_every, timeout)
+    finally:
+        running = False
+        for thread in threads:
+            thread.join()
+        client.stop()
+        os.close(master)
+        os.close(slave)
+
+    report["coalesce_window"] = coalesce_window
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tunnel protocol and transports")
+    parser.add_argument("--packets", type=int, default=20000, help="number of packets for the protocol benchmark")
+    parser.add_argument("--transport-packets", type=int, default=2000, help="number of packets for the transport benchmarks")
+    parser.add_argument("--ping-every", type=int, default=10, help="send a latency ping every this many transport packets")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="payload mix as category=formats:weight,...")
+    parser.add_argument("--corruption", type=float, default=0.0, help="fraction of packets with a flipped bit")
+    parser.add_argument("--chunk-size", type=int, default=4096, help="bytes fed to the parser at a time")
+    parser.add_argument("--coalesce-window", type=float, default=0.0, help="write coalescing window in seconds")
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds to wait for outstanding echoes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip", nargs="*", default=[], choices=["protocol", "socket", "serial"])
+    parser.add_argument("-o", "--output", default="", help="write JSON results to this path instead of stdout")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    results = {
+        "time": time.time(),
+        "python": sys.version.split()[0],
+        "config": vars(args),
+    }
+    if "protocol" not in args.skip:
+        results["protocol"] = bench_protocol(mix, args.packets, args.corruption, args.chunk_size, False, args.seed)
+        results["protocol_codecs"] = bench_protocol(mix, args.packets, args.corruption, args.chunk_size, True, args.seed)
+    if "socket" not in args.skip:
+        results["socket"] = bench_socket(
+            mix, args.transport_packets, args.corruption, args.ping_every, args.coalesce_window, args.timeout, args.seed)
+    if "serial" not in args.skip:
+        results["serial"] = bench_serial(
+            mix, args.transport_packets, args.corruption, args.ping_every, args.coalesce_window, args.timeout, args.seed)
+
+    serialized = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(serialized)
+    else:
+        print(serialized)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import struct
+import collections
+from functools import lru_cache
+
+
+# struct codes for fixed width segments. Integers are sent big endian,
+# doubles in native byte order (see to_int32_bytes and to_float_bytes in util.py)
+FIXED_FORMATS = {
+    'i': ('>', 'i'),
+    'd': ('=', 'd'),
+    'f': ('=', 'd'),  # python floats are always sent as doubles
+}
+# length prefixed segments
+STRING_FORMATS = ('s', 'x')
+
+LENGTH_STRUCT = struct.Struct('>H')
+
+
+class PacketCodec:
+    """
+    Encoder/decoder for the arguments of one packet category.
+    The format string is compiled once into a list of struct.Structs,
+    one per run of consecutive fixed width segments with the same byte order.
+    
+    Format characters:
+        i - 32 bit signed integer
+        d, f - 64 bit double
+        s - length prefixed string (decoded to str)
+        x - length prefixed bytes
+    """
+    def __init__(self, category, formats, names=None, max_segment_len=64):
+        self.category = category
+        self.category_bytes = str(category).encode()
+        self.formats = formats
+        self.max_segment_len = max_segment_len
+        self.steps = compile_formats(formats)
+        self.num_fields = len(formats)
+
+        if names is None:
+            self.tuple_type = None
+        else:
+            if isinstance(names, str):
+                names = names.replace(',', ' ').split()
+            if len(names) != self.num_fields:
+                raise ValueError("Category '%s' has %s formats but %s names" % (category, self.num_fields, len(names)))
+            self.tuple_type = collections.namedtuple("PacketFields", names)
+
+    def pack(self, args):
+        if len(args) != self.num_fields:
+            raise ValueError("Category '%s' expects %s arguments, got %s" % (self.category, self.num_fields, len(args)))
+        parts = []
+        index = 0
+        for string_format, step, count in self.steps:
+            if string_format is None:
+                parts.append(step.pack(*args[index: index + count]))
+            else:
+                arg = args[index]
+                if type(arg) == str:
+                    arg = arg.encode()
+                assert len(arg) <= self.max_segment_len, arg
+                parts.append(LENGTH_STRUCT.pack(len(arg)))
+                parts.append(arg)
+            index += count
+        return b''.join(parts)
+
+    def unpack(self, buffer, start_index=0):
+        """
+        Decode all segments from buffer starting at start_index.
+        Returns the decoded fields and the index after the last segment
+        """
+        fields = []
+        index = start_index
+        for string_format, step, count in self.steps:
+            if string_format is None:
+                fields.extend(step.unpack_from(buffer, index))
+                index += step.size
+            else:
+                length, = LENGTH_STRUCT.unpack_from(buffer, index)
+                index += 2
+                segment = bytes(buffer[index: index + length])
+                if len(segment) != length:
+                    raise struct.error("String segment exceeds buffer length")
+                fields.append(segment.decode() if string_format == 's' else segment)
+                index += length
+        if self.tuple_type is None:
+            return tuple(fields), index
+        else:
+            return self.tuple_type(*fields), index
+
+
+@lru_cache(maxsize=None)
+def compile_formats(formats):
+    """
+    Split a format string into (string format, struct, field count) steps.
+    Consecutive fixed width segments with the same byte order share one struct.Struct.
+    String steps have no struct. Results are cached so categories sharing a format
+    share the compiled structs.
+    """
+    steps = []
+    run_order = None
+    run_codes = ""
+
+    def flush_run():
+        nonlocal run_order, run_codes
+        if run_codes:
+            steps.append((None, struct.Struct(run_order + run_codes), len(run_codes)))
+        run_order, run_codes = None, ""
+
+    for f in formats:
+        if f in STRING_FORMATS:
+            flush_run()
+            steps.append((f, None, 1))
+        elif f in FIXED_FORMATS:
+            order, code = FIXED_FORMATS[f]
+            if order != run_order:
+                flush_run()
+            run_order = order
+            run_codes += code
+        else:
+            raise ValueError("Invalid format character '%s' in '%s'" % (f, formats))
+    flush_run()
+    return tuple(steps)
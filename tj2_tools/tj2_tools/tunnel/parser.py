@@ -0,0 +1,34 @@
+class TunnelStreamParser:
+    """
+    Incremental packet parser for a continuous byte stream.
+    Received bytes are appended to a single bytearray and a cursor tracks how far
+    the stream has been consumed, so each byte is only scanned once regardless of
+    how much data is backed up.
+    """
+    def __init__(self, protocol, compact_size=0x10000):
+        self.protocol = protocol
+        self.buffer = bytearray()
+        self.cursor = 0
+
+        # consumed bytes are released once the cursor passes this offset
+        self.compact_size = compact_size
+
+    def feed(self, data):
+        """
+        Append newly received bytes and return the list of PacketResults
+        for every packet completed by them.
+        """
+        self.buffer += data
+        self.cursor, results = self.protocol.parse_stream(self.buffer, self.cursor)
+        if self.cursor == len(self.buffer):
+            self.buffer.clear()
+            self.cursor = 0
+        elif self.cursor >= self.compact_size:
+            # deleting from the front of a bytearray doesn't move the remaining bytes
+            del self.buffer[:self.cursor]
+            self.cursor = 0
+        return results
+
+    def reset(self):
+        self.buffer.clear()
+        self.cursor = 0
@@ -3,6 +3,8 @@ import time
 import rospy
 import struct
 from .result import PacketResult
+from .codec import PacketCodec
+from .trace import PacketTrace, is_debug_enabled
 from .util import *
 
 
@@ -16,6 +18,7 @@ class TunnelProtocol:
 
         self.max_packet_len = 128
         self.max_segment_len = 64
+        self.max_recv_packet_len = 1024  # matches MAX_PACKET_LEN in tj2_tunnel
 
         self.read_packet_num = -1
         self.recv_packet_num = 0
@@ -24,6 +27,12 @@ class TunnelProtocol:
         self.buffer_index = 0
         self.current_segment = b''
 
+        self.codecs = {}
+
+        # checked once instead of formatting debug strings for every packet
+        self.debug = is_debug_enabled()
+        self.trace = None
+
         self.packet_error_codes = {
             NO_ERROR: "no error",
             PACKET_0_ERROR: "c1 != %s" % str(self.PACKET_START_0),
@@ -47,7 +56,48 @@ class TunnelProtocol:
         self.write_packet_num = 0
         self.min_packet_len = len(self.minimum_packet)
 
+    def update_log_level(self):
+        """
+        Re-check the rospy log level. Call this if the logger level is changed at runtime
+        """
+        self.debug = is_debug_enabled()
+
+    def enable_trace(self, sample_every=1, size=256):
+        """
+        Record 1 in sample_every sent and received packets in a ring of the given size.
+        Dump it with self.trace.log_dump()
+        """
+        self.trace = PacketTrace(sample_every, size)
+        return self.trace
+
+    def disable_trace(self):
+        self.trace = None
+
+    def register_category(self, category, formats, names=None):
+        """
+        Compile an encoder/decoder for a category's argument format (see PacketCodec).
+        make_packet packs registered categories in one call and unpack decodes them.
+        """
+        codec = PacketCodec(category, formats, names, self.max_segment_len)
+        self.codecs[category] = codec
+        return codec
+
+    def unpack(self, result):
+        """
+        Decode all fields of a result using its category's registered codec
+        """
+        return result.unpack(self.codecs[result.category])
+
     def make_packet(self, category, *args):
+        codec = self.codecs.get(category)
+        if codec is not None:
+            packet = to_int32_bytes(self.write_packet_num) + codec.category_bytes + self.PACKET_SEP + codec.pack(args)
+            packet = self.packet_footer(packet)
+            self.write_packet_num += 1
+            if self.trace is not None:
+                self.trace.record("send", packet, NO_ERROR)
+            return packet
+
         packet = self.packet_header(category)
         for arg in args:
             if type(arg) == int:
@@ -66,7 +116,9 @@ class TunnelProtocol:
         packet = self.packet_footer(packet)
 
         self.write_packet_num += 1
-        
+        if self.trace is not None:
+            self.trace.record("send", packet, NO_ERROR)
+
         return packet
 
     def packet_header(self, category):
@@ -75,25 +127,21 @@ class TunnelProtocol:
         return packet
 
     def packet_footer(self, packet):
-        calc_checksum = self.calculate_checksum(packet)
-
-        packet += b"%02x" % calc_checksum
-
-        packet_len = len(packet)
-        packet_len_bytes = to_uint16_bytes(packet_len)
-
-        packet = self.PACKET_START_0 + self.PACKET_START_1 + packet_len_bytes + packet
-        packet += self.PACKET_STOP
-
-        return packet
-    
-    def calculate_checksum(self, packet):
-        calc_checksum = 0
-        for val in packet:
-            calc_checksum += val
-        calc_checksum &= 0xff
-
-        return calc_checksum
+        packet += CHECKSUM_HEX[self.calculate_checksum(packet)]
+        return b''.join((self.PACKET_START_0, self.PACKET_START_1, to_uint16_bytes(len(packet)), packet, self.PACKET_STOP))
+
+    def make_packets(self, packets):
+        """
+        Frame a sequence of (category, args) pairs into one contiguous buffer
+        so it can be written with a single send/write call
+        """
+        return b''.join([self.make_packet(category, *args) for category, args in packets])
+
+    def calculate_checksum(self, packet, start_index=0, stop_index=None):
+        if start_index != 0 or stop_index is not None:
+            packet = memoryview(packet)[start_index:stop_index]
+        # sum iterates over the bytes in C
+        return sum(packet) & 0xff
     
     def extract_checksum(self, packet):
         try:
@@ -103,49 +151,60 @@ class TunnelProtocol:
             return -1
 
     def parse_buffer(self, buffer: bytes):
-        rospy.logdebug("Parse buffer: %s" % str(buffer))
+        index, results = self.parse_stream(buffer)
+        return buffer[index:], results
+
+    def parse_stream(self, buffer, start_index=0):
+        """
+        Parse all complete packets in buffer starting from start_index.
+        Returns the index of the first unconsumed byte and the list of results.
+        The buffer is never modified or re-sliced. Bytes before the returned index
+        never need to be passed in again.
+        """
         results = []
-        def get_char(n=1):
-            nonlocal buffer
-            if n > len(buffer):
-                buffer = b''
-                return b''
-            c = buffer[0:n]
-            buffer = buffer[n:]
-            return c
+        start_1 = self.PACKET_START_1[0]
+        stop = self.PACKET_STOP[0]
+        buffer_len = len(buffer)
+        index = start_index
 
         while True:
-            if len(buffer) == 0:
-                rospy.logdebug("No characters left in the buffer")
+            packet_start = buffer.find(self.PACKET_START_0, index)
+            if packet_start == -1:
+                # no start character in the remainder. Discard everything
+                index = buffer_len
                 break
-            c = get_char()
-            if c != self.PACKET_START_0:
+            if packet_start + 4 > buffer_len:
+                # header is incomplete. Wait for more bytes
+                index = packet_start
+                break
+            if buffer[packet_start + 1] != start_1:
+                index = packet_start + 1
                 continue
-            packet = c
-            c = get_char()
-            if c != self.PACKET_START_1:
+            length = (buffer[packet_start + 2] << 8) | buffer[packet_start + 3]
+            if length > self.max_recv_packet_len:
+                if self.debug:
+                    rospy.logdebug("Packet length %s exceeds maximum. Resynchronizing" % length)
+                index = packet_start + 1
                 continue
-            packet += c
-            raw_length = get_char(2)
-            if len(raw_length) == 0:
-                rospy.logdebug("Buffer does not encode a length. Skipping")
-                break
-            packet += raw_length
-            length = to_int(raw_length)
-            rospy.logdebug("Found packet length: %s" % length)
-            packet += get_char(length + 1)
-            if len(packet) == 0:
-                rospy.logdebug("Packet length exceeds buffer size. Skipping")
-                break
-            rospy.logdebug("Found packet: %s" % packet)
-            if packet[-1:] != self.PACKET_STOP:
-                rospy.logdebug("Packet doesn't end with PACKET_STOP. Skipping")
+            packet_stop = packet_start + 4 + length + 1
+            if packet_stop > buffer_len:
+                # body is incomplete. Wait for more bytes
+                index = packet_start
                 break
+            if buffer[packet_stop - 1] != stop:
+                if self.debug:
+                    rospy.logdebug("Packet doesn't end with PACKET_STOP. Resynchronizing")
+                index = packet_start + 1
+                continue
 
+            packet = bytes(buffer[packet_start: packet_stop])
             result = self.parse_packet(packet)
+            if self.trace is not None:
+                self.trace.record("recv", packet, result.error_code)
             results.append(result)
-        
-        return buffer, results
+            index = packet_stop
+
+        return index, results
 
     def parse_packet(self, packet: bytes):
         recv_time = time.time()
@@ -168,7 +227,7 @@ class TunnelProtocol:
         
         full_packet = packet
         packet = packet[4:-1]  # remove start, length, and stop characters
-        calc_checksum = self.calculate_checksum(packet[:-2])
+        calc_checksum = self.calculate_checksum(packet, 0, -2)
         recv_checksum = self.extract_checksum(packet)
         if recv_checksum != calc_checksum:
             rospy.logwarn("Checksum failed! recv %02x != calc %02x. %s" % (recv_checksum, calc_checksum, repr(full_packet)))
@@ -193,10 +252,12 @@ class TunnelProtocol:
         if self.recv_packet_num != self.read_packet_num:
             rospy.logwarn("Received packet num doesn't match local count. "
                            "recv %s != local %s", self.recv_packet_num, self.read_packet_num)
-            rospy.logdebug("Buffer: %s" % packet)
+            if self.debug:
+                rospy.logdebug("Buffer: %s" % packet)
             self.read_packet_num = self.recv_packet_num
             packet_result.set_error_code(PACKET_COUNT_NOT_SYNCED_ERROR)
-        rospy.logdebug("Packet num %s passes for %s" % (self.recv_packet_num, str(packet)))
+        if self.debug:
+            rospy.logdebug("Packet num %s passes for %s" % (self.recv_packet_num, str(packet)))
 
         # find category segment
         if not self.get_next_segment(packet, tab_separated=True):
@@ -218,7 +279,8 @@ class TunnelProtocol:
             self.read_packet_num += 1
             return PacketResult(PACKET_CATEGORY_ERROR, recv_time)
         
-        rospy.logdebug("Category '%s' found in %s" % (category, str(packet)))
+        if self.debug:
+            rospy.logdebug("Category '%s' found in %s" % (category, str(packet)))
 
         packet_result.set_start_index(self.buffer_index)
         packet_result.set_stop_index(len(packet) + 1)
@@ -261,7 +323,8 @@ class TunnelProtocol:
         if packet_num is None:
             packet_num = self.read_packet_num
         if error_code == NO_ERROR:
-            rospy.logdebug("Packet %s has no error" % packet_num)
+            if self.debug:
+                rospy.logdebug("Packet %s has no error" % packet_num)
             return
         
         if not self.is_code_error(error_code):
@@ -1,3 +1,4 @@
+import struct
 from .util import *
 
 class PacketResult:
@@ -51,9 +52,23 @@ class PacketResult:
         if length is None:
             next_index = self.current_index + 2
             length = to_int(self.buffer[self.current_index: next_index])
+            self.current_index = next_index
 
         next_index = self.current_index + length
         result = self.buffer[self.current_index: next_index].decode()
         self.current_index = next_index
         self.check_index()
         return result
+
+    def unpack(self, codec):
+        """
+        Decode all remaining fields in one call with a PacketCodec.
+        Returns a tuple or namedtuple depending on the codec
+        """
+        try:
+            fields, next_index = codec.unpack(self.buffer, self.current_index)
+        except struct.error as e:
+            raise RuntimeError("Failed to unpack '%s' packet: %s" % (self.category, e))
+        self.current_index = next_index
+        self.check_index()
+        return fields
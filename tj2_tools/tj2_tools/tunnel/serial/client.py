@@ -1,21 +1,26 @@
 import rospy
-import queue
 import serial
+import select
 import threading
 
 from ..protocol import TunnelProtocol
+from ..parser import TunnelStreamParser
+from ..writer import PacketWriteQueue
 
 
 class TunnelSerialClient:
-    def __init__(self, address, baud):
+    def __init__(self, address, baud, coalesce_window=None):
         self.protocol = TunnelProtocol()
+        self.parser = TunnelStreamParser(self.protocol)
 
-        self.buffer = b''
+        # None writes every packet immediately. Otherwise packets are queued
+        # and flushed together from update() after coalesce_window seconds
+        self.coalesce_window = coalesce_window
+        if self.coalesce_window is None:
+            self.message_queue = None
+        else:
+            self.message_queue = PacketWriteQueue(100, self.coalesce_window)
 
-        self.inputs = []
-        self.outputs = []
-        self.message_queue = queue.Queue(maxsize=100)
-        
         self.device = serial.Serial(address, baud)
         self.device.nonblocking()
 
@@ -25,11 +30,24 @@ class TunnelSerialClient:
         self.write_lock = threading.Lock()
 
     def update(self):
-        if self.device.in_waiting == 0:
+        inputs = [self.device]
+        timeout = self.poll_timeout
+        if self.message_queue is not None:
+            inputs.append(self.message_queue)
+            timeout = self.message_queue.poll_timeout(timeout)
+        readable, writable, exceptional = select.select(inputs, [], [], timeout)
+
+        if self.message_queue is not None:
+            if self.message_queue in readable:
+                self.message_queue.clear_wake()
+            if self.message_queue.is_flush_due():
+                with self.write_lock:
+                    self.device.write(self.message_queue.drain())
+
+        if self.device not in readable:
             return
-        recv_msg = self.device.read(self.device.in_waiting)
-        self.buffer += recv_msg
-        self.buffer, results = self.protocol.parse_buffer(self.buffer)
+        recv_msg = self.device.read(max(1, self.device.in_waiting))
+        results = self.parser.feed(recv_msg)
         for result in results:
             if not self.protocol.is_code_error(result.error_code):
                 continue
@@ -41,13 +59,26 @@ class TunnelSerialClient:
 
     def write(self, category, *args):
         packet = self.protocol.make_packet(category, *args)
-        with self.write_lock:
-            self.device.write(packet)
+        self.write_buffer(packet)
+
+    def write_many(self, packets):
+        """
+        Frame a list of (category, args) pairs into one buffer and write it in one call
+        """
+        buffer = self.protocol.make_packets(packets)
+        self.write_buffer(buffer)
+
+    def write_buffer(self, buffer):
+        if self.message_queue is None:
+            with self.write_lock:
+                self.device.write(buffer)
+        elif not self.message_queue.put(buffer):
+            rospy.logdebug("Queue is full. Dropped the oldest packet.")
 
-    
     def packet_callback(self, result):
         pass
 
     def stop(self):
         self.device.close()
-
+        if self.message_queue is not None:
+            self.message_queue.close()
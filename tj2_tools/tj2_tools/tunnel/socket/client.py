@@ -1,46 +1,44 @@
 import rospy
-import queue
 import socket
 import select
-import threading
 
 from ..protocol import TunnelProtocol
+from ..parser import TunnelStreamParser
+from ..writer import PacketWriteQueue
 
 
 class TunnelSocketClient:
-    def __init__(self, address, port):
+    def __init__(self, address, port, coalesce_window=0.0):
         self.address = address
         self.port = port
         self.device = None
 
         self.protocol = TunnelProtocol()
-
-        self.buffer = b''
+        self.parser = TunnelStreamParser(self.protocol)
 
         self.inputs = []
-        self.outputs = []
-        self.message_queue = queue.Queue(maxsize=100)
+        self.message_queue = PacketWriteQueue(100, coalesce_window)
 
         self.poll_timeout = 1.0
         self.read_block_size = 4096
 
-        self.write_lock = threading.Lock()
-    
     def start(self):
         self.device = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.device.connect((self.address, self.port))
+        self.device.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.inputs.append(self.device)
-        self.outputs.append(self.device)
 
     def update(self):
-        readable, writable, exceptional = select.select(self.inputs, self.outputs, self.inputs, self.poll_timeout)
+        timeout = self.message_queue.poll_timeout(self.poll_timeout)
+        readable, writable, exceptional = select.select(self.inputs + [self.message_queue], [], self.inputs, timeout)
         for stream in readable:
-            if stream is self.device:
-                rospy.logdebug("Reading from socket")
+            if stream is self.message_queue:
+                self.message_queue.clear_wake()
+            elif stream is self.device:
                 recv_msg = stream.recv(self.read_block_size)
-                rospy.logdebug("Received: %s" % recv_msg)
-                self.buffer += recv_msg
-                self.buffer, results = self.protocol.parse_buffer(self.buffer)
+                if self.protocol.debug:
+                    rospy.logdebug("Received: %s" % recv_msg)
+                results = self.parser.feed(recv_msg)
                 for result in results:
                     if not self.protocol.is_code_error(result.error_code):
                         continue
@@ -50,40 +48,38 @@ class TunnelSocketClient:
                     else:
                         self.packet_callback(result)
         
-        for stream in writable:
-            if self.message_queue.qsize() == 0:
-                continue
-            rospy.logdebug("Queue size: %s" % self.message_queue.qsize())
-            with self.write_lock:
-                while self.message_queue.qsize():
-                    rospy.logdebug("Getting from message queue")
-                    packet = self.message_queue.get()
-                    rospy.logdebug("Writing: %s" % packet)
-                    stream.send(packet)
+        if self.device in self.inputs and self.message_queue.is_flush_due():
+            buffer = self.message_queue.drain()
+            if self.protocol.debug:
+                rospy.logdebug("Writing: %s" % repr(buffer))
+            self.device.sendall(buffer)
 
         for stream in exceptional:
             rospy.loginfo("Closing connection due to an exception")
             self.inputs.remove(stream)
-            if stream in self.outputs:
-                self.outputs.remove(stream)
             stream.close()
     
     def write(self, category, *args):
-        serialized_args = ", ".join(map(str, args))
-        
-        if self.message_queue.full():
-            rospy.logdebug("Discarding write (%s, %s). Queue is full." % (category, serialized_args))
-            return
-        rospy.logdebug("Creating packet from args: (%s, %s)" % (category, serialized_args))
         packet = self.protocol.make_packet(category, *args)
+        self.queue_packet(packet)
 
-        with self.write_lock:
+    def write_many(self, packets):
+        """
+        Frame a list of (category, args) pairs into one buffer and queue it as a single send
+        """
+        buffer = self.protocol.make_packets(packets)
+        self.queue_packet(buffer)
+
+    def queue_packet(self, packet):
+        if self.protocol.debug:
             rospy.logdebug("Queueing packet: %s" % repr(packet))
-            self.message_queue.put(packet)
-    
+        if not self.message_queue.put(packet):
+            rospy.logdebug("Queue is full. Dropped the oldest packet.")
+
     def packet_callback(self, result):
         pass
 
     def stop(self):
         self.device.close()
+        self.message_queue.close()
 
@@ -1,115 +1,186 @@
 import rospy
-import queue
 import socket
-import select
+import selectors
+import threading
 
 from ..protocol import TunnelProtocol
+from ..parser import TunnelStreamParser
+
+
+class TunnelServerConnection:
+    """
+    State for one connected client. Every connection has its own receive buffer and
+    packet counters so clients can't corrupt each other's streams.
+    """
+    def __init__(self, stream, address, max_queue_size):
+        self.stream = stream
+        self.address = address
+
+        self.protocol = TunnelProtocol()
+        self.parser = TunnelStreamParser(self.protocol)
+
+        # bytes waiting to be sent. Writes are dropped instead of queued past max_queue_size
+        self.outbox = bytearray()
+        self.max_queue_size = max_queue_size
+
+    def queue(self, packet):
+        if len(self.outbox) + len(packet) > self.max_queue_size:
+            return False
+        self.outbox += packet
+        return True
+
+    def flush(self):
+        """
+        Send as much of the outbox as the socket accepts without blocking.
+        Returns True if bytes are still waiting
+        """
+        if len(self.outbox) == 0:
+            return False
+        try:
+            num_sent = self.stream.send(self.outbox)
+        except BlockingIOError:
+            return True
+        del self.outbox[:num_sent]
+        return len(self.outbox) > 0
+
+    def __str__(self):
+        return "%s:%s" % self.address[0:2]
 
 
 class TunnelSocketServer:
-    def __init__(self, address, port, categories):
+    def __init__(self, address, port, categories=None):
         self.address = address
         self.port = port
         self.device = None
 
-        self.categories = categories
+        # optional mapping of category -> format string. See TunnelProtocol.register_category
+        self.categories = categories if categories is not None else {}
 
+        # shared by all connections so a broadcast packet is only encoded once
         self.protocol = TunnelProtocol()
+        self.register_categories(self.protocol)
 
-        self.inputs = []
-        self.outputs = []
-        self.message_queues = {}
+        self.selector = selectors.DefaultSelector()
+        self.connections = {}
 
         self.poll_timeout = 1.0
         self.read_block_size = 4096
+        self.max_queue_size = 0x10000  # bytes per client
+
+        self.write_lock = threading.Lock()
 
-        self.buffer = b''
+    def register_categories(self, protocol):
+        for category, formats in self.categories.items():
+            protocol.register_category(category, formats)
 
     def start(self):
         self.device = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.device.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.device.setblocking(0)
         self.device.bind((self.address, self.port))
         self.device.listen(5)
-        self.inputs.append(self.device)
-    
+        self.selector.register(self.device, selectors.EVENT_READ)
+
     def poll_socket(self):
-        if len(self.inputs) == 0:
+        if self.device is None:
             return False
 
-        readable, writable, exceptional = select.select(self.inputs, self.outputs, self.inputs, self.poll_timeout)
-        for stream in readable:
-            if stream is self.device:
-                connection, client_address = stream.accept()
-                connection.setblocking(0)
-                self.inputs.append(connection)
-                self.message_queues[connection] = queue.Queue()
-                rospy.loginfo("Registering client %s:%s" % client_address)
-                if connection not in self.outputs:
-                    self.outputs.append(connection)
-            else:
-                recv_msg = stream.recv(self.read_block_size)
-                self.buffer += recv_msg
-                if recv_msg:
-                    if len(self.buffer) > 0:
-                        rospy.logdebug("Buffer: %s" % repr(self.buffer))
-                        self.buffer, results = self.protocol.parse_buffer(self.buffer, self.categories)
-                        for result in results:
-                            error_code, recv_time, data = result
-                            category = data[0]
-                            data = data[1:]
-                            if category == "__msg__":
-                                rospy.loginfo("Tunnel message: %s" % data[0])
-                            else:
-                                self.packet_callback(error_code, recv_time, category, data)
-                    # self.message_queues[stream].put(recv_msg)  # echo back to client
-                    
-                else:
-                    self.close_stream(stream)
-
-        for stream in writable:
-            try:
-                next_msg = self.message_queues[stream].get_nowait()
-            except KeyError:
+        with self.write_lock:
+            # only wait on writability for clients with pending bytes
+            for connection in self.connections.values():
+                events = selectors.EVENT_READ
+                if len(connection.outbox) > 0:
+                    events |= selectors.EVENT_WRITE
+                if self.selector.get_key(connection.stream).events != events:
+                    self.selector.modify(connection.stream, events, connection)
+
+        for key, mask in self.selector.select(self.poll_timeout):
+            if key.fileobj is self.device:
+                self.accept()
                 continue
-            except queue.Empty:
+            connection = key.data
+            if mask & selectors.EVENT_READ:
+                self.read(connection)
+            if mask & selectors.EVENT_WRITE and connection.stream in self.connections:
+                with self.write_lock:
+                    try:
+                        connection.flush()
+                    except OSError:
+                        self.close_stream(connection.stream)
+        return True
+
+    def accept(self):
+        stream, client_address = self.device.accept()
+        stream.setblocking(0)
+        stream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = TunnelServerConnection(stream, client_address, self.max_queue_size)
+        self.register_categories(connection.protocol)
+        with self.write_lock:
+            self.connections[stream] = connection
+            self.selector.register(stream, selectors.EVENT_READ, connection)
+        rospy.loginfo("Registering client %s" % connection)
+
+    def read(self, connection):
+        try:
+            recv_msg = connection.stream.recv(self.read_block_size)
+        except BlockingIOError:
+            return
+        except OSError:
+            recv_msg = b''
+        if not recv_msg:
+            rospy.loginfo("Client %s disconnected" % connection)
+            with self.write_lock:
+                self.close_stream(connection.stream)
+            return
+
+        for result in connection.parser.feed(recv_msg):
+            if not connection.protocol.is_code_error(result.error_code):
                 continue
-            try:
-                rospy.logdebug("Writing: %s" % next_msg)
-                stream.send(next_msg)
-            except ConnectionResetError:
-                self.close_stream(stream)
+            if result.category == "__msg__":
+                rospy.loginfo("Tunnel message: %s" % result.get_string())
+            else:
+                self.packet_callback(result)
 
-        for stream in exceptional:
-            self.close_stream(stream)
-    
     def write(self, category, *args):
-        serialized_args = ", ".join(map(str, args))
-        
-        for message_queue in self.message_queues.values():
-            if message_queue.full():
-                rospy.logdebug("Discarding write (%s, %s). Queue is full." % (category, serialized_args))
+        """
+        Encode a packet once and queue the same bytes for every client
+        """
+        with self.write_lock:
+            if len(self.connections) == 0:
                 return
-            rospy.logdebug("Creating packet from args: (%s, %s)" % (category, serialized_args))
             packet = self.protocol.make_packet(category, *args)
-
-            rospy.logdebug("Queueing packet: %s" % repr(packet))
-            message_queue.put(packet)
+            for stream, connection in list(self.connections.items()):
+                if not connection.queue(packet):
+                    rospy.logdebug("Discarding write (%s) for %s. Queue is full." % (category, connection))
+                    continue
+                try:
+                    connection.flush()
+                except OSError:
+                    self.close_stream(stream)
 
     def close_stream(self, stream):
-        self.inputs.remove(stream)
-        if stream in self.outputs:
-            self.outputs.remove(stream)
+        # callers must hold write_lock
+        if stream not in self.connections:
+            return
+        self.selector.unregister(stream)
         stream.close()
-        del self.message_queues[stream]
+        del self.connections[stream]
 
     def update(self):
         try:
             self.poll_socket()
         except BaseException as e:
             rospy.logerr(str(e))
-    
-    def packet_callback(self, error_code, recv_time, category, data):
+
+    def packet_callback(self, result):
         pass
 
     def stop(self):
-        self.device.close()
+        with self.write_lock:
+            for stream in list(self.connections.keys()):
+                self.close_stream(stream)
+        if self.device is not None:
+            self.selector.unregister(self.device)
+            self.device.close()
+            self.device = None
+        self.selector.close()
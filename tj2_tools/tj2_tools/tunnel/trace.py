@@ -0,0 +1,46 @@
+import time
+import rospy
+import logging
+import collections
+
+
+def is_debug_enabled():
+    """
+    Check whether rospy.logdebug would emit anything. rospy logs through the 'rosout' logger
+    """
+    return logging.getLogger("rosout").isEnabledFor(logging.DEBUG)
+
+
+class PacketTrace:
+    """
+    Sampled record of packets passing through a TunnelProtocol.
+    Every sample_every-th packet is stored in a bounded ring so the most recent
+    traffic can be dumped on demand without logging every packet.
+    """
+    def __init__(self, sample_every=1, size=256):
+        self.sample_every = max(1, int(sample_every))
+        self.ring = collections.deque(maxlen=size)
+        self.count = 0
+
+    def record(self, direction, packet, error_code):
+        self.count += 1
+        if self.count % self.sample_every != 0:
+            return
+        self.ring.append((time.time(), direction, error_code, bytes(packet)))
+
+    def dump(self):
+        """
+        Return the traced packets as formatted lines, oldest first
+        """
+        return [
+            "%0.6f %s code=%s %s" % (timestamp, direction, error_code, repr(packet))
+            for timestamp, direction, error_code, packet in list(self.ring)
+        ]
+
+    def log_dump(self):
+        rospy.loginfo("Packet trace (1 in %s of %s packets):" % (self.sample_every, self.count))
+        for line in self.dump():
+            rospy.loginfo("\t%s" % line)
+
+    def clear(self):
+        self.ring.clear()
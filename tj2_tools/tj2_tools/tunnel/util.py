@@ -15,6 +15,9 @@ PACKET_STOP_ERROR = 9
 SEGMENT_TOO_LONG_ERROR = 10
 PACKET_TIMEOUT_ERROR = 11
 
+# two character hex representation of every checksum value
+CHECKSUM_HEX = tuple(b"%02x" % value for value in range(256))
+
 
 def to_uint16_bytes(integer):
     return integer.to_bytes(2, 'big')
@@ -0,0 +1,92 @@
+import time
+import socket
+import threading
+import collections
+
+
+class PacketWriteQueue:
+    """
+    Thread safe queue of outgoing packets that are flushed together as one buffer.
+    When the queue is full the oldest packet is dropped since stale commands are
+    worth less than new ones. Packets are held for up to coalesce_window seconds
+    after the first one is queued so bursts of writes go out in a single syscall.
+
+    The queue can be passed to select. It becomes readable when a packet is
+    queued so a blocked reader thread wakes up to flush it.
+    """
+    def __init__(self, max_size=100, coalesce_window=0.0):
+        self.packets = collections.deque(maxlen=max_size)
+        self.coalesce_window = coalesce_window
+        self.first_queue_time = None
+        self.num_dropped = 0
+
+        self.lock = threading.Lock()
+        self.wake_recv, self.wake_send = socket.socketpair()
+        self.wake_recv.setblocking(False)
+        self.wake_send.setblocking(False)
+
+    def put(self, packet):
+        """
+        Queue a packet. Returns False if the oldest packet was dropped to make room
+        """
+        with self.lock:
+            dropped = len(self.packets) == self.packets.maxlen
+            if dropped:
+                self.num_dropped += 1
+            self.packets.append(packet)
+            if self.first_queue_time is None:
+                self.first_queue_time = time.monotonic()
+                try:
+                    self.wake_send.send(b'\x00')
+                except BlockingIOError:
+                    pass
+        return not dropped
+
+    def qsize(self):
+        return len(self.packets)
+
+    def time_until_flush(self):
+        """
+        Seconds until the queued packets should be flushed. None if the queue is empty
+        """
+        first_queue_time = self.first_queue_time
+        if first_queue_time is None:
+            return None
+        return max(0.0, first_queue_time + self.coalesce_window - time.monotonic())
+
+    def is_flush_due(self):
+        time_until_flush = self.time_until_flush()
+        return time_until_flush is not None and time_until_flush <= 0.0
+
+    def drain(self):
+        """
+        Remove all queued packets and return them joined into one buffer
+        """
+        with self.lock:
+            buffer = b''.join(self.packets)
+            self.packets.clear()
+            self.first_queue_time = None
+        return buffer
+
+    def poll_timeout(self, timeout):
+        """
+        Shorten a select timeout so it expires when the coalesce window does
+        """
+        time_until_flush = self.time_until_flush()
+        if time_until_flush is None:
+            return timeout
+        return min(timeout, time_until_flush)
+
+    def clear_wake(self):
+        try:
+            while self.wake_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def fileno(self):
+        return self.wake_recv.fileno()
+
+    def close(self):
+        self.wake_recv.close()
+        self.wake_send.close()
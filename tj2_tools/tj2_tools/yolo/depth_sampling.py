@@ -0,0 +1,58 @@
+import numpy as np
+
+
+def parse_depth_statistic(statistic):
+    """
+    "mean", "median", or a percentile from 0 to 100 (number or numeric string)
+    """
+    if statistic in ("mean", "median"):
+        return statistic
+    try:
+        percentile = float(statistic)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid depth statistic: %s. Use mean, median, or a percentile" % statistic)
+    if not (0.0 <= percentile <= 100.0):
+        raise ValueError("Depth percentile must be between 0 and 100. Got %s" % percentile)
+    return percentile
+
+
+def sample_box_depths(depth_image, boxes, border_px=0, statistic="mean", invalid_depth=0):
+    """
+    Depth statistic inside a circle inscribed in each bounding box, shrunk by border_px.
+    Only each box's region of interest is read, so the cost scales with box area rather than image size.
+    Pixels at or below invalid_depth are rejected.
+
+    :param depth_image np.ndarray: (H, W) depth image
+    :param boxes np.ndarray: (N, 4) boxes as center x, center y, width, height in pixels
+    :param statistic: "mean", "median", or a percentile from 0 to 100
+    :return np.ndarray: (N,) float64 depths in the image's units. 0.0 for boxes with no valid pixels
+    """
+    statistic = parse_depth_statistic(statistic)
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    height, width = depth_image.shape[0:2]
+    depths = np.zeros(len(boxes))
+    for index, (center_x, center_y, size_x, size_y) in enumerate(boxes):
+        center_x = int(center_x)
+        center_y = int(center_y)
+        radius = int(min(size_x, size_y) / 2.0)
+        radius = max(radius - border_px, 1)
+
+        x0 = max(center_x - radius, 0)
+        x1 = min(center_x + radius + 1, width)
+        y0 = max(center_y - radius, 0)
+        y1 = min(center_y + radius + 1, height)
+        if x0 >= x1 or y0 >= y1:
+            continue
+
+        dy, dx = np.ogrid[y0 - center_y: y1 - center_y, x0 - center_x: x1 - center_x]
+        roi = depth_image[y0:y1, x0:x1]
+        valid = roi[((dx * dx + dy * dy) <= radius * radius) & (roi > invalid_depth)]
+        if len(valid) == 0:
+            continue
+        if statistic == "mean":
+            depths[index] = np.mean(valid, dtype=np.float64)
+        elif statistic == "median":
+            depths[index] = np.median(valid)
+        else:
+            depths[index] = np.percentile(valid, statistic)
+    return depths
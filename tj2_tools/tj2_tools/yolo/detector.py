@@ -12,9 +12,16 @@ from .utils import get_label, get_obj_id
 
 class YoloDetector:
     def __init__(self, device, model_path, image_width, image_height, confidence_threshold=0.25, nms_iou_threshold=0.45,
-                 max_detections=1000, report_loop_times=False, publish_overlay=False):
+                 max_detections=1000, report_loop_times=False, publish_overlay=False,
+                 backend="torch", num_threads=0, class_names=None):
+        """
+        :param backend: "torch" runs model_path through yolov5's DetectMultiBackend on device.
+            "onnxruntime" runs an ONNX model_path (see export_onnx) on the CPU with num_threads (0 for the default)
+        :param class_names: fallback class names for ONNX models without names in their metadata
+        """
         self.model_device = device
         self.model_path = model_path
+        self.backend = backend
         self.report_loop_times = report_loop_times
         self.publish_overlay = publish_overlay
         self.image_width = image_width
@@ -29,33 +36,52 @@ class YoloDetector:
         self.agnostic_nms = False  # class-agnostic NMS
         self.overlay_line_thickness = 3  # bounding box thickness (pixels)
 
-        self.selected_model_device = select_device(self.model_device)
-        self.model = DetectMultiBackend(self.model_path, device=self.selected_model_device, dnn=False)
+        self.timing_report = ""
+        self.stage_durations = {}  # seconds spent in each stage of the last detect call
+        self.batch_buffer = None
+        self.image_size = (self.image_width, self.image_height)
+        self.model_input_shape = None  # fixed (height, width) the model requires. None if any size works
 
-        self.stride = self.model.stride
-        self.class_names = self.model.names
-        pt = self.model.pt
-        jit = self.model.jit
-        onnx = self.model.onnx
-        engine = self.model.engine
+        if self.backend == "onnxruntime":
+            from .onnx_backend import OnnxRuntimeModel
+            self.selected_model_device = torch.device("cpu")
+            self.model = OnnxRuntimeModel(self.model_path, num_threads)
+            self.stride = self.model.stride
+            self.class_names = self.model.class_names or class_names
+            if self.class_names is None:
+                raise ValueError("%s has no class names in its metadata. Please provide them" % self.model_path)
+            self.model_input_shape = self.model.input_shape
+            self.model.warmup()
+        elif self.backend == "torch":
+            self.selected_model_device = select_device(self.model_device)
+            self.model = DetectMultiBackend(self.model_path, device=self.selected_model_device, dnn=False)
 
-        # FP16 supported on limited backends with CUDA
-        self.half &= (pt or jit or onnx or engine) and self.selected_model_device.type != 'cpu'
-        if pt or jit:
-            self.model.model.half() if self.half else self.model.model.float()
+            self.stride = self.model.stride
+            self.class_names = self.model.names
+            pt = self.model.pt
+            jit = self.model.jit
+            onnx = self.model.onnx
+            engine = self.model.engine
 
-        cudnn.benchmark = True  # set True to speed up constant image size inference
+            # FP16 supported on limited backends with CUDA
+            self.half &= (pt or jit or onnx or engine) and self.selected_model_device.type != 'cpu'
+            if pt or jit:
+                self.model.model.half() if self.half else self.model.model.float()
 
-        self.timing_report = ""
+            cudnn.benchmark = True  # set True to speed up constant image size inference
 
-        # Run inference
-        self.image_size = (self.image_width, self.image_height)
-        self.model.warmup(imgsz=(1, 3, *self.image_size), half=self.half)  # warmup
+            # Run inference
+            self.model.warmup(imgsz=(1, 3, *self.image_size), half=self.half)  # warmup
+        else:
+            raise ValueError("Invalid backend: %s. Choose torch or onnxruntime" % self.backend)
 
-    def detect(self, image):
+    def detect(self, image, draw_overlay=None):
+        """
+        :param draw_overlay: draw the overlay image for this call. Defaults to publish_overlay
+        """
         t_start = time.time()
         # Padded resize
-        trans_image = letterbox(image, self.image_size, stride=self.stride, auto=True)[0]
+        trans_image = self.letterbox(image)
 
         # Convert
         trans_image = trans_image.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
@@ -69,7 +95,7 @@ class YoloDetector:
         t0 = time.time()
 
         # Inference
-        prediction = self.model(torch_image, augment=self.augment, visualize=False)
+        prediction = self.forward(torch_image)
         t1 = time.time()
 
         # NMS
@@ -96,17 +122,129 @@ class YoloDetector:
         detection[:, :4] = scale_coords(torch_image.shape[2:], detection[:, :4], image.shape).round()
         t3 = time.time()
 
-        if self.publish_overlay:
-            annotator = Annotator(np.copy(image), line_width=self.overlay_line_thickness, example=str(self.class_names))
-            for *xyxy, confidence, class_index in reversed(detection):
-                class_index = int(class_index)
-                label = f"{self.class_names[class_index]} {confidence:.2f}"
-                annotator.box_label(xyxy, label, color=colors(class_index, True))
-            overlay_image = annotator.result()
-        else:
-            overlay_image = None
+        overlay_image = self.make_overlay(image, detection, draw_overlay)
+        t4 = time.time()
+
+        detections = self.make_detections(detection)
+        t5 = time.time()
+
+        self.set_stage_durations(t_start, t0, t1, t2, t3, t4, t5)
+        if self.report_loop_times:
+            self.timing_report = self.make_timing_report()
+
+        return detections, overlay_image
+
+    def detect_batch(self, images, draw_overlay=None):
+        """
+        Run several images through the model in one forward pass.
+        Images with the same shape are letterboxed as detect() would. Mixed shapes are letterboxed
+        to the full image size so they fit one batch.
+        Returns a list of (detections, overlay_image) in the same order as images.
+        """
+        if len(images) == 0:
+            return []
+        t_start = time.time()
+
+        same_shape = all(image.shape == images[0].shape for image in images)
+        batch = self.letterbox_batch(images, auto=same_shape)
+
+        torch_image = torch.from_numpy(batch).to(self.selected_model_device)
+        torch_image = torch_image.half() if self.half else torch_image.float()  # uint8 to fp16/32
+        torch_image /= 255  # 0 - 255 to 0.0 - 1.0
+        t0 = time.time()
+
+        # Inference
+        prediction = self.forward(torch_image)
+        t1 = time.time()
+
+        # NMS. Runs per image on the batched prediction
+        prediction = non_max_suppression(
+            prediction,
+            self.confidence_threshold,
+            self.nms_iou_threshold,
+            self.classes_filter,
+            self.agnostic_nms,
+            max_det=self.max_detections
+        )
+        t2 = time.time()
+
+        for image, detection in zip(images, prediction):
+            detection[:, :4] = scale_coords(torch_image.shape[2:], detection[:, :4], image.shape).round()
+        t3 = time.time()
+
+        overlay_images = [
+            self.make_overlay(image, detection, draw_overlay) for image, detection in zip(images, prediction)
+        ]
         t4 = time.time()
 
+        results = [
+            (self.make_detections(detection), overlay_image)
+            for detection, overlay_image in zip(prediction, overlay_images)
+        ]
+        t5 = time.time()
+
+        self.set_stage_durations(t_start, t0, t1, t2, t3, t4, t5)
+        if self.report_loop_times:
+            self.timing_report = self.make_timing_report("\tbatch size: %d\n" % len(images))
+
+        return results
+
+    def letterbox_batch(self, images, auto=True):
+        """
+        Letterbox images into a reused (N, 3, H, W) uint8 RGB buffer
+        """
+        for index, image in enumerate(images):
+            trans_image = self.letterbox(image, auto)
+            if index == 0:
+                shape = (len(images), 3, trans_image.shape[0], trans_image.shape[1])
+                if self.batch_buffer is None or self.batch_buffer.shape[1:] != shape[1:] or \
+                        len(self.batch_buffer) < len(images):
+                    self.batch_buffer = np.empty(shape, dtype=np.uint8)
+            self.batch_buffer[index] = trans_image.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
+        return self.batch_buffer[:len(images)]
+
+    def set_stage_durations(self, t_start, t_prep, t_predict, t_nms, t_scale, t_overlay, t_msg):
+        self.stage_durations = {
+            "prep": t_prep - t_start,
+            "predict": t_predict - t_prep,
+            "nms": t_nms - t_predict,
+            "scale": t_scale - t_nms,
+            "overlay": t_overlay - t_scale,
+            "msg": t_msg - t_overlay,
+        }
+
+    def make_timing_report(self, prefix=""):
+        report = prefix
+        for stage, duration in self.stage_durations.items():
+            report += "\t%s: %0.4f\n" % (stage, duration)
+        return report
+
+    def letterbox(self, image, auto=True):
+        trans_image = letterbox(image, self.image_size, stride=self.stride, auto=auto)[0]
+        if self.model_input_shape is not None and trans_image.shape[0:2] != self.model_input_shape:
+            # fixed size models need exactly their input shape
+            trans_image = letterbox(image, self.model_input_shape, stride=self.stride, auto=False)[0]
+        return trans_image
+
+    def forward(self, torch_image):
+        if self.backend == "onnxruntime":
+            return torch.from_numpy(self.model(torch_image.numpy()))
+        return self.model(torch_image, augment=self.augment, visualize=False)
+
+    def make_overlay(self, image, detection, draw_overlay=None):
+        if draw_overlay is None:
+            draw_overlay = self.publish_overlay
+        if not draw_overlay:
+            return None
+        annotator = Annotator(np.copy(image), line_width=self.overlay_line_thickness, example=str(self.class_names))
+        for *xyxy, confidence, class_index in reversed(detection):
+            class_index = int(class_index)
+            label = f"{self.class_names[class_index]} {confidence:.2f}"
+            annotator.box_label(xyxy, label, color=colors(class_index, True))
+        return annotator.result()
+
+    def make_detections(self, detection):
+        detections = {}
         class_count = {}
         for *xyxy, confidence, class_index in reversed(detection):
             if class_index not in class_count:
@@ -118,18 +256,7 @@ class YoloDetector:
             bndbox = torch.tensor(xyxy).view(1, 4).view(-1).tolist()
 
             detections[obj_id] = bndbox, confidence
-        t5 = time.time()
-
-        if self.report_loop_times:
-            self.timing_report = ""
-            self.timing_report += "\ttensor prep: %0.4f\n" % (t0 - t_start)
-            self.timing_report += "\tpredict: %0.4f\n" % (t1 - t0)
-            self.timing_report += "\tnms: %0.4f\n" % (t2 - t1)
-            self.timing_report += "\tscale: %0.4f\n" % (t3 - t2)
-            self.timing_report += "\toverlay: %0.4f\n" % (t4 - t3)
-            self.timing_report += "\tmsg: %0.4f\n" % (t5 - t4)
-
-        return detections, overlay_image
+        return detections
 
     def get_obj_id(self, class_index, class_count):
         return get_obj_id(class_index, class_count)
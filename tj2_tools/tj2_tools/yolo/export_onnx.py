@@ -0,0 +1,193 @@
+"""
+Export a yolov5 PyTorch model to ONNX for YoloDetector's onnxruntime backend and check that
+it finds the same detections as the PyTorch model on a directory of sample images.
+
+    python -m tj2_tools.yolo.export_onnx cargo_2022.pt --width 960 --height 540 --images samples/ --int8
+    python -m tj2_tools.yolo.export_onnx cargo_2022.pt --onnx cargo_2022.onnx --images samples/ --verify-only
+
+The model is exported at the letterboxed shape YoloDetector uses for width x height frames
+so both backends see the same pixels.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+import cv2
+
+from yolov5.utils.augmentations import letterbox
+
+from .detector import YoloDetector
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def get_export_shape(detector):
+    """
+    (height, width) of frames after YoloDetector's letterbox
+    """
+    dummy = np.zeros((detector.image_height, detector.image_width, 3), dtype=np.uint8)
+    return letterbox(dummy, detector.image_size, stride=detector.stride, auto=True)[0].shape[0:2]
+
+
+def export(weights_path, onnx_path, image_shape, opset=12, simplify=False):
+    from yolov5 import export as yolov5_export
+    yolov5_export.run(
+        weights=weights_path,
+        imgsz=image_shape,
+        batch_size=1,
+        device="cpu",
+        include=("onnx",),
+        opset=opset,
+        simplify=simplify,
+    )
+    exported_path = os.path.splitext(weights_path)[0] + ".onnx"
+    if os.path.abspath(exported_path) != os.path.abspath(onnx_path):
+        shutil.move(exported_path, onnx_path)
+    return onnx_path
+
+
+def quantize(onnx_path, int8_path):
+    """
+    Dynamic INT8 quantization of the model's weights
+    """
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+    return int8_path
+
+
+def box_iou(box1, box2):
+    x0 = max(box1[0], box2[0])
+    y0 = max(box1[1], box2[1])
+    x1 = min(box1[2], box2[2])
+    y1 = min(box1[3], box2[3])
+    intersection = max(0.0, x1 - x0) * max(0.0, y1 - y0)
+    area1 = (box1[2] - box1[0]) * (box1[3] - box1[1])
+    area2 = (box2[2] - box2[0]) * (box2[3] - box2[1])
+    union = area1 + area2 - intersection
+    return intersection / union if union > 0.0 else 0.0
+
+
+def match_detections(reference, candidate, iou_threshold):
+    """
+    Greedily match candidate detections to reference detections of the same class.
+    Returns a list of (iou, confidence difference) for each match
+    """
+    matches = []
+    used = set()
+    for ref_id, (ref_box, ref_confidence) in reference.items():
+        ref_class = ref_id & 0xffff
+        best = None
+        for cand_id, (cand_box, cand_confidence) in candidate.items():
+            if cand_id in used or (cand_id & 0xffff) != ref_class:
+                continue
+            iou = box_iou(ref_box, cand_box)
+            if iou >= iou_threshold and (best is None or iou > best[1]):
+                best = cand_id, iou, abs(float(ref_confidence) - float(cand_confidence))
+        if best is not None:
+            used.add(best[0])
+            matches.append(best[1:])
+    return matches
+
+
+def iter_images(directory):
+    for filename in sorted(os.listdir(directory)):
+        if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+            image = cv2.imread(os.path.join(directory, filename))
+            if image is not None:
+                yield filename, image
+
+
+def verify(torch_detector, onnx_detector, images_dir, iou_threshold):
+    num_reference = 0
+    num_candidate = 0
+    matches = []
+    durations = {"torch": [], "onnxruntime": []}
+    for filename, image in iter_images(images_dir):
+        start_time = time.perf_counter()
+        reference, _ = torch_detector.detect(image)
+        durations["torch"].append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        candidate, _ = onnx_detector.detect(image)
+        durations["onnxruntime"].append(time.perf_counter() - start_time)
+
+        num_reference += len(reference)
+        num_candidate += len(candidate)
+        matches.extend(match_detections(reference, candidate, iou_threshold))
+
+    if len(durations["torch"]) == 0:
+        raise ValueError("No images found in %s" % images_dir)
+
+    ious = [match[0] for match in matches]
+    confidence_diffs = [match[1] for match in matches]
+    return {
+        "images": len(durations["torch"]),
+        "torch_detections": num_reference,
+        "onnx_detections": num_candidate,
+        "matched": len(matches),
+        "recall": len(matches) / num_reference if num_reference else 1.0,
+        "precision": len(matches) / num_candidate if num_candidate else 1.0,
+        "mean_iou": float(np.mean(ious)) if ious else None,
+        "max_confidence_diff": float(np.max(confidence_diffs)) if confidence_diffs else None,
+        "torch_frames_per_s": len(durations["torch"]) / sum(durations["torch"]),
+        "onnx_frames_per_s": len(durations["onnxruntime"]) / sum(durations["onnxruntime"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a yolov5 model to ONNX and verify detection parity")
+    parser.add_argument("weights", help="PyTorch .pt model")
+    parser.add_argument("--onnx", default="", help="ONNX output path. Defaults to the weights path with .onnx")
+    parser.add_argument("--width", type=int, default=960, help="camera image width")
+    parser.add_argument("--height", type=int, default=540, help="camera image height")
+    parser.add_argument("--opset", type=int, default=12)
+    parser.add_argument("--simplify", action="store_true", help="simplify the graph with onnx-simplifier")
+    parser.add_argument("--int8", action="store_true", help="also write and verify an INT8 quantized model")
+    parser.add_argument("--images", default="", help="directory of sample images to verify parity on")
+    parser.add_argument("--confidence", type=float, default=0.25)
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU for two detections to match")
+    parser.add_argument("--min-recall", type=float, default=0.95, help="fail if recall or precision is below this")
+    parser.add_argument("--num-threads", type=int, default=0, help="onnxruntime intra op threads. 0 for default")
+    parser.add_argument("--verify-only", action="store_true", help="skip exporting and verify an existing model")
+    args = parser.parse_args()
+
+    onnx_path = args.onnx or os.path.splitext(args.weights)[0] + ".onnx"
+    torch_detector = YoloDetector("cpu", args.weights, args.width, args.height, args.confidence)
+
+    model_paths = [onnx_path]
+    if not args.verify_only:
+        export_shape = get_export_shape(torch_detector)
+        print("Exporting %s at %s to %s" % (args.weights, export_shape, onnx_path))
+        export(args.weights, onnx_path, export_shape, args.opset, args.simplify)
+    if args.int8:
+        int8_path = os.path.splitext(onnx_path)[0] + "_int8.onnx"
+        if not args.verify_only:
+            print("Quantizing to %s" % int8_path)
+            quantize(onnx_path, int8_path)
+        model_paths.append(int8_path)
+
+    if not args.images:
+        return
+
+    passed = True
+    results = {}
+    for path in model_paths:
+        onnx_detector = YoloDetector(
+            "cpu", path, args.width, args.height, args.confidence,
+            backend="onnxruntime", num_threads=args.num_threads, class_names=torch_detector.class_names
+        )
+        report = verify(torch_detector, onnx_detector, args.images, args.iou)
+        results[path] = report
+        if report["recall"] < args.min_recall or report["precision"] < args.min_recall:
+            passed = False
+    print(json.dumps(results, indent=4))
+    if not passed:
+        print("Detection parity check failed")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
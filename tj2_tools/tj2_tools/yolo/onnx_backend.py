@@ -0,0 +1,72 @@
+import ast
+import numpy as np
+import onnxruntime
+
+OPTIMIZATION_LEVELS = {
+    "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+class OnnxRuntimeModel:
+    """
+    CPU ONNX Runtime session for a yolov5 model exported to ONNX (optionally INT8 quantized).
+    Called with an (N, 3, H, W) float array in 0..1 and returns raw (N, anchors, 5 + classes) predictions
+    ready for non_max_suppression.
+    """
+    def __init__(self, model_path, num_threads=0, optimization_level="all"):
+        if optimization_level not in OPTIMIZATION_LEVELS:
+            raise ValueError("Invalid optimization level: %s. Choose from %s" % (
+                optimization_level, ", ".join(OPTIMIZATION_LEVELS.keys())))
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = OPTIMIZATION_LEVELS[optimization_level]
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_dtype = np.float16 if model_input.type == "tensor(float16)" else np.float32
+        self.output_name = self.session.get_outputs()[0].name
+
+        # dimensions are names instead of ints if the model was exported with dynamic axes
+        shape = model_input.shape
+        self.batch_size = shape[0] if isinstance(shape[0], int) else None
+        if isinstance(shape[2], int) and isinstance(shape[3], int):
+            self.input_shape = (shape[2], shape[3])
+        else:
+            self.input_shape = None
+
+        # yolov5's export writes stride and names into the model metadata
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.stride = int(ast.literal_eval(metadata["stride"])) if "stride" in metadata else 32
+        self.class_names = None
+        if "names" in metadata:
+            names = ast.literal_eval(metadata["names"])
+            if isinstance(names, dict):
+                names = [names[index] for index in sorted(names.keys())]
+            self.class_names = list(names)
+
+    def __call__(self, images):
+        images = np.ascontiguousarray(images, dtype=self.input_dtype)
+        if self.batch_size is None or self.batch_size == len(images):
+            return self.session.run([self.output_name], {self.input_name: images})[0]
+        # fixed batch size models run in chunks
+        predictions = []
+        for index in range(0, len(images), self.batch_size):
+            chunk = images[index: index + self.batch_size]
+            num_images = len(chunk)
+            if num_images < self.batch_size:
+                padding = np.zeros((self.batch_size - num_images,) + chunk.shape[1:], dtype=chunk.dtype)
+                chunk = np.concatenate((chunk, padding))
+            predictions.append(self.session.run([self.output_name], {self.input_name: chunk})[0][:num_images])
+        return np.concatenate(predictions)
+
+    def warmup(self):
+        if self.input_shape is None:
+            return
+        batch_size = 1 if self.batch_size is None else self.batch_size
+        self(np.zeros((batch_size, 3) + self.input_shape, dtype=self.input_dtype))
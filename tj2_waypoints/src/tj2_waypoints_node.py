@@ -9,9 +9,9 @@ import actionlib
 import dynamic_reconfigure.client
 
 import tf2_ros
-import tf_conversions
 import tf2_geometry_msgs
-from tf.transformations import euler_from_quaternion, quaternion_from_euler
+
+from tj2_tools.robot_state import yaw_to_quat, quat_msg_to_yaw
 
 from geometry_msgs.msg import Twist
 from geometry_msgs.msg import PoseStamped
@@ -464,18 +464,13 @@ class Tj2Waypoints:
     def pose_to_waypoint(self, pose):
         # pose: PoseStamped
         # returns: list, [x, y, theta]
-        yaw = euler_from_quaternion([
-            pose.pose.orientation.x,
-            pose.pose.orientation.y,
-            pose.pose.orientation.z,
-            pose.pose.orientation.w,
-        ])[2]
+        yaw = quat_msg_to_yaw(pose.pose.orientation)
         return [pose.pose.position.x, pose.pose.position.y, yaw]
 
     def waypoint_to_pose(self, waypoint):
         # waypoint: list, [x, y, theta]
         # returns: PoseStamped
-        quat = quaternion_from_euler(0.0, 0.0, waypoint[2])
+        quat = yaw_to_quat(waypoint[2])
         pose = PoseStamped()
         pose.header.frame_id = self.map_frame
         pose.pose.position.x = waypoint[0]
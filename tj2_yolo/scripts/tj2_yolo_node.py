@@ -28,60 +28,92 @@ from sensor_msgs.msg import CompressedImage
 from image_geometry import PinholeCameraModel
 
 from geometry_msgs.msg import Pose
-from geometry_msgs.msg import PoseStamped
-
-import tf2_geometry_msgs
 
 from visualization_msgs.msg import MarkerArray
 from visualization_msgs.msg import Marker
 
 from std_msgs.msg import ColorRGBA
 
+from diagnostic_msgs.msg import DiagnosticArray
+from diagnostic_msgs.msg import DiagnosticStatus
+from diagnostic_msgs.msg import KeyValue
+
 from message_filters import ApproximateTimeSynchronizer
 from message_filters import TimeSynchronizer
 from message_filters import Subscriber
 
 from cv_bridge import CvBridge, CvBridgeError
 
-from tj2_tools.transforms import lookup_transform
+from tj2_tools.transforms import transform_to_matrix, transform_points, project_pixels_to_rays
 from tj2_tools.yolo.detector import YoloDetector
+from tj2_tools.yolo.depth_sampling import sample_box_depths, parse_depth_statistic
+from tj2_tools.pipeline import LatestSlot, StageTimings, PipelineWorker
+from tj2_tools.pipeline.replay import NullPublisher
 
 
 class Tj2Yolo:
-    def __init__(self):
+    def __init__(self, offline_params=None):
+        """
+        :param offline_params: if not None, run without a ROS master. Parameters are read from this dict
+            (keys without the leading ~), nothing is subscribed to, and publishing does nothing.
+            Frames are fed in by calling compute_detections. See tj2_yolo_replay.py
+        """
         self.name = "tj2_yolo"
-        rospy.init_node(
-            self.name
-        )
-
-        self.model_device = rospy.get_param("~model_device", "0")
-        self.model_path = rospy.get_param("~model_path", "./yolov5s.pt")
-        self.image_width_param = rospy.get_param("~image_width_param", "/camera/realsense2_camera/color_width")
-        self.image_height_param = rospy.get_param("~image_height_param", "/camera/realsense2_camera/color_height")
-        self.image_width = rospy.get_param(self.image_width_param, 960)
-        self.image_height = rospy.get_param(self.image_height_param, 540)
-        self.publish_overlay = rospy.get_param("~publish_overlay", True)
-        self.confidence_threshold = rospy.get_param("~confidence_threshold", 0.25)
-        self.nms_iou_threshold = rospy.get_param("~nms_iou_threshold", 0.45)
-        self.max_detections = rospy.get_param("~max_detections", 100)  # maximum detections per image
-        self.use_depth = rospy.get_param("~use_depth", True)
-        self.z_depth_estimations = rospy.get_param("~z_depth_estimations", None)
+        self.offline_params = offline_params
+        self.offline = offline_params is not None
+        if not self.offline:
+            rospy.init_node(
+                self.name
+            )
+
+        self.model_device = self.get_param("~model_device", "0")
+        self.model_path = self.get_param("~model_path", "./yolov5s.pt")
+        # "torch" or "onnxruntime" (CPU only, model_path must be an ONNX model. See tj2_tools.yolo.export_onnx)
+        self.backend = self.get_param("~backend", "torch")
+        self.num_threads = self.get_param("~num_threads", 0)  # onnxruntime threads. 0 uses all cores
+        self.image_width_param = self.get_param("~image_width_param", "/camera/realsense2_camera/color_width")
+        self.image_height_param = self.get_param("~image_height_param", "/camera/realsense2_camera/color_height")
+        self.image_width = self.get_param(self.image_width_param, 960)
+        self.image_height = self.get_param(self.image_height_param, 540)
+        self.publish_overlay = self.get_param("~publish_overlay", True)
+        self.confidence_threshold = self.get_param("~confidence_threshold", 0.25)
+        self.nms_iou_threshold = self.get_param("~nms_iou_threshold", 0.45)
+        self.max_detections = self.get_param("~max_detections", 100)  # maximum detections per image
+        self.use_depth = self.get_param("~use_depth", True)
+        self.z_depth_estimations = self.get_param("~z_depth_estimations", None)
         if self.z_depth_estimations is None:
             self.z_depth_estimations = {}
-        self.base_frame = rospy.get_param("~base_frame", "base_link")
-        marker_persistance_s = rospy.get_param("~marker_persistance", 0.5)
+        self.base_frame = self.get_param("~base_frame", "base_link")
+        # wait this long (seconds) for the camera to base transform at the image's stamp
+        self.tf_timeout = rospy.Duration(self.get_param("~tf_timeout", 0.02))
+        marker_persistance_s = self.get_param("~marker_persistance", 0.5)
         self.marker_persistance = rospy.Duration(marker_persistance_s)
-        self.bounding_box_border_px = rospy.get_param("~bounding_box_border_px", 10)
-        self.report_loop_times = rospy.get_param("~report_loop_times", True)
-        self.sync_method = rospy.get_param("~sync_method", "approx_sync")
-        self.publish_delayed_image = rospy.get_param("~publish_delayed_image", True)
+        self.bounding_box_border_px = self.get_param("~bounding_box_border_px", 10)
+        # depth of each detection: "mean", "median", or a percentile (0..100) of the valid depth pixels
+        self.depth_statistic = parse_depth_statistic(self.get_param("~depth_statistic", "mean"))
+        self.report_loop_times = self.get_param("~report_loop_times", True)
+        self.sync_method = self.get_param("~sync_method", "approx_sync")
+        self.publish_delayed_image = self.get_param("~publish_delayed_image", True)
+        # overlays are only drawn when someone subscribes, at most overlay_rate Hz (0 for every frame)
+        self.overlay_rate = self.get_param("~overlay_rate", 10.0)
+        self.overlay_scale = self.get_param("~overlay_scale", 1.0)  # resize factor applied before publishing
+        self.overlay_jpeg_quality = self.get_param("~overlay_jpeg_quality", 0)  # 1..100 publishes JPEG on overlay/compressed
+        self.marker_rate = self.get_param("~marker_rate", 30.0)
+        # Run decode, inference, and post processing in separate threads. Each stage only
+        # ever works on the newest frame handed to it. Stale frames are dropped
+        self.pipeline_mode = self.get_param("~pipeline_mode", False)
+        self.publish_diagnostics = self.get_param("~publish_diagnostics", True)
+        self.diagnostics_rate = self.get_param("~diagnostics_rate", 1.0)
+        self.timing_window = self.get_param("~timing_window", 100)  # number of frames per stage statistics
 
         self.yolo = YoloDetector(
             self.model_device, self.model_path, self.image_width, self.image_height,
             self.confidence_threshold, self.nms_iou_threshold, self.max_detections,
-            self.report_loop_times, self.publish_overlay
+            self.report_loop_times, self.publish_overlay,
+            backend=self.backend, num_threads=self.num_threads
         )
 
+        self.last_overlay_time = 0.0
         self.label_colors = {}
         self.camera_model = None
         self.detection_result = Detection3DArray()
@@ -93,8 +125,11 @@ class Tj2Yolo:
         self.depth_image_sub = None
 
         self.bridge = CvBridge()
+        self.color_info_sub = None
 
-        if self.use_depth:
+        if self.offline:
+            pass
+        elif self.use_depth:
             if self.sync_method == "approx_sync":
                 rospy.loginfo("Synchronizing using approximate sync method")
                 self.color_image_sub = self.make_color_sync_sub()
@@ -117,19 +152,45 @@ class Tj2Yolo:
         else:
             self.color_image_sub = self.make_color_sub()
 
-        self.color_info_sub = rospy.Subscriber("color/camera_info", CameraInfo, self.info_callback, queue_size=5)
+        if not self.offline:
+            self.color_info_sub = rospy.Subscriber("color/camera_info", CameraInfo, self.info_callback, queue_size=5)
         
-        self.overlay_pub = rospy.Publisher("overlay", Image, queue_size=1)
-        # self.overlay_compressed_pub = rospy.Publisher("overlay/compressed", CompressedImage, queue_size=1)
-        self.delayed_image_pub = rospy.Publisher("delayed_image", Image, queue_size=1)
-        self.detections_pub = rospy.Publisher("detections", Detection3DArray, queue_size=25)
-        self.markers_pub = rospy.Publisher("markers", MarkerArray, queue_size=25)
+        self.overlay_pub = self.make_publisher("overlay", Image, queue_size=1)
+        self.overlay_compressed_pub = self.make_publisher("overlay/compressed", CompressedImage, queue_size=1)
+        self.delayed_image_pub = self.make_publisher("delayed_image", Image, queue_size=1)
+        self.detections_pub = self.make_publisher("detections", Detection3DArray, queue_size=25)
+        self.markers_pub = self.make_publisher("markers", MarkerArray, queue_size=25)
+        self.diagnostics_pub = self.make_publisher("/diagnostics", DiagnosticArray, queue_size=5)
 
         self.tf_buffer = tf2_ros.Buffer()
-        self.tf_listener = tf2_ros.TransformListener(self.tf_buffer)
+        if self.offline:
+            self.tf_listener = None
+        else:
+            self.tf_listener = tf2_ros.TransformListener(self.tf_buffer)
+
+        self.stage_timings = StageTimings(self.timing_window)
+        self.pipeline_workers = []
+        self.decode_slot = None
+        if self.pipeline_mode:
+            self.start_pipeline()
+
+        if self.publish_diagnostics and not self.offline:
+            self.diagnostics_timer = rospy.Timer(rospy.Duration(1.0 / self.diagnostics_rate), self.diagnostics_callback)
+        else:
+            self.diagnostics_timer = None
         
         rospy.loginfo("%s is ready" % self.name)
     
+    def get_param(self, name, default):
+        if self.offline:
+            return self.offline_params.get(name.lstrip("~"), default)
+        return rospy.get_param(name, default)
+
+    def make_publisher(self, topic, msg_type, queue_size):
+        if self.offline:
+            return NullPublisher()
+        return rospy.Publisher(topic, msg_type, queue_size=queue_size)
+
     def make_color_sub(self):
         return rospy.Subscriber("color/image_raw", Image, self.image_callback, queue_size=1, buff_size=2<<31)
 
@@ -145,79 +206,151 @@ class Tj2Yolo:
     def make_depth_sync_sub(self):
         return Subscriber("depth/image_raw", Image, buff_size=2<<31)
 
+    def start_pipeline(self):
+        rospy.loginfo("Running detection as a pipeline")
+        self.decode_slot = LatestSlot()
+        infer_slot = LatestSlot()
+        publish_slot = LatestSlot()
+        self.pipeline_workers = [
+            PipelineWorker("decode", self.decode_frame, self.decode_slot, infer_slot, self.stage_timings),
+            PipelineWorker("infer", self.infer_frame, infer_slot, publish_slot, self.stage_timings),
+            PipelineWorker("publish", self.pipelined_publish_frame, publish_slot, None, self.stage_timings),
+        ]
+        for worker in self.pipeline_workers:
+            worker.start()
+        rospy.on_shutdown(self.stop_pipeline)
+
+    def stop_pipeline(self):
+        for worker in self.pipeline_workers:
+            worker.stop()
+
+    def get_pipeline_drop_counts(self):
+        return {worker.name: worker.input_slot.num_dropped for worker in self.pipeline_workers}
+
     def info_callback(self, msg):
         self.camera_model = PinholeCameraModel()
         self.camera_model.fromCameraInfo(msg)
-        self.color_info_sub.unregister()  # only use the first message
+        if self.color_info_sub is not None:
+            self.color_info_sub.unregister()  # only use the first message
         rospy.loginfo("Camera model loaded")
 
     def rgbd_callback(self, color_msg, depth_msg):
-        self.compute_detections(color_msg, depth_msg)
+        self.handle_frame(color_msg, depth_msg)
     
     def depth_callback(self, depth_msg):
         self.last_depth_msg = depth_msg
 
     def image_callback(self, msg):
-        self.compute_detections(msg, self.last_depth_msg)
+        self.handle_frame(msg, self.last_depth_msg)
+
+    def handle_frame(self, color_msg, depth_msg):
+        if self.pipeline_mode:
+            # hand off and return so the subscriber queues never back up
+            self.decode_slot.put((color_msg, depth_msg, time.time()))
+        else:
+            self.compute_detections(color_msg, depth_msg)
     
     def compute_detections(self, color_msg, depth_msg):
         t_start = time.time()
+        frame = self.decode_frame(color_msg, depth_msg, t_start)
+        if frame is None:
+            return
+        t_detect_start = time.time()
+        frame = self.infer_frame(*frame)
+        t_detect = time.time()
+        if self.report_loop_times:
+            self.timing_report = "------\n"
+            self.timing_report += self.yolo.timing_report
+        self.publish_frame(*frame)
+
+        t_end = time.time()
+        self.stage_timings.record("decode", t_detect_start - t_start)
+        self.stage_timings.record("infer", t_detect - t_detect_start)
+        self.stage_timings.record("publish", t_end - t_detect)
+        self.stage_timings.record("total", t_end - t_start)
+        self.stage_timings.record("latency", t_end - color_msg.header.stamp.to_sec())
+        if self.report_loop_times:
+            self.timing_report += "detect: %0.4f\n" % (t_detect - t_detect_start)
+            self.timing_report += "total: %0.4f\n" % (t_end - t_start)
+            self.timing_report += "since image start: %0.4f\n" % (t_start - color_msg.header.stamp.to_sec())
+            self.timing_report += "since image end: %0.4f\n" % (t_end - color_msg.header.stamp.to_sec())
+            rospy.loginfo_throttle(0.5, self.timing_report)
+
+    def decode_frame(self, color_msg, depth_msg, receive_time):
         color_image = self.get_color_cv_image(color_msg)
         if color_image is None:
-            return
+            return None
         if depth_msg is not None:
             depth_image = self.get_depth_cv_image(depth_msg)
             if depth_image is None:
-                return
+                return None
         else:
             depth_image = None
-        t_detect_start = time.time()
+        return color_msg, color_image, depth_image, receive_time
+
+    def infer_frame(self, color_msg, color_image, depth_image, receive_time):
+        detection_2d_arr_msg, overlay_image = self.detect(color_image, self.is_overlay_due())
+        self.stage_timings.record_many(self.yolo.stage_durations, "yolo/")
+        return color_msg, color_image, depth_image, receive_time, detection_2d_arr_msg, overlay_image
+
+    def pipelined_publish_frame(self, color_msg, color_image, depth_image, receive_time, detection_2d_arr_msg, overlay_image):
         if self.report_loop_times:
             self.timing_report = "------\n"
-        detection_2d_arr_msg = self.get_detections_from_color(color_image)
+        self.publish_frame(color_msg, color_image, depth_image, receive_time, detection_2d_arr_msg, overlay_image)
+        t_end = time.time()
+        self.stage_timings.record("latency", t_end - color_msg.header.stamp.to_sec())
         if self.report_loop_times:
-            self.timing_report += self.yolo.timing_report
-        t_detect = time.time()
+            self.timing_report += self.stage_timings.report()
+            self.timing_report += "dropped: %s\n" % self.get_pipeline_drop_counts()
+            self.timing_report += "since receive: %0.4f\n" % (t_end - receive_time)
+            self.timing_report += "since image end: %0.4f\n" % (t_end - color_msg.header.stamp.to_sec())
+            rospy.loginfo_throttle(0.5, self.timing_report)
+
+    def publish_frame(self, color_msg, color_image, depth_image, receive_time, detection_2d_arr_msg, overlay_image):
+        t_overlay_start = time.time()
+        self.publish_overlay_image(overlay_image)
+
         detection_3d_arr_msg = Detection3DArray()
         detection_3d_arr_msg.header = detection_2d_arr_msg.header
 
+        t_depth_start = time.time()
+        if depth_image is not None:
+            z_dists = self.get_depths_from_detections(depth_image, detection_2d_arr_msg.detections)
+        else:
+            z_dists = [1.0] * len(detection_2d_arr_msg.detections)
+        if self.report_loop_times:
+            self.timing_report += "\tget_depths_from_detections: %0.4f\n" % (time.time() - t_depth_start)
+
+        t0 = time.time()
         for detection_2d_msg in detection_2d_arr_msg.detections:
-            t0 = time.time()
             color = self.get_detection_color(color_image, detection_2d_msg)
             self.marker_colors[detection_2d_msg.results[0].id] = color
-            t1 = time.time()
-            if depth_image is not None:
-                z_dist = self.get_depth_from_detection(depth_image, detection_2d_msg)
-            else:
-                z_dist = 1.0
-            t2 = time.time()
-            detection_3d_msg = self.detection_2d_to_3d(detection_2d_msg, z_dist)
-            t3 = time.time()
-            if detection_3d_msg is None:
-                continue
-            self.tf_detection_pose_to_robot(detection_3d_msg)
-            t4 = time.time()
-            if self.report_loop_times:
-                label, count = self.get_detection_label(detection_2d_msg)
-                self.timing_report += "\t%s-%s\n" % (label, count)
-                self.timing_report += "\t\tget_detection_color: %0.4f\n" % (t1 - t0)
-                self.timing_report += "\t\tget_depth_from_detection: %0.4f\n" % (t2 - t1)
-                self.timing_report += "\t\tdetection_2d_to_3d: %0.4f\n" % (t3 - t2)
-                self.timing_report += "\t\ttf_detection_pose_to_robot: %0.4f\n" % (t4 - t3)
-            detection_3d_arr_msg.detections.append(detection_3d_msg)
-        
+        t1 = time.time()
+        detection_3d_arr_msg.detections = self.detections_2d_to_3d(detection_2d_arr_msg.detections, z_dists)
+        t2 = time.time()
+        self.tf_detections_to_robot(detection_3d_arr_msg.detections, color_msg.header.stamp)
+        t3 = time.time()
+        if self.report_loop_times:
+            self.timing_report += "\tdetections: %s\n" % len(detection_3d_arr_msg.detections)
+            self.timing_report += "\tget_detection_color: %0.4f\n" % (t1 - t0)
+            self.timing_report += "\tdetections_2d_to_3d: %0.4f\n" % (t2 - t1)
+            self.timing_report += "\ttf_detections_to_robot: %0.4f\n" % (t3 - t2)
+
         self.detection_result = detection_3d_arr_msg
 
-        t_end = time.time()
-        if self.report_loop_times:
-            self.timing_report += "detect: %0.4f\n" % (t_detect - t_detect_start)
-            self.timing_report += "total: %0.4f\n" % (t_end - t_start)
-            self.timing_report += "since image start: %0.4f\n" % (t_start - color_msg.header.stamp.to_sec())
-            self.timing_report += "since image end: %0.4f\n" % (t_end - color_msg.header.stamp.to_sec())
-            rospy.loginfo_throttle(0.5, self.timing_report)
         self.detections_pub.publish(detection_3d_arr_msg)
-        if self.publish_delayed_image:
+        if self.publish_delayed_image and self.delayed_image_pub.get_num_connections() > 0:
             self.delayed_image_pub.publish(color_msg)
+        t4 = time.time()
+
+        self.stage_timings.record_many({
+            "overlay_publish": t_depth_start - t_overlay_start,
+            "depth": t0 - t_depth_start,
+            "color": t1 - t0,
+            "project": t2 - t1,
+            "tf": t3 - t2,
+            "detections_publish": t4 - t3,
+        })
     
     def get_color_cv_image(self, msg):
         try:
@@ -233,26 +366,56 @@ class Tj2Yolo:
             rospy.logerr(e)
             return None
 
-    def get_detections_from_color(self, color_image):
-        detection_arr_msg, overlay_image = self.detect(color_image)
-        if self.publish_overlay and overlay_image is not None:
-            try:
-                # compressed_msg = CompressedImage()
-                # compressed_msg.header.stamp = rospy.Time.now()
-                # compressed_msg.format = "jpeg"
-                # compressed_msg.data = np.array(cv2.imencode('.jpg', overlay_image)[1]).tobytes()
-                # self.overlay_compressed_pub.publish(compressed_msg)
-                
+    def get_overlay_pub(self):
+        return self.overlay_compressed_pub if self.overlay_jpeg_quality > 0 else self.overlay_pub
+
+    def is_overlay_due(self):
+        """
+        Only draw overlays that someone will see, at most overlay_rate times per second
+        """
+        if not self.publish_overlay:
+            return False
+        if self.get_overlay_pub().get_num_connections() == 0:
+            return False
+        now = time.time()
+        if self.overlay_rate > 0.0 and now - self.last_overlay_time < 1.0 / self.overlay_rate:
+            return False
+        self.last_overlay_time = now
+        return True
+
+    def publish_overlay_image(self, overlay_image):
+        if not self.publish_overlay or overlay_image is None:
+            return
+        if self.overlay_scale != 1.0:
+            overlay_image = cv2.resize(overlay_image, None, fx=self.overlay_scale, fy=self.overlay_scale, interpolation=cv2.INTER_AREA)
+        try:
+            if self.overlay_jpeg_quality > 0:
+                compressed_msg = CompressedImage()
+                compressed_msg.header.stamp = rospy.Time.now()
+                compressed_msg.format = "jpeg"
+                success, encoded = cv2.imencode(".jpg", overlay_image, [cv2.IMWRITE_JPEG_QUALITY, self.overlay_jpeg_quality])
+                if not success:
+                    rospy.logerr("Failed to encode overlay image")
+                    return
+                compressed_msg.data = encoded.tobytes()
+                self.overlay_compressed_pub.publish(compressed_msg)
+            else:
                 overlay_msg = self.bridge.cv2_to_imgmsg(overlay_image, encoding="bgr8")
                 self.overlay_pub.publish(overlay_msg)
-            except TypeError as e:
-                rospy.logerr("Exception occurred while converting frame: %s. %s" % (e, overlay_image.shape))
-        return detection_arr_msg
+        except TypeError as e:
+            rospy.logerr("Exception occurred while converting frame: %s. %s" % (e, overlay_image.shape))
 
     def get_depth_from_detection(self, depth_image, detection_2d_msg):
-        depth = self.get_bbox_mean(depth_image, detection_2d_msg)[0]
-        depth /= 1000.0  # depth image encoded in mm
-        return depth
+        return self.get_depths_from_detections(depth_image, [detection_2d_msg])[0]
+
+    def get_depths_from_detections(self, depth_image, detection_2d_msgs):
+        boxes = [
+            (msg.bbox.center.x, msg.bbox.center.y, msg.bbox.size_x, msg.bbox.size_y)
+            for msg in detection_2d_msgs
+        ]
+        depths = sample_box_depths(depth_image, boxes, self.bounding_box_border_px, self.depth_statistic)
+        depths /= 1000.0  # depth image encoded in mm
+        return depths.tolist()
     
     def get_detection_color(self, color_image, detection_2d_msg):
         # return self.get_color_with_mask(color_image, detection_2d_msg)
@@ -298,45 +461,81 @@ class Tj2Yolo:
         target_mask = cv2.bitwise_and(circle_mask, nonzero_mask)
         return cv2.mean(image, target_mask)
 
-    def detection_2d_to_3d(self, detection_2d_msg, z_dist):
-        center_point, box_size = self.get_detection_3d_box(detection_2d_msg, z_dist)
-        if center_point is None or box_size is None:
-            return None
-
-        detection_3d_msg = Detection3D()
-        detection_3d_msg.header.stamp = detection_2d_msg.header.stamp
-        detection_3d_msg.results = detection_2d_msg.results
-
-        pose = Pose()
-        pose.position.x = center_point[0]
-        pose.position.y = center_point[1]
-        pose.position.z = center_point[2]
-        pose.orientation.w = 1.0
-        pose.orientation.x = 0.0
-        pose.orientation.y = 0.0
-        pose.orientation.z = 0.0
-
-        detection_3d_msg.header.frame_id = self.camera_model.tfFrame()
-        detection_3d_msg.results[0].pose.pose = pose
-        detection_3d_msg.bbox.center = pose
-        detection_3d_msg.bbox.size.x = box_size[0]
-        detection_3d_msg.bbox.size.y = box_size[1]
-        detection_3d_msg.bbox.size.z = box_size[2]
-
-        return detection_3d_msg
-
-    def tf_detection_pose_to_robot(self, detection_3d_msg):
-        transform = lookup_transform(self.tf_buffer, self.base_frame, detection_3d_msg.header.frame_id)
+    def detections_2d_to_3d(self, detection_2d_msgs, z_dists):
+        centers, box_sizes = self.get_detection_3d_boxes(detection_2d_msgs, z_dists)
+        if centers is None or box_sizes is None:
+            return []
+
+        frame_id = self.camera_model.tfFrame()
+        detection_3d_msgs = []
+        for detection_2d_msg, center_point, box_size in zip(detection_2d_msgs, centers.tolist(), box_sizes.tolist()):
+            detection_3d_msg = Detection3D()
+            detection_3d_msg.header.stamp = detection_2d_msg.header.stamp
+            detection_3d_msg.results = detection_2d_msg.results
+
+            pose = Pose()
+            pose.position.x = center_point[0]
+            pose.position.y = center_point[1]
+            pose.position.z = center_point[2]
+            pose.orientation.w = 1.0
+            pose.orientation.x = 0.0
+            pose.orientation.y = 0.0
+            pose.orientation.z = 0.0
+
+            detection_3d_msg.header.frame_id = frame_id
+            detection_3d_msg.results[0].pose.pose = pose
+            detection_3d_msg.bbox.center = pose
+            detection_3d_msg.bbox.size.x = box_size[0]
+            detection_3d_msg.bbox.size.y = box_size[1]
+            detection_3d_msg.bbox.size.z = box_size[2]
+
+            detection_3d_msgs.append(detection_3d_msg)
+
+        return detection_3d_msgs
+
+    def lookup_camera_transform(self, camera_frame, stamp=None):
+        """
+        Camera to base frame transform at the image's stamp, or the latest transform if that isn't available
+        """
+        stamps = [rospy.Time(0)] if stamp is None else [stamp, rospy.Time(0)]
+        for lookup_stamp in stamps:
+            try:
+                return self.tf_buffer.lookup_transform(self.base_frame, camera_frame, lookup_stamp, self.tf_timeout)
+            except (tf2_ros.LookupException, tf2_ros.ConnectivityException, tf2_ros.ExtrapolationException) as e:
+                error = e
+        rospy.logwarn_throttle(1.0, "Failed to look up %s to %s. %s" % (camera_frame, self.base_frame, error))
+        return None
+
+    def tf_detections_to_robot(self, detection_3d_msgs, stamp=None):
+        """
+        Transform all detections (which share a camera frame) to the robot frame with a single lookup
+        """
+        if len(detection_3d_msgs) == 0:
+            return
+        transform = self.lookup_camera_transform(detection_3d_msgs[0].header.frame_id, stamp)
         if transform is None:
-            rospy.logwarn_throttle(1.0, "Can't transform detection to robot frame. Skipping")
+            rospy.logwarn_throttle(1.0, "Can't transform detections to robot frame. Skipping")
             return
-        pose_stamped = PoseStamped()
-        pose_stamped.header.frame_id = detection_3d_msg.header.frame_id
-        pose_stamped.pose = detection_3d_msg.results[0].pose.pose
-        robot_pose = tf2_geometry_msgs.do_transform_pose(pose_stamped, transform)
-        detection_3d_msg.results[0].pose.pose = robot_pose.pose
-        detection_3d_msg.bbox.center = robot_pose.pose
-        detection_3d_msg.header = robot_pose.header
+        camera_points = [
+            (msg.results[0].pose.pose.position.x, msg.results[0].pose.pose.position.y, msg.results[0].pose.pose.position.z)
+            for msg in detection_3d_msgs
+        ]
+        robot_points = transform_points(transform_to_matrix(transform), camera_points)
+
+        # detection orientations are identity so the transformed orientation is the transform's rotation
+        rotation = transform.transform.rotation
+        for detection_3d_msg, robot_point in zip(detection_3d_msgs, robot_points.tolist()):
+            robot_pose = Pose()
+            robot_pose.position.x = robot_point[0]
+            robot_pose.position.y = robot_point[1]
+            robot_pose.position.z = robot_point[2]
+            robot_pose.orientation.x = rotation.x
+            robot_pose.orientation.y = rotation.y
+            robot_pose.orientation.z = rotation.z
+            robot_pose.orientation.w = rotation.w
+            detection_3d_msg.results[0].pose.pose = robot_pose
+            detection_3d_msg.bbox.center = robot_pose
+            detection_3d_msg.header = transform.header
 
     def add_detection_to_marker_array(self, marker_array, detection_3d_msg, color):
         sphere_marker = self.make_marker(detection_3d_msg, color)
@@ -378,28 +577,39 @@ class Tj2Yolo:
     def get_detection_label(self, detection_msg):
         return self.yolo.get_label(detection_msg.results[0].id)
 
-    def get_detection_3d_box(self, detection_msg, z_dist):
+    def get_detection_3d_boxes(self, detection_msgs, z_dists):
+        """
+        Camera frame centers and sizes of all detections as (N, 3) arrays.
+        All center and corner pixels are projected in one vectorized call
+        """
         if self.camera_model is None:
             rospy.logerr_throttle(0.5, "No camera model has been loaded! Is the info topic publish messages?")
             return None, None
-        center_x = int(detection_msg.bbox.center.x)
-        center_y = int(detection_msg.bbox.center.y)
-        ray = self.camera_model.projectPixelTo3dRay((center_x, center_y))
-        x_dist = ray[0] * z_dist
-        y_dist = ray[1] * z_dist
-
-        label, count = self.get_detection_label(detection_msg)
-        edge_point_x = center_x - int(detection_msg.bbox.size_x / 2.0)
-        edge_point_y = center_y - int(detection_msg.bbox.size_y / 2.0)
-        ray = self.camera_model.projectPixelTo3dRay((edge_point_x, edge_point_y))
-        x_size = abs(ray[0] * z_dist - x_dist) * 2.0
-        y_size = abs(ray[1] * z_dist - y_dist) * 2.0
-        z_size = self.z_depth_estimations.get(label, 0.01)
-
-        return (x_dist, y_dist, z_dist), (x_size, y_size, z_size)
-
-    def detect(self, image):
-        detections, overlay_image = self.yolo.detect(image)
+        num_detections = len(detection_msgs)
+        boxes = np.array([
+            (msg.bbox.center.x, msg.bbox.center.y, msg.bbox.size_x, msg.bbox.size_y)
+            for msg in detection_msgs
+        ], dtype=np.float64).reshape(-1, 4)
+        z_dists = np.asarray(z_dists, dtype=np.float64)
+
+        centers_px = boxes[:, 0:2].astype(np.int64)
+        edges_px = centers_px - (boxes[:, 2:4] / 2.0).astype(np.int64)
+        rays = project_pixels_to_rays(self.camera_model, np.concatenate((centers_px, edges_px)))
+        center_rays = rays[:num_detections]
+        edge_rays = rays[num_detections:]
+
+        centers = np.empty((num_detections, 3))
+        centers[:, 0:2] = center_rays[:, 0:2] * z_dists[:, np.newaxis]
+        centers[:, 2] = z_dists
+
+        sizes = np.empty((num_detections, 3))
+        sizes[:, 0:2] = np.abs(edge_rays[:, 0:2] * z_dists[:, np.newaxis] - centers[:, 0:2]) * 2.0
+        sizes[:, 2] = [self.z_depth_estimations.get(self.get_detection_label(msg)[0], 0.01) for msg in detection_msgs]
+
+        return centers, sizes
+
+    def detect(self, image, draw_overlay=None):
+        detections, overlay_image = self.yolo.detect(image, draw_overlay)
         
         detection_arr_msg = Detection2DArray()
         detection_arr_msg.header.stamp = rospy.Time.now()
@@ -422,9 +632,39 @@ class Tj2Yolo:
         return detection_arr_msg, overlay_image
 
 
+    def diagnostics_callback(self, timer=None):
+        self.diagnostics_pub.publish(self.get_diagnostics_msg())
+
+    def get_diagnostics_msg(self):
+        """
+        One status per stage with p50/p99/mean/max in milliseconds and the duration histogram
+        """
+        diagnostics_msg = DiagnosticArray()
+        diagnostics_msg.header.stamp = rospy.Time.now()
+        drop_counts = self.get_pipeline_drop_counts()
+        for stage, stats in self.stage_timings.summary().items():
+            status = DiagnosticStatus()
+            status.level = DiagnosticStatus.OK
+            status.name = "%s: %s" % (self.name, stage)
+            status.hardware_id = self.name
+            status.message = "p50 %0.1f ms, p99 %0.1f ms" % (stats["p50"] * 1000.0, stats["p99"] * 1000.0)
+            status.values.append(KeyValue("count", str(stats["count"])))
+            for key in ("p50", "p99", "mean", "max"):
+                status.values.append(KeyValue(key + "_ms", "%0.3f" % (stats[key] * 1000.0)))
+            for edge, count in self.stage_timings.histogram(stage):
+                bucket = "le_%gms" % (edge * 1000.0) if edge is not None else "gt_%gms" % (self.stage_timings.histogram_edges[-1] * 1000.0)
+                status.values.append(KeyValue(bucket, str(count)))
+            if stage in drop_counts:
+                status.values.append(KeyValue("dropped", str(drop_counts[stage])))
+            diagnostics_msg.status.append(status)
+        return diagnostics_msg
+
     def run(self):
-        clock_rate = rospy.Rate(30)
+        clock_rate = rospy.Rate(self.marker_rate)
         while not rospy.is_shutdown():
+            clock_rate.sleep()
+            if self.markers_pub.get_num_connections() == 0:
+                continue
             markers = MarkerArray()
             for detection_3d_msg in self.detection_result.detections:
                 if rospy.Time.now() - detection_3d_msg.header.stamp > self.marker_persistance:
@@ -432,7 +672,6 @@ class Tj2Yolo:
                 color = self.marker_colors[detection_3d_msg.results[0].id]
                 self.add_detection_to_marker_array(markers, detection_3d_msg, color)
             self.markers_pub.publish(markers)
-            clock_rate.sleep()
 
 
 def main():
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Replay color/depth frames through Tj2Yolo's processing path without a ROS master and report
+frames/s and per-stage p50/p99 latencies as JSON.
+
+    ./tj2_yolo_replay.py --model cargo_2022.pt --bag match.bag
+    ./tj2_yolo_replay.py --model cargo_2022.onnx --param backend=onnxruntime --images frames/ --depth-images depth/
+
+Frames are loaded into memory before timing starts. The camera to base frame transform is identity.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import cv2
+import rospy
+
+from cv_bridge import CvBridge
+
+from tj2_tools.pipeline.replay import parse_param, make_camera_info, set_identity_transform, replay, summarize_timings
+from tj2_yolo_node import Tj2Yolo
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def load_bag_frames(path, color_topic, depth_topic, info_topic, max_frames):
+    """
+    Returns a list of (color, depth) messages and the first camera info message.
+    Each color frame is paired with the latest depth frame before it
+    """
+    import rosbag
+    frames = []
+    info_msg = None
+    depth_msg = None
+    with rosbag.Bag(path) as bag:
+        for topic, msg, timestamp in bag.read_messages(topics=[color_topic, depth_topic, info_topic]):
+            if topic == info_topic:
+                if info_msg is None:
+                    info_msg = msg
+            elif topic == depth_topic:
+                depth_msg = msg
+            elif topic == color_topic:
+                frames.append((msg, depth_msg))
+                if len(frames) >= max_frames:
+                    break
+    return frames, info_msg
+
+
+def load_image_frames(color_dir, depth_dir, max_frames):
+    """
+    Color images are read as BGR. Depth images (matched by file name) are read unchanged, typically 16 bit mm
+    """
+    bridge = CvBridge()
+    frames = []
+    for filename in sorted(os.listdir(color_dir)):
+        if os.path.splitext(filename)[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        color_image = cv2.imread(os.path.join(color_dir, filename))
+        if color_image is None:
+            continue
+        color_msg = bridge.cv2_to_imgmsg(color_image, encoding="bgr8")
+        depth_msg = None
+        if depth_dir:
+            depth_path = os.path.join(depth_dir, os.path.splitext(filename)[0] + ".png")
+            depth_image = cv2.imread(depth_path, cv2.IMREAD_UNCHANGED)
+            if depth_image is not None:
+                depth_msg = bridge.cv2_to_imgmsg(depth_image, encoding="passthrough")
+        frames.append((color_msg, depth_msg))
+        if len(frames) >= max_frames:
+            break
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tj2_yolo offline on recorded frames")
+    parser.add_argument("--model", required=True, help="model path")
+    parser.add_argument("--bag", default="", help="bag with color, depth, and camera info topics")
+    parser.add_argument("--color-topic", default="/camera/color/image_raw")
+    parser.add_argument("--depth-topic", default="/camera/aligned_depth_to_color/image_raw")
+    parser.add_argument("--info-topic", default="/camera/color/camera_info")
+    parser.add_argument("--images", default="", help="directory of color images (instead of a bag)")
+    parser.add_argument("--depth-images", default="", help="directory of depth PNGs named like the color images")
+    parser.add_argument("--fx", type=float, default=0.0, help="focal length for image directories. Default: image width")
+    parser.add_argument("--fy", type=float, default=0.0)
+    parser.add_argument("--cx", type=float, default=0.0, help="principal point for image directories. Default: center")
+    parser.add_argument("--cy", type=float, default=0.0)
+    parser.add_argument("--camera-frame", default="camera_color_optical_frame")
+    parser.add_argument("--max-frames", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=5, help="frames to run before timing starts")
+    parser.add_argument("--param", action="append", default=[], type=parse_param,
+                        help="node parameter as name=value (YAML value), e.g. backend=onnxruntime")
+    parser.add_argument("-o", "--output", default="", help="write JSON results to this path instead of stdout")
+    args = parser.parse_args()
+
+    # use wall clock time for rospy.Time.now() without a master
+    rospy.rostime.set_rostime_initialized(True)
+
+    if args.bag:
+        frames, info_msg = load_bag_frames(args.bag, args.color_topic, args.depth_topic, args.info_topic, args.max_frames)
+    elif args.images:
+        frames = load_image_frames(args.images, args.depth_images, args.max_frames)
+        info_msg = None
+    else:
+        parser.error("Provide --bag or --images")
+    if len(frames) == 0:
+        print("No frames found")
+        sys.exit(1)
+
+    width = frames[0][0].width
+    height = frames[0][0].height
+    if info_msg is None:
+        info_msg = make_camera_info(
+            width, height,
+            args.fx or float(width), args.fy or float(width),
+            args.cx or width / 2.0, args.cy or height / 2.0,
+            args.camera_frame
+        )
+
+    params = dict(
+        model_path=args.model,
+        model_device="cpu",
+        image_width_param="image_width",
+        image_height_param="image_height",
+        image_width=width,
+        image_height=height,
+        publish_overlay=False,
+        publish_delayed_image=False,
+        report_loop_times=False,
+        pipeline_mode=False,
+        timing_window=len(frames),
+    )
+    params.update(dict(args.param))
+    node = Tj2Yolo(offline_params=params)
+    node.info_callback(info_msg)
+    set_identity_transform(node.tf_buffer, node.base_frame, node.camera_model.tfFrame())
+
+    def process(frame):
+        color_msg, depth_msg = frame
+        color_msg.header.stamp = rospy.Time.now()
+        node.compute_detections(color_msg, depth_msg)
+
+    _, frames_per_s = replay(process, frames, node.stage_timings, args.warmup)
+    stages = summarize_timings(node.stage_timings)
+    results = {
+        "time": time.time(),
+        "source": args.bag or args.images,
+        "params": params,
+        "frames": len(frames),
+        "image_size": [width, height],
+        "frames_per_s": frames_per_s,
+        "stages": stages,
+    }
+
+    serialized = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(serialized)
+    else:
+        print(serialized)
+
+
+if __name__ == "__main__":
+    main()